@@ -0,0 +1,71 @@
+"""add project_counters table
+
+Revision ID: 1a7d3c5b9e20
+Revises: 4c9e2a7d1f38
+Create Date: 2016-02-08 11:40:17.630942
+
+Counters of the tasks, task runs and results of every project, kept up to
+date by the event listeners. The table is filled with the counters of the
+existing projects.
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1a7d3c5b9e20'
+down_revision = '4c9e2a7d1f38'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'project_counters',
+        sa.Column('project_id', sa.Integer,
+                  sa.ForeignKey('project.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('n_tasks', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('n_completed_tasks', sa.Integer, nullable=False,
+                  server_default='0'),
+        sa.Column('n_task_runs', sa.Integer, nullable=False,
+                  server_default='0'),
+        sa.Column('n_results', sa.Integer, nullable=False,
+                  server_default='0'),
+        sa.Column('n_registered_volunteers', sa.Integer, nullable=False,
+                  server_default='0'),
+        sa.Column('n_anonymous_volunteers', sa.Integer, nullable=False,
+                  server_default='0'),
+        sa.Column('last_activity', sa.Text))
+    op.execute('''
+        INSERT INTO project_counters
+        (project_id, n_tasks, n_completed_tasks, n_task_runs, n_results,
+         n_registered_volunteers, n_anonymous_volunteers, last_activity)
+        SELECT project.id,
+        COALESCE(tasks.n_tasks, 0), COALESCE(tasks.n_completed_tasks, 0),
+        COALESCE(task_runs.n_task_runs, 0), COALESCE(results.n_results, 0),
+        COALESCE(task_runs.n_registered_volunteers, 0),
+        COALESCE(task_runs.n_anonymous_volunteers, 0),
+        task_runs.last_activity
+        FROM project
+        LEFT JOIN
+        (SELECT project_id, COUNT(id) AS n_tasks,
+         SUM(CASE WHEN state='completed' THEN 1 ELSE 0 END)
+            AS n_completed_tasks
+         FROM task GROUP BY project_id) AS tasks
+        ON tasks.project_id=project.id
+        LEFT JOIN
+        (SELECT project_id, COUNT(id) AS n_task_runs,
+         COUNT(DISTINCT CASE WHEN user_ip IS NULL THEN user_id END)
+            AS n_registered_volunteers,
+         COUNT(DISTINCT CASE WHEN user_id IS NULL THEN user_ip END)
+            AS n_anonymous_volunteers,
+         MAX(finish_time) AS last_activity
+         FROM task_run GROUP BY project_id) AS task_runs
+        ON task_runs.project_id=project.id
+        LEFT JOIN
+        (SELECT project_id, COUNT(id) AS n_results FROM result
+         WHERE info IS NOT NULL GROUP BY project_id) AS results
+        ON results.project_id=project.id''')
+
+
+def downgrade():
+    op.drop_table('project_counters')
@@ -0,0 +1,36 @@
+"""add n_task_runs to task
+
+Revision ID: 2dcee6dfae9d
+Revises: 4f12d8650050
+Create Date: 2016-01-12 11:20:41.561842
+
+Keep the number of task runs of every task in the task table, so the
+schedulers do not need to aggregate the task_run table.
+
+A NOT NULL column with a default would rewrite the whole task table, which
+alembic keeps locked until the end of the migration. So only the nullable
+column and its default are added here. The existing tasks, which the
+schedulers skip until then, are counted in batches and the index built
+without blocking writes with:
+
+    python cli.py backfill_n_task_runs
+    python cli.py create_indexes
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2dcee6dfae9d'
+down_revision = '4f12d8650050'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('task', sa.Column('n_task_runs', sa.Integer))
+    # Only for new rows, so the existing ones are not rewritten
+    op.alter_column('task', 'n_task_runs', server_default='0')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS task_project_id_state_n_task_runs_idx')
+    op.drop_column('task', 'n_task_runs')
@@ -0,0 +1,62 @@
+"""add finish_time_ts to task_run
+
+Revision ID: 3b6f4ea5e1c9
+Revises: 5a2b8c0e6b1f
+Create Date: 2016-01-19 16:05:33.412870
+
+Timestamp copy of task_run.finish_time (stored as ISO text), so the stats
+time windows can be resolved with index range scans. A trigger sets it on
+every insert, also for processes not upgraded yet and raw SQL inserts.
+
+Only the nullable column is added here, as alembic holds the lock on
+task_run until the end of the migration. The existing rows, which the time
+windows miss until then, are filled in batches and the indexes built
+without blocking writes with:
+
+    python cli.py backfill_finish_time_ts
+    python cli.py create_indexes
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b6f4ea5e1c9'
+down_revision = '5a2b8c0e6b1f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Dashboard views defined over task_run.finish_time. They are created again
+# by the dashboard jobs with the new definitions.
+DASHBOARD_VIEWS = ['dashboard_week_users', 'dashboard_week_anon',
+                   'dashboard_week_new_task_run',
+                   'dashboard_week_returning_users']
+
+
+def upgrade():
+    op.add_column('task_run', sa.Column('finish_time_ts', sa.DateTime))
+    op.execute('''
+    CREATE OR REPLACE FUNCTION task_run_finish_time_ts() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.finish_time ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}' THEN
+            NEW.finish_time_ts := NEW.finish_time::timestamp;
+        ELSE
+            NEW.finish_time_ts := NULL;
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql''')
+    op.execute('''CREATE TRIGGER task_run_finish_time_ts
+               BEFORE INSERT OR UPDATE OF finish_time ON task_run
+               FOR EACH ROW EXECUTE PROCEDURE task_run_finish_time_ts()''')
+    for view in DASHBOARD_VIEWS:
+        op.execute('DROP MATERIALIZED VIEW IF EXISTS %s' % view)
+
+
+def downgrade():
+    for view in DASHBOARD_VIEWS:
+        op.execute('DROP MATERIALIZED VIEW IF EXISTS %s' % view)
+    op.execute('DROP TRIGGER IF EXISTS task_run_finish_time_ts ON task_run')
+    op.execute('DROP FUNCTION IF EXISTS task_run_finish_time_ts()')
+    op.execute('DROP INDEX IF EXISTS task_run_finish_time_ts_idx')
+    op.execute('DROP INDEX IF EXISTS task_run_project_id_finish_time_ts_idx')
+    op.drop_column('task_run', 'finish_time_ts')
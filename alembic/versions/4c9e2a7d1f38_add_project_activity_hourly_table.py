@@ -0,0 +1,39 @@
+"""add project_activity_hourly table
+
+Revision ID: 4c9e2a7d1f38
+Revises: 3b6f4ea5e1c9
+Create Date: 2016-01-25 10:12:48.205113
+
+Hourly rollup of the answers and completed tasks of every project. The table
+is filled by the update_project_activity job; its first run rolls up the whole
+task_run history.
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4c9e2a7d1f38'
+down_revision = '3b6f4ea5e1c9'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'project_activity_hourly',
+        sa.Column('project_id', sa.Integer,
+                  sa.ForeignKey('project.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('hour', sa.DateTime, primary_key=True),
+        sa.Column('n_anon', sa.Integer, nullable=False, default=0),
+        sa.Column('n_auth', sa.Integer, nullable=False, default=0),
+        sa.Column('n_completed_tasks', sa.Integer, nullable=False, default=0))
+    op.create_index('project_activity_hourly_hour_idx',
+                    'project_activity_hourly', ['hour'])
+    # Created again by the dashboard job reading from the rollup
+    op.execute('DROP MATERIALIZED VIEW IF EXISTS dashboard_week_new_task_run')
+
+
+def downgrade():
+    op.execute('DROP MATERIALIZED VIEW IF EXISTS dashboard_week_new_task_run')
+    op.drop_index('project_activity_hourly_hour_idx')
+    op.drop_table('project_activity_hourly')
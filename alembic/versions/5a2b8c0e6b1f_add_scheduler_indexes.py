@@ -0,0 +1,36 @@
+"""add scheduler indexes
+
+Revision ID: 5a2b8c0e6b1f
+Revises: 2dcee6dfae9d
+Create Date: 2016-01-14 09:42:17.203311
+
+Indexes for the queries of the schedulers, the available tasks counters
+and the results of a project.
+
+A plain CREATE INDEX would block every insert into task and task_run while
+it is built, and alembic runs the migrations in a transaction, where
+CREATE INDEX CONCURRENTLY isn't allowed. So the indexes, declared in the
+models, are built after the upgrade with:
+
+    python cli.py create_indexes
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a2b8c0e6b1f'
+down_revision = '2dcee6dfae9d'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Built concurrently by cli.py create_indexes
+    pass
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS result_project_id_task_id_idx')
+    op.execute('DROP INDEX IF EXISTS task_run_task_id_idx')
+    op.execute('DROP INDEX IF EXISTS task_run_project_id_user_ip_task_id_idx')
+    op.execute('DROP INDEX IF EXISTS task_run_project_id_user_id_task_id_idx')
+    op.execute('DROP INDEX IF EXISTS task_project_id_priority_0_id_open_idx')
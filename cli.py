@@ -566,6 +566,209 @@ def create_results():
         db.session.commit()
         print "Project %s completed!" % project.short_name
 
+def benchmark_cache_codecs(n_projects='5'):
+    """Compare cache codecs on the values of the biggest projects."""
+    import pybossa.cache.projects as cached_projects
+    import pybossa.cache.project_stats as stats
+    from pybossa.cache.codecs import benchmark
+
+    def report(name, value):
+        results = benchmark(value)
+        legacy = float(results['legacy']['size'])
+        for codec, result in sorted(results.items()):
+            print "%-40s %-8s %10d bytes %6.1f%% %8.3f ms %8.3f ms" % (
+                name, codec, result['size'], result['size'] * 100 / legacy,
+                result['encode'], result['decode'])
+
+    with app.app_context():
+        print "%-40s %-8s %16s %7s %11s %11s" % (
+            'value', 'codec', 'size', 'legacy', 'encode', 'decode')
+        sql = text('''SELECT project_id FROM task GROUP BY project_id
+                   ORDER BY COUNT(id) DESC LIMIT :limit''')
+        for row in db.session.execute(sql, dict(limit=int(n_projects))):
+            project_id = row.project_id
+            report('browse_tasks(%s)' % project_id,
+                   cached_projects.browse_tasks(project_id))
+            report('get_stats(%s)' % project_id, stats.get_stats(project_id))
+        for category in Category.query.all():
+            report('get_all(%s)' % category.short_name,
+                   cached_projects.get_all(category.short_name))
+
+
+def backfill_volunteer_counter():
+    """Add the volunteers of every task run to the HyperLogLogs."""
+    from pybossa.core import sentinel
+    from pybossa.volunteer_counter import VolunteerCounter
+    with app.app_context():
+        n_rows = VolunteerCounter(sentinel.master).backfill(db.session)
+        print "%s volunteers per project and recent day added" % n_rows
+
+
+def rebuild_leaderboard():
+    """Compute the leaderboards in Redis from the task runs."""
+    from pybossa.core import sentinel
+    from pybossa.leaderboard import Leaderboard
+    with app.app_context():
+        n_projects = Leaderboard(sentinel.master).rebuild(db.session)
+        print "Leaderboards of %s projects rebuilt" % n_projects
+
+
+def benchmark_task_run_submit(short_name, n_task_runs='100'):
+    """Time the flush of anonymous task runs for a task of a project.
+
+    Everything is rolled back. The task needs one more answer than the task
+    runs added, so it is never completed and no webhook is pushed.
+    """
+    import time
+    from pybossa.model.task import Task
+    from pybossa.model.task_run import TaskRun
+    from pybossa.task_pool import get_task_pool
+    n_task_runs = int(n_task_runs)
+    with app.app_context():
+        project = Project.query.filter_by(short_name=short_name).first()
+        if project is None:
+            print "Project %s not found" % short_name
+            return
+        try:
+            task = Task(project_id=project.id, n_answers=n_task_runs + 1)
+            db.session.add(task)
+            db.session.flush()
+            timings = []
+            for i in range(n_task_runs):
+                task_run = TaskRun(project_id=project.id, task_id=task.id,
+                                   user_ip='10.0.%s.%s' % (i / 256, i % 256))
+                db.session.add(task_run)
+                start = time.time()
+                db.session.flush()
+                timings.append((time.time() - start) * 1000)
+        finally:
+            db.session.rollback()
+            pool = get_task_pool()
+            if pool is not None:
+                pool.invalidate(project.id)
+        timings.sort()
+        print "%s task runs: mean %.3f ms, p50 %.3f ms, p95 %.3f ms" % (
+            n_task_runs, sum(timings) / len(timings),
+            timings[len(timings) / 2], timings[int(len(timings) * 0.95)])
+
+
+def benchmark_rate_limiter(n_requests='1000'):
+    """Time the rate limit check of a request with each limiter engine.
+
+    Each engine limits a client of its own to half the requests, so the
+    checks of clients over their limit are timed too.
+    """
+    import time
+    from pybossa.core import sentinel
+    from pybossa.ratelimit import ENGINES, RateLimit, get_engine, local_blocks
+    n_requests = int(n_requests)
+    limit = max(n_requests / 2, 1)
+
+    def report(name, engine, local_check):
+        key = 'rate-limit/benchmark/%s/%s/' % (name, local_check)
+        app.config['RATE_LIMIT_LOCAL_CHECK'] = local_check
+        timings = []
+        for i in range(n_requests):
+            start = time.time()
+            RateLimit(key, limit, 60, True, engine=engine)
+            timings.append((time.time() - start) * 1000)
+        for redis_key in sentinel.master.keys(key + '*'):
+            sentinel.master.delete(redis_key)
+        local_blocks.clear()
+        timings.sort()
+        print "%-15s %-11s mean %.3f ms, p50 %.3f ms, p95 %.3f ms" % (
+            name, 'local check' if local_check else '',
+            sum(timings) / len(timings), timings[len(timings) / 2],
+            timings[int(len(timings) * 0.95)])
+
+    local_check = app.config.get('RATE_LIMIT_LOCAL_CHECK')
+    with app.test_request_context():
+        try:
+            for name in sorted(ENGINES):
+                report(name, get_engine(name), False)
+                report(name, get_engine(name), True)
+        finally:
+            app.config['RATE_LIMIT_LOCAL_CHECK'] = local_check
+
+
+def delete_legacy_cache_keys():
+    """Delete the cache keys written before they were versioned."""
+    from pybossa.cache import delete_legacy_keys
+    with app.app_context():
+        print "%s legacy cache keys deleted" % delete_legacy_keys()
+
+
+def backfill_finish_time_ts(batch_size='10000'):
+    """Fill task_run.finish_time_ts of the rows older than its migration.
+
+    Each batch is committed on its own, so task_run is never locked for
+    long.
+    """
+    batch_size = int(batch_size)
+    sql = text('''UPDATE task_run SET finish_time_ts=finish_time::timestamp
+               WHERE id >= :start AND id < :end
+               AND finish_time_ts IS NULL AND finish_time IS NOT NULL''')
+    with app.app_context():
+        max_id = db.session.scalar('SELECT MAX(id) FROM task_run') or 0
+        n_rows = 0
+        for start in range(0, max_id + 1, batch_size):
+            n_rows += db.session.execute(
+                sql, dict(start=start, end=start + batch_size)).rowcount
+            db.session.commit()
+        print "finish_time_ts of %s task runs filled" % n_rows
+
+
+def backfill_n_task_runs(batch_size='10000'):
+    """Count the task runs of the tasks older than task.n_task_runs.
+
+    Each batch is committed on its own, so task is never locked for long.
+    """
+    batch_size = int(batch_size)
+    sql = text('''UPDATE task SET n_task_runs=(SELECT COUNT(id)
+               FROM task_run WHERE task_run.task_id=task.id)
+               WHERE id >= :start AND id < :end AND n_task_runs IS NULL''')
+    with app.app_context():
+        max_id = db.session.scalar('SELECT MAX(id) FROM task') or 0
+        n_rows = 0
+        for start in range(0, max_id + 1, batch_size):
+            n_rows += db.session.execute(
+                sql, dict(start=start, end=start + batch_size)).rowcount
+            db.session.commit()
+        print "n_task_runs of %s tasks filled" % n_rows
+
+
+def create_indexes():
+    """Build the indexes of the models missing in the DB without locking.
+
+    The migrations adding indexes to big tables leave them to this command,
+    as CREATE INDEX CONCURRENTLY can't run in their transaction. Indexes
+    left invalid by an interrupted build are built again.
+    """
+    import re
+    from sqlalchemy.schema import CreateIndex
+    sql = text('''SELECT pg_index.indisvalid FROM pg_index
+               JOIN pg_class ON pg_class.oid=pg_index.indexrelid
+               WHERE pg_class.relname=:name''')
+    with app.app_context():
+        conn = db.engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT')
+        try:
+            for table in db.metadata.sorted_tables:
+                for index in sorted(table.indexes, key=lambda i: i.name):
+                    valid = conn.scalar(sql, name=index.name)
+                    if valid:
+                        continue
+                    if valid is not None:
+                        conn.execute('DROP INDEX CONCURRENTLY %s'
+                                     % index.name)
+                    ddl = CreateIndex(index).compile(dialect=conn.dialect)
+                    conn.execute(re.sub('INDEX ', 'INDEX CONCURRENTLY ',
+                                        str(ddl), count=1))
+                    print "Index %s built" % index.name
+        finally:
+            conn.close()
+
+
 ## ==================================================
 ## Misc stuff for setting up a command line interface
 
@@ -0,0 +1,101 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Hourly rollup of the activity of the projects.
+
+The project_activity_hourly table keeps, per project and hour, the answers
+submitted by anonymous and authenticated users and the tasks completed. It is
+extended from a watermark, the hour before the last one rolled up, by the
+update_project_activity job. Hours from the watermark on are recomputed every
+time, so task runs committed late are not lost.
+
+Readers take the rolled up hours before the watermark and aggregate the task
+runs after it on the fly, so results are exact even if the job lags behind.
+"""
+from sqlalchemy.sql import text
+# Registers the table with the rest of the models
+from pybossa.model.project_activity_hourly import ProjectActivityHourly
+
+
+# NULL while nothing has been rolled up yet
+WATERMARK_SQL = '''(SELECT MAX(hour) - INTERVAL '1 hour'
+                    FROM project_activity_hourly)'''
+
+# Activity per project and hour of the task runs finished since %(since)s
+ACTIVITY_SQL = '''
+    SELECT project_id, hour, SUM(n_anon) AS n_anon, SUM(n_auth) AS n_auth,
+    SUM(n_completed_tasks) AS n_completed_tasks FROM
+    (SELECT project_id, date_trunc('hour', finish_time_ts) AS hour,
+     SUM(CASE WHEN user_id IS NULL THEN 1 ELSE 0 END) AS n_anon,
+     SUM(CASE WHEN user_ip IS NULL THEN 1 ELSE 0 END) AS n_auth,
+     0 AS n_completed_tasks
+     FROM task_run WHERE finish_time_ts >= %(since)s %(filters)s
+     GROUP BY project_id, hour
+     UNION ALL
+     SELECT project_id, date_trunc('hour', last_task_run) AS hour,
+     0 AS n_anon, 0 AS n_auth, COUNT(id) AS n_completed_tasks FROM
+     (SELECT task.id, task.project_id,
+      MAX(task_run.finish_time_ts) AS last_task_run
+      FROM task JOIN task_run ON task_run.task_id=task.id
+      WHERE task.state='completed' AND task.id IN
+      (SELECT task_id FROM task_run
+       WHERE finish_time_ts >= %(since)s %(filters)s)
+      GROUP BY task.id, task.project_id) AS completed_tasks
+     WHERE last_task_run >= %(since)s
+     GROUP BY project_id, hour) AS activity
+    GROUP BY project_id, hour'''
+
+
+def update_project_activity(session):
+    """Roll up the task runs finished since the watermark."""
+    # Read once, the delete below moves it back
+    watermark = session.execute(text('SELECT %s' % WATERMARK_SQL)).scalar()
+    since = "COALESCE(:watermark, '-infinity'::timestamp)"
+    session.execute(text('DELETE FROM project_activity_hourly WHERE hour >= %s'
+                         % since), dict(watermark=watermark))
+    sql = text('''INSERT INTO project_activity_hourly
+               (project_id, hour, n_anon, n_auth, n_completed_tasks) %s'''
+               % (ACTIVITY_SQL % dict(since=since, filters='')))
+    session.execute(sql, dict(watermark=watermark))
+    session.commit()
+
+
+def project_activity_sql(project_id=None):
+    """Return the SQL of the activity per project and hour within :period.
+
+    Rows are (project_id, hour, n_anon, n_auth, n_completed_tasks). A NULL
+    :period means the whole history; with project_id the query is filtered by
+    :project_id.
+    """
+    start = "COALESCE(NOW() - :period ::INTERVAL, '-infinity')"
+    filters = 'AND project_id=:project_id' if project_id else ''
+    # GREATEST ignores the watermark while it is NULL
+    since = 'GREATEST(%s, %s)' % (start, WATERMARK_SQL)
+    live = ACTIVITY_SQL % dict(since=since, filters=filters)
+    return '''SELECT project_id, hour, n_anon, n_auth, n_completed_tasks
+           FROM project_activity_hourly
+           WHERE hour >= date_trunc('hour', %s) AND hour < %s %s
+           UNION ALL %s''' % (start, WATERMARK_SQL, filters, live)
+
+
+def project_activity(session, period=None, project_id=None):
+    """Return the activity per project and hour within period."""
+    sql = text(project_activity_sql(project_id))
+    results = session.execute(sql, dict(period=period, project_id=project_id))
+    return [(row.project_id, row.hour, row.n_anon, row.n_auth,
+             row.n_completed_tasks) for row in results]
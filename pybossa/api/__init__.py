@@ -22,7 +22,7 @@ This package adds GET, POST, PUT and DELETE methods for:
     * projects,
     * categories,
     * tasks,
-    * task_runs,
+    * task_runs (also in bulk),
     * users,
     * global_stats,
     * vmcp
@@ -59,6 +59,9 @@ cors_headers = ['Content-Type', 'Authorization']
 
 error = ErrorStatus()
 
+# Maximum number of tasks returned by a single newtask request
+NEWTASK_MAX_LIMIT = 20
+
 
 @blueprint.route('/')
 @crossdomain(origin='*', headers=cors_headers)
@@ -100,15 +103,36 @@ register_api(VmcpAPI, 'api_vmcp', '/vmcp', pk='oid', pk_type='int')
 register_api(TokenAPI, 'api_token', '/token', pk='token', pk_type='string')
 
 
+@jsonpify
+@blueprint.route('/taskrun/bulk', methods=['POST'])
+@crossdomain(origin='*', headers=cors_headers)
+@ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
+def bulk_taskrun():
+    """Create a list of task runs, returning a status for each of them."""
+    try:
+        statuses = TaskRunAPI().post_bulk(json.loads(request.data))
+        return Response(json.dumps(statuses), mimetype="application/json")
+    except Exception as e:
+        return error.format_exception(e, target='taskrun', action='POST')
+
+csrf.exempt(bulk_taskrun)
+
+
 @jsonpify
 @blueprint.route('/app/<project_id>/newtask')
 @blueprint.route('/project/<project_id>/newtask')
 @crossdomain(origin='*', headers=cors_headers)
 @ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
 def new_task(project_id):
-    """Return a new task for a project."""
+    """Return a new task for a project.
+
+    If the limit argument is given, a list with up to limit tasks (with a
+    maximum of NEWTASK_MAX_LIMIT) is returned instead.
+    """
     # Check if the request has an arg:
     try:
+        if request.args.get('limit'):
+            return _new_tasks_response(project_id)
         task = _retrieve_new_task(project_id)
         # If there is a task for the user, return it
         if task is not None:
@@ -122,7 +146,23 @@ def new_task(project_id):
         return error.format_exception(e, target='project', action='GET')
 
 
+def _new_tasks_response(project_id):
+    limit = min(NEWTASK_MAX_LIMIT, max(1, int(request.args.get('limit'))))
+    tasks = _retrieve_new_tasks(project_id, limit)
+    guard = ContributionsGuard(sentinel.master)
+    guard.stamp_many([task for task in tasks if task.id is not None],
+                     get_user_id_or_ip())
+    response = make_response(json.dumps([task.dictize() for task in tasks]))
+    response.mimetype = "application/json"
+    return response
+
+
 def _retrieve_new_task(project_id):
+    tasks = _retrieve_new_tasks(project_id)
+    return tasks[0] if tasks else None
+
+
+def _retrieve_new_tasks(project_id, limit=1):
     project = project_repo.get(project_id)
     if project is None:
         raise NotFound
@@ -130,18 +170,19 @@ def _retrieve_new_task(project_id):
         info = dict(
             error="This project does not allow anonymous contributors")
         error = model.task.Task(info=info)
-        return error
+        return [error]
     if request.args.get('offset'):
         offset = int(request.args.get('offset'))
     else:
         offset = 0
     user_id = None if current_user.is_anonymous() else current_user.id
     user_ip = request.remote_addr if current_user.is_anonymous() else None
-    task = sched.new_task(project_id, project.info.get('sched'),
-                          user_id,
-                          user_ip,
-                          offset)
-    return task
+    tasks = sched.new_tasks(project_id, project.info.get('sched'),
+                            user_id,
+                            user_ip,
+                            offset,
+                            limit)
+    return tasks
 
 
 @jsonpify
@@ -27,7 +27,7 @@ This package adds GET, POST, PUT and DELETE methods for any class:
 
 """
 import json
-from flask import request, abort, Response
+from flask import request, abort, Response, stream_with_context
 from flask.views import MethodView
 from werkzeug.exceptions import NotFound, Unauthorized, Forbidden
 from pybossa.util import jsonpify, crossdomain
@@ -67,6 +67,9 @@ class APIBase(MethodView):
 
     hateoas = Hateoas()
 
+    # Rows read per query when streaming
+    stream_batch_size = 1000
+
     def valid_args(self):
         """Check if the domain object args are valid."""
         for k in request.args.keys():
@@ -94,6 +97,8 @@ class APIBase(MethodView):
         """
         try:
             ensure_authorized_to('read', self.__class__)
+            if oid is None and request.args.get('stream') == 'ndjson':
+                return self._stream_response()
             query = self._db_query(oid)
             json_response = self._create_json_response(query, oid)
             return Response(json_response, mimetype='application/json')
@@ -146,15 +151,9 @@ class APIBase(MethodView):
         return results
 
     def _filter_query(self, repo_info, limit, offset):
-        filters = {}
-        for k in request.args.keys():
-            if k not in ['limit', 'offset', 'api_key', 'last_id']:
-                # Raise an error if the k arg is not a column
-                getattr(self.__class__, k)
-                filters[k] = request.args[k]
         repo = repo_info['repo']
         query_func = repo_info['filter']
-        filters = self._custom_filter(filters)
+        filters = self._custom_filter(self._get_filters())
         last_id = request.args.get('last_id')
         if last_id:
             results = getattr(repo, query_func)(limit=limit, last_id=last_id,
@@ -164,6 +163,58 @@ class APIBase(MethodView):
                                                 **filters)
         return results
 
+    def _get_filters(self):
+        filters = {}
+        for k in request.args.keys():
+            if k not in ['limit', 'offset', 'api_key', 'last_id', 'stream',
+                         'cursor']:
+                # Raise an error if the k arg is not a column
+                getattr(self.__class__, k)
+                filters[k] = request.args[k]
+        return filters
+
+    def _stream_response(self):
+        """Return the items matching the filters as newline delimited JSON.
+
+        The items are read by id in batches, starting after the cursor
+        argument, and sent without links as they are read, so a whole table
+        can be exported in a single request. Without a limit every item is
+        sent. The last line holds the cursor to resume from, or null once
+        there are no more items.
+        """
+        repo_info = repos[self.__class__.__name__]
+        query_func = getattr(repo_info['repo'], repo_info['filter'])
+        filters = self._custom_filter(self._get_filters())
+        limit = request.args.get('limit')
+        limit = int(limit) if limit else None
+        cursor = request.args.get('cursor') or request.args.get('last_id')
+        cursor = int(cursor) if cursor else None
+
+        def generate(cursor):
+            n_read = 0
+            while limit is None or n_read < limit:
+                size = self.stream_batch_size
+                if limit is not None:
+                    size = min(size, limit - n_read)
+                items = query_func(limit=size, last_id=cursor, **filters)
+                for item in items:
+                    cursor = item.id
+                    try:
+                        ensure_authorized_to('read', item)
+                    except (Forbidden, Unauthorized):
+                        continue
+                    yield json.dumps(self._select_attributes(item.dictize()))
+                    yield '\n'
+                n_read += len(items)
+                if len(items) < size:
+                    cursor = None
+                    break
+            cursor = str(cursor) if cursor is not None else None
+            yield json.dumps(dict(cursor=cursor)) + '\n'
+
+        return Response(stream_with_context(generate(cursor)),
+                        mimetype='application/x-ndjson')
+
     def _set_limit_and_offset(self):
         try:
             limit = min(100, int(request.args.get('limit')))
@@ -21,17 +21,24 @@ PyBossa api module for exposing domain object TaskRun via an API.
 This package adds GET, POST, PUT and DELETE methods for:
     * task_runs
 
+and a bulk POST of many task_runs.
+
 """
 import json
 from flask import request, abort
 from flask.ext.login import current_user
 from pybossa.model.task_run import TaskRun
-from werkzeug.exceptions import Forbidden, BadRequest
+from werkzeug.exceptions import Forbidden, BadRequest, Unauthorized
 
-from api_base import APIBase
+from api_base import APIBase, error
 from pybossa.util import get_user_id_or_ip
 from pybossa.core import task_repo, project_repo, result_repo, sentinel
 from pybossa.contributions_guard import ContributionsGuard
+from pybossa.auth.taskrun import can_contribute
+from pybossa.exc import DBIntegrityError
+
+# Maximum number of task runs posted in a single bulk request
+BULK_MAX_SIZE = 100
 
 
 class TaskRunAPI(APIBase):
@@ -39,7 +46,7 @@ class TaskRunAPI(APIBase):
     """Class API for domain object TaskRun."""
 
     __class__ = TaskRun
-    reserved_keys = set(['id', 'created', 'finish_time'])
+    reserved_keys = set(['id', 'created', 'finish_time', 'finish_time_ts'])
 
     def post(self):
         try:
@@ -51,9 +58,84 @@ class TaskRunAPI(APIBase):
             return super(TaskRunAPI, self).post()
         return super(TaskRunAPI, self).post()
 
+    def post_bulk(self, data):
+        """Create many task runs of the current user in one transaction.
+
+        Guards and authorization are checked for the whole list at once.
+        Return a status per item, in the order they were posted.
+        """
+        if not isinstance(data, list) or not 0 < len(data) <= BULK_MAX_SIZE:
+            raise BadRequest('A list of 1 to %s task runs is required'
+                             % BULK_MAX_SIZE)
+        statuses = [None] * len(data)
+        taskruns = {}
+        for i, item in enumerate(data):
+            try:
+                if not isinstance(item, dict):
+                    raise BadRequest('Every task run must be an object')
+                self._forbidden_attributes(item)
+                taskrun = TaskRun(**self.hateoas.remove_links(item))
+                self._add_user_info(taskrun)
+                taskruns[i] = taskrun
+            except Exception as e:
+                statuses[i] = self._failed(e)
+        # Locked, so the answers found below can't change until the commit
+        tasks = dict((task.id, task) for task in task_repo.get_tasks(
+            list(set(tr.task_id for tr in taskruns.values())),
+            for_update=True))
+        projects = dict((project_id, project_repo.get(project_id))
+                        for project_id in set(task.project_id
+                                              for task in tasks.values()))
+        user = get_user_id_or_ip()
+        contributed = task_repo.get_contributed_task_ids(
+            tasks.keys(), user_id=user['user_id'], user_ip=user['user_ip'])
+        requested = tasks.values()
+        guard = ContributionsGuard(sentinel.master)
+        stamps = dict(zip([task.id for task in requested],
+                          guard.retrieve_timestamps(requested, user)))
+        valid = []
+        for i, taskrun in sorted(taskruns.items()):
+            try:
+                task = tasks.get(taskrun.task_id)
+                self._validate_project_and_task(taskrun, task)
+                if not projects[task.project_id].published:
+                    # As for single posts, accepted but not stored
+                    statuses[i] = dict(status='OK')
+                    continue
+                self._ensure_can_create(projects[task.project_id], task,
+                                        contributed)
+                if stamps[task.id] is None:
+                    raise Forbidden('You must request a task first!')
+                taskrun.created = stamps[task.id]
+                # Only one answer per task, also within the same request
+                contributed.add(task.id)
+                valid.append((i, taskrun))
+            except Exception as e:
+                statuses[i] = self._failed(e)
+        try:
+            task_repo.save_many([taskrun for i, taskrun in valid])
+        except DBIntegrityError as e:
+            # Nothing was stored, so every valid item failed with the same
+            # error
+            for i, taskrun in valid:
+                statuses[i] = self._failed(e)
+            return statuses
+        for i, taskrun in valid:
+            statuses[i] = dict(status='OK', id=taskrun.id)
+        return statuses
+
+    def _ensure_can_create(self, project, task, contributed):
+        if not can_contribute(current_user, project, task.id in contributed):
+            raise Unauthorized('Anonymous contributors are not allowed')
+
+    def _failed(self, e):
+        return error.format_status(e, target='taskrun', action='POST')
+
     def _update_object(self, taskrun):
         """Update task_run object with user id or ip."""
-        task = task_repo.get_task(taskrun.task_id)
+        # Locked until the commit, so concurrent posts of the same user are
+        # checked for repeated answers one after the other
+        task = task_repo.get_task(taskrun.task_id, for_update=True)
         guard = ContributionsGuard(sentinel.master)
 
         self._validate_project_and_task(taskrun, task)
@@ -0,0 +1,57 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class ApiKeyUser(object):
+
+    """User authenticated with an API key, for API requests.
+
+    The id, name and admin flag come from the cached API key lookup (see
+    pybossa.cache.users.get_api_key_user), which is all most API calls need.
+    Any other attribute loads the User from the database the first time.
+    """
+
+    def __init__(self, id, name, admin):
+        self.id = id
+        self.name = name
+        self.admin = admin
+        self._user = None
+
+    def is_authenticated(self):
+        return True
+
+    def is_anonymous(self):
+        return False
+
+    def is_active(self):
+        return True
+
+    def get_id(self):
+        return self.name
+
+    @property
+    def user(self):
+        """Return the User, loading it on first use."""
+        if self._user is None:
+            from pybossa.core import user_repo
+            self._user = user_repo.get(self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        # Only called for the attributes not set above
+        return getattr(self.user, name)
@@ -19,6 +19,19 @@
 from flask import abort
 
 
+def can_contribute(user, project, answered):
+    """Check the rules shared by single and bulk task run posts.
+
+    Return False for anonymous users of a project closed to them, and abort
+    with 403 if the user already answered the task.
+    """
+    if (user.is_anonymous() and
+            project.allow_anonymous_contributors is False):
+        return False
+    if answered:
+        raise abort(403)
+    return True
+
 class TaskRunAuth(object):
     _specific_actions = []
 
@@ -39,17 +52,12 @@ class TaskRunAuth(object):
         project = self.project_repo.get(taskrun.project_id)
         if not project.published:
             raise abort(403)
-        if (user.is_anonymous() and
-                project.allow_anonymous_contributors is False):
-            return False
-        authorized = self.task_repo.count_task_runs_with(
+        answered = self.task_repo.count_task_runs_with(
             project_id=taskrun.project_id,
             task_id=taskrun.task_id,
             user_id=taskrun.user_id,
-            user_ip=taskrun.user_ip) <= 0
-        if not authorized:
-            raise abort(403)
-        return authorized
+            user_ip=taskrun.user_ip) > 0
+        return can_contribute(user, project, answered)
 
     def _read(self, user, taskrun=None):
         return True
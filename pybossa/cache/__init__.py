@@ -24,12 +24,50 @@ It exports:
     * memoize: for caching functions using its arguments as part of the key
     * delete_cached: to remove a cached value
     * delete_memoized: to remove a cached value from the memoize decorator
+    * sweep_tags: to drop expired keys from the memoize tag sets
+    * delete_legacy_keys: to drop the keys written by earlier versions
+    * get_memoized_many: to read many memoized calls at once
+    * delete_memoized_many: to remove many memoized values at once
+    * limit_memoized: to bound the time memoized values are still served
+
+Values are stored in Redis. If LOCAL_CACHE_MAX_ENTRIES is set, a small in
+process LRU cache (see pybossa.cache.local) is kept in front of Redis, where
+values live for local_timeout seconds (LOCAL_CACHE_TIMEOUT by default).
+
+Keys are namespaced by the version of the storage format (KEY_PREFIX), so
+processes of different versions never share entries during a deploy.
+
+Every key written by memoize is added to the tag set of its function, so all
+the values of a function can be deleted without scanning the keyspace.
+
+To avoid many requests recomputing the same expired value at once, the
+decorators accept:
+    * stale_timeout: seconds an expired value is still served while a single
+      caller recomputes it
+    * single_flight: on a miss, only one caller computes the value while the
+      others wait up to LOCK_WAIT seconds for it
+    * early_recompute: factor of the probabilistic recomputation of values
+      before they expire, weighted by the time they took to compute
+
+Values are serialized with the codec given to the decorator (CACHE_CODEC by
+default) and compressed above CACHE_COMPRESS_THRESHOLD bytes, see
+pybossa.cache.codecs.
 
 """
 import os
+import math
+import time
+import uuid
+import random
 import hashlib
+from collections import OrderedDict
 from functools import wraps
+from redis.exceptions import ResponseError
 from pybossa.core import sentinel
+from pybossa.cache.local import LocalCache, InvalidationListener
+from pybossa.cache.codecs import (CacheEntry, UnknownFormatError,
+                                  COMPRESS_THRESHOLD, VERSION, encode,
+                                  decode, get_codec, is_encoded)
 
 try:
     import cPickle as pickle
@@ -47,6 +85,34 @@ ONE_HOUR = 60 * 60
 HALF_HOUR = 30 * 60
 FIVE_MINUTES = 5 * 60
 
+LOCAL_CACHE_TIMEOUT = getattr(settings, 'LOCAL_CACHE_TIMEOUT', 5)
+# Processes storing different formats never read each other's keys
+KEY_PREFIX = '%s:v%s' % (settings.REDIS_KEYPREFIX, VERSION)
+INVALIDATION_CHANNEL = '%s:invalidation' % KEY_PREFIX
+TAGS_KEY = '%s:tags' % KEY_PREFIX
+TAG_BATCH_SIZE = 1000
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 2
+LOCK_POLL_INTERVAL = 0.05
+CACHE_CODEC = getattr(settings, 'CACHE_CODEC', 'pickle')
+CACHE_COMPRESS_THRESHOLD = getattr(settings, 'CACHE_COMPRESS_THRESHOLD',
+                                   COMPRESS_THRESHOLD)
+
+
+def _create_local_cache():
+    max_entries = getattr(settings, 'LOCAL_CACHE_MAX_ENTRIES', 0)
+    if not max_entries:
+        return None
+    max_bytes = getattr(settings, 'LOCAL_CACHE_MAX_BYTES', 10 * 1024 * 1024)
+    return LocalCache(max_entries, max_bytes)
+
+
+local_cache = _create_local_cache()
+invalidation_listener = None
+if local_cache is not None:
+    invalidation_listener = InvalidationListener(local_cache,
+                                                 INVALIDATION_CHANNEL)
+
 
 def get_key_to_hash(*args, **kwargs):
     """Return key to hash for *args and **kwargs."""
@@ -67,62 +133,288 @@ def get_hash_key(prefix, key_to_hash):
     return key
 
 
-def cache(key_prefix, timeout=300):
+def get_tag_key(function_name):
+    """Return the key of the set with the keys memoized for a function."""
+    return "%s:tag:%s" % (KEY_PREFIX, function_name)
+
+
+def _local_cache(local_timeout):
+    if local_cache is None or not local_timeout:
+        return None
+    invalidation_listener.ensure_started(sentinel.master)
+    return local_cache
+
+
+def _store(key, data, timeout, tag=None):
+    pipe = sentinel.master.pipeline()
+    _queue_store(pipe, key, data, timeout, tag)
+    pipe.execute()
+
+
+def _queue_store(pipe, key, data, timeout, tag=None):
+    pipe.setex(key, timeout, data)
+    if tag:
+        # The set outlives the keys added to it, as they share the timeout
+        pipe.sadd(tag, key)
+        pipe.expire(tag, timeout)
+        pipe.sadd(TAGS_KEY, tag)
+
+
+class _Policy(object):
+
+    def __init__(self, timeout, local_timeout, stale_timeout=0,
+                 single_flight=False, early_recompute=0, codec=None):
+        self.timeout = 300 if timeout is None else timeout
+        self.local_timeout = LOCAL_CACHE_TIMEOUT if local_timeout is None \
+            else local_timeout
+        self.stale_timeout = stale_timeout
+        self.single_flight = single_flight
+        self.early_recompute = early_recompute
+        self.codec = get_codec(codec or CACHE_CODEC)
+
+    def needs_refresh(self, entry):
+        if entry.expires is None:
+            return False
+        now = time.time()
+        if self.early_recompute:
+            # 1 - random() is never 0
+            now -= (entry.delta * self.early_recompute *
+                    math.log(1 - random.random()))
+        return now >= entry.expires
+
+
+def _load(data):
+    """Return the CacheEntry in data, or None if it can't be read."""
+    if is_encoded(data):
+        try:
+            return decode(data)
+        except UnknownFormatError:
+            # Written by a newer version, recomputed as a miss
+            return None
+    entry = pickle.loads(data)
+    if isinstance(entry, CacheEntry):
+        return entry
+    # Values stored before entries were introduced
+    return CacheEntry(entry, None, 0)
+
+
+def _lock_key(key):
+    return key + ':lock'
+
+
+def _acquire(key):
+    return bool(sentinel.master.set(_lock_key(key), 1, nx=True,
+                                    ex=LOCK_TIMEOUT))
+
+
+def _wait_for(key):
+    deadline = time.time() + LOCK_WAIT
+    while time.time() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        data = sentinel.master.get(key)
+        if data:
+            return data
+    return None
+
+
+def _encode(entry, policy):
+    try:
+        return encode(entry, policy.codec, CACHE_COMPRESS_THRESHOLD)
+    except (TypeError, ValueError):
+        # Values the codec can't represent are pickled
+        return encode(entry, 'pickle', CACHE_COMPRESS_THRESHOLD)
+
+
+def _compute(key, tag, policy, locked, f, *args, **kwargs):
+    try:
+        start = time.time()
+        output = f(*args, **kwargs)
+        now = time.time()
+        data = _encode(CacheEntry(output, now + policy.timeout, now - start),
+                       policy)
+        _store(key, data, policy.timeout + policy.stale_timeout, tag)
+        local = _local_cache(policy.local_timeout)
+        if local:
+            local.set(key, data, policy.local_timeout)
+        return output
+    finally:
+        if locked:
+            sentinel.master.delete(_lock_key(key))
+
+
+def _cached_call(key, tag, policy, f, *args, **kwargs):
+    if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is not None:
+        return _compute(key, tag, policy, False, f, *args, **kwargs)
+    local = _local_cache(policy.local_timeout)
+    data = local.get(key) if local else None
+    if data is None:
+        data = sentinel.slave.get(key)
+        if data and local:
+            local.set(key, data, policy.local_timeout)
+    entry = _load(data) if data else None
+    if entry:
+        # Only one caller refreshes, the rest keep getting the stale value
+        if not policy.needs_refresh(entry) or not _acquire(key):
+            return entry.value
+        return _compute(key, tag, policy, True, f, *args, **kwargs)
+    locked = False
+    if policy.single_flight:
+        locked = _acquire(key)
+        if not locked:
+            data = _wait_for(key)
+            entry = _load(data) if data else None
+            if entry:
+                return entry.value
+    return _compute(key, tag, policy, locked, f, *args, **kwargs)
+
+
+def _publish_invalidation(kind, target):
+    # Published after deleting from Redis, so workers can't reload the value
+    if local_cache is not None:
+        if kind == 'key':
+            local_cache.delete(target)
+        else:
+            local_cache.delete_prefix(target)
+        sentinel.master.publish(INVALIDATION_CHANNEL,
+                                '%s:%s' % (kind, target))
+
+
+def cache(key_prefix, timeout=300, local_timeout=None, stale_timeout=0,
+          single_flight=False, early_recompute=0, codec=None):
     """
     Decorator for caching functions.
 
     Returns the function value from cache, or the function if cache disabled
 
     """
-    if timeout is None:
-        timeout = 300
+    policy = _Policy(timeout, local_timeout, stale_timeout, single_flight,
+                     early_recompute, codec)
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            key = "%s::%s" % (settings.REDIS_KEYPREFIX, key_prefix)
-            if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-                output = sentinel.slave.get(key)
-                if output:
-                    return pickle.loads(output)
-                output = f(*args, **kwargs)
-                sentinel.master.setex(key, timeout, pickle.dumps(output))
-                return output
-            output = f(*args, **kwargs)
-            sentinel.master.setex(key, timeout, pickle.dumps(output))
-            return output
+            key = "%s::%s" % (KEY_PREFIX, key_prefix)
+            return _cached_call(key, None, policy, f, *args, **kwargs)
         return wrapper
     return decorator
 
 
-def memoize(timeout=300):
+def memoize(timeout=300, local_timeout=None, stale_timeout=0,
+            single_flight=False, early_recompute=0, codec=None):
     """
     Decorator for caching functions using its arguments as part of the key.
 
     Returns the cached value, or the function if the cache is disabled
 
     """
-    if timeout is None:
-        timeout = 300
+    policy = _Policy(timeout, local_timeout, stale_timeout, single_flight,
+                     early_recompute, codec)
     def decorator(f):
+        def cache_key(*args, **kwargs):
+            key = "%s:%s_args:" % (KEY_PREFIX, f.__name__)
+            key_to_hash = get_key_to_hash(*args, **kwargs)
+            return get_hash_key(key, key_to_hash)
+
+        def many(compute_many):
+            """Register the function computing many calls for
+            get_memoized_many. It gets a list of args tuples and returns a
+            dict with the value for each of them."""
+            wrapper.compute_many = compute_many
+            return compute_many
+
         @wraps(f)
         def wrapper(*args, **kwargs):
-            key = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, f.__name__)
-            key_to_hash = get_key_to_hash(*args, **kwargs)
-            key = get_hash_key(key, key_to_hash)
-            if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-                output = sentinel.slave.get(key)
-                if output:
-                    return pickle.loads(output)
-                output = f(*args, **kwargs)
-                sentinel.master.setex(key, timeout, pickle.dumps(output))
-                return output
-            output = f(*args, **kwargs)
-            sentinel.master.setex(key, timeout, pickle.dumps(output))
-            return output
+            return _cached_call(cache_key(*args, **kwargs), wrapper.cache_tag,
+                                policy, f, *args, **kwargs)
+        wrapper.uncached = f
+        wrapper.cache_key = cache_key
+        wrapper.cache_tag = get_tag_key(f.__name__)
+        wrapper.cache_policy = policy
+        wrapper.compute_many = None
+        wrapper.many = many
         return wrapper
     return decorator
 
 
+def get_memoized_many(calls):
+    """
+    Return the values of many calls to memoized functions.
+
+    calls is a list of (function, args) tuples. The values are read with a
+    single MGET, and the misses of every function are computed together (by
+    the function registered with its many decorator, or one by one) and
+    stored with a single pipeline.
+
+    """
+    results = [None] * len(calls)
+    keys = [function.cache_key(*args) for function, args in calls]
+    missing = range(len(calls))
+    if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None and calls:
+        missing = []
+        for i, data in enumerate(sentinel.slave.mget(keys)):
+            entry = _load(data) if data else None
+            if entry is None or calls[i][0].cache_policy.needs_refresh(entry):
+                missing.append(i)
+            else:
+                results[i] = entry.value
+    by_function = OrderedDict()
+    for i in missing:
+        by_function.setdefault(calls[i][0], []).append(i)
+    if not by_function:
+        return results
+    pipe = sentinel.master.pipeline()
+    for function, indexes in by_function.items():
+        args_list = [calls[i][1] for i in indexes]
+        start = time.time()
+        if function.compute_many is not None:
+            values = function.compute_many(args_list)
+        else:
+            values = dict((args, function.uncached(*args))
+                          for args in args_list)
+        now = time.time()
+        delta = (now - start) / len(indexes)
+        policy = function.cache_policy
+        for i in indexes:
+            results[i] = values[calls[i][1]]
+            data = _encode(CacheEntry(results[i], now + policy.timeout,
+                                      delta), policy)
+            _queue_store(pipe, keys[i], data,
+                         policy.timeout + policy.stale_timeout,
+                         function.cache_tag)
+    pipe.execute()
+    return results
+
+
+_limit_script = """
+local n = 0
+for i, key in ipairs(KEYS) do
+    if redis.call('TTL', key) > tonumber(ARGV[1]) then
+        redis.call('EXPIRE', key, ARGV[1])
+        n = n + 1
+    end
+end
+return n
+"""
+
+
+def limit_memoized(calls, seconds):
+    """
+    Make the values of many memoized calls expire in seconds at most.
+
+    calls is a list of (function, args) tuples. Unlike deleting them, values
+    that already expire sooner are left alone, so limiting them on every
+    write recomputes them once per interval at most.
+
+    Returns the number of values whose expiration was brought forward
+
+    """
+    if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is not None or \
+            not calls:
+        return 0
+    keys = [function.cache_key(*args) for function, args in calls]
+    limit = sentinel.master.register_script(_limit_script)
+    return limit(keys=keys, args=[seconds])
+
+
 def delete_cached(key):
     """
     Delete a cached value from the cache.
@@ -131,8 +423,10 @@ def delete_cached(key):
 
     """
     if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-        key = "%s::%s" % (settings.REDIS_KEYPREFIX, key)
-        return bool(sentinel.master.delete(key))
+        key = "%s::%s" % (KEY_PREFIX, key)
+        deleted = bool(sentinel.master.delete(key))
+        _publish_invalidation('key', key)
+        return deleted
     return True
 
 
@@ -144,13 +438,110 @@ def delete_memoized(function, *args, **kwargs):
 
     """
     if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-        key = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, function.__name__)
+        key = "%s:%s_args:" % (KEY_PREFIX, function.__name__)
+        tag = get_tag_key(function.__name__)
         if args or kwargs:
             key_to_hash = get_key_to_hash(*args, **kwargs)
             key = get_hash_key(key, key_to_hash)
-            return bool(sentinel.master.delete(key))
-        keys_to_delete = sentinel.slave.keys(pattern=key + '*')
-        if not keys_to_delete:
-            return False
-        return bool(sentinel.master.delete(*keys_to_delete))
+            pipe = sentinel.master.pipeline()
+            pipe.delete(key)
+            pipe.srem(tag, key)
+            deleted = bool(pipe.execute()[0])
+            _publish_invalidation('key', key)
+            return deleted
+        deleted = _delete_tag(tag)
+        _publish_invalidation('prefix', key)
+        return deleted
     return True
+
+
+def delete_memoized_many(calls):
+    """
+    Delete the values of many memoized calls with a single pipeline.
+
+    calls is a list of (function, args) tuples.
+
+    """
+    if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is not None or \
+            not calls:
+        return
+    keys = [function.cache_key(*args) for function, args in calls]
+    pipe = sentinel.master.pipeline()
+    pipe.delete(*keys)
+    for (function, args), key in zip(calls, keys):
+        pipe.srem(get_tag_key(function.__name__), key)
+    pipe.execute()
+    for key in keys:
+        _publish_invalidation('key', key)
+
+
+def _delete_tag(tag):
+    """Delete the keys in a tag set and the set itself."""
+    # Renamed first, so keys written meanwhile go to a new set
+    deleting = "%s:deleting:%s" % (tag, uuid.uuid4().hex)
+    try:
+        sentinel.master.rename(tag, deleting)
+    except ResponseError:
+        # The tag set does not exist
+        return False
+    deleted = 0
+    batch = []
+    for key in sentinel.master.sscan_iter(deleting, count=TAG_BATCH_SIZE):
+        batch.append(key)
+        if len(batch) == TAG_BATCH_SIZE:
+            deleted += sentinel.master.delete(*batch)
+            batch = []
+    if batch:
+        deleted += sentinel.master.delete(*batch)
+    sentinel.master.delete(deleting)
+    return bool(deleted)
+
+
+def sweep_tags():
+    """Remove the keys that have expired from the memoize tag sets."""
+    n_removed = 0
+    for tag in sentinel.master.smembers(TAGS_KEY):
+        if not sentinel.master.exists(tag):
+            sentinel.master.srem(TAGS_KEY, tag)
+            continue
+        batch = []
+        for key in sentinel.master.sscan_iter(tag, count=TAG_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) == TAG_BATCH_SIZE:
+                n_removed += _remove_expired(tag, batch)
+                batch = []
+        if batch:
+            n_removed += _remove_expired(tag, batch)
+    return n_removed
+
+
+def _remove_expired(tag, keys):
+    pipe = sentinel.master.pipeline()
+    for key in keys:
+        pipe.exists(key)
+    expired = [key for key, exists in zip(keys, pipe.execute())
+               if not exists]
+    if expired:
+        sentinel.master.srem(tag, *expired)
+    return len(expired)
+
+
+def delete_legacy_keys():
+    """Delete the cache keys outside KEY_PREFIX, written by earlier versions.
+
+    They are in no tag set, so delete_memoized can't reach them, and they
+    are never read again. Return how many were deleted.
+    """
+    n_deleted = 0
+    batch = []
+    pattern = '%s:*' % settings.REDIS_KEYPREFIX
+    for key in sentinel.master.scan_iter(pattern, count=TAG_BATCH_SIZE):
+        if key.startswith(KEY_PREFIX + ':'):
+            continue
+        batch.append(key)
+        if len(batch) == TAG_BATCH_SIZE:
+            n_deleted += sentinel.master.delete(*batch)
+            batch = []
+    if batch:
+        n_deleted += sentinel.master.delete(*batch)
+    return n_deleted
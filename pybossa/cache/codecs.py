@@ -0,0 +1,158 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Serialization of the values stored by the cache decorators.
+
+A stored value is a header followed by the encoded value::
+
+    magic (2) | version (1) | codec (1) | flags (1) | expires (8) | delta (8)
+
+where expires is the time the value expires (before any stale period) and
+delta the seconds it took to compute. If the zlib flag is set the encoded
+value is compressed, which is done for values above a size threshold.
+
+Values that do not start with the magic bytes were stored as plain pickles
+by earlier versions and are still read, although the cache keeps each
+format version under keys of its own. Values with an unknown version or
+codec raise UnknownFormatError, so the cache can treat them as misses.
+"""
+import json
+import zlib
+import struct
+import timeit
+from collections import namedtuple
+
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: no cover
+    import pickle
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+MAGIC = '\xfe\xca'
+VERSION = 1
+HEADER = struct.Struct('!2sBBBdd')
+ZLIB = 1
+COMPRESS_THRESHOLD = 1024
+COMPRESS_LEVEL = 6
+
+# Stored value, with the time it expires (before the stale period) and the
+# seconds it took to compute
+CacheEntry = namedtuple('CacheEntry', ['value', 'expires', 'delta'])
+
+
+class UnknownFormatError(ValueError):
+    pass
+
+
+def _pickle_dumps(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _msgpack_dumps(value):
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def _msgpack_loads(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+# name: (id, encode, decode)
+CODECS = {
+    'pickle': (1, _pickle_dumps, pickle.loads),
+    'json': (2, json.dumps, json.loads),
+}
+if msgpack is not None:
+    CODECS['msgpack'] = (3, _msgpack_dumps, _msgpack_loads)
+
+_DECODERS = dict((codec_id, decode)
+                 for codec_id, _, decode in CODECS.values())
+
+
+def get_codec(name):
+    """Return the name of the codec to use, pickle if it is not available."""
+    return name if name in CODECS else 'pickle'
+
+
+def is_encoded(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def encode(entry, codec='pickle', compress_threshold=COMPRESS_THRESHOLD):
+    """Return the stored representation of a CacheEntry."""
+    codec_id, dumps, _ = CODECS[codec]
+    payload = dumps(entry.value)
+    flags = 0
+    if compress_threshold is not None and len(payload) > compress_threshold:
+        compressed = zlib.compress(payload, COMPRESS_LEVEL)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= ZLIB
+    return HEADER.pack(MAGIC, VERSION, codec_id, flags, entry.expires,
+                       entry.delta) + payload
+
+
+def decode(data):
+    """Return the CacheEntry stored in data."""
+    if not is_encoded(data):
+        raise UnknownFormatError('Not an encoded cache value')
+    magic, version, codec_id, flags, expires, delta = \
+        HEADER.unpack_from(data)
+    if version != VERSION or codec_id not in _DECODERS:
+        raise UnknownFormatError('Unknown cache format %s/%s'
+                                 % (version, codec_id))
+    payload = data[HEADER.size:]
+    if flags & ZLIB:
+        payload = zlib.decompress(payload)
+    return CacheEntry(_DECODERS[codec_id](payload), expires, delta)
+
+
+def benchmark(value, codecs=None, compress_threshold=COMPRESS_THRESHOLD,
+              number=100):
+    """Return the size and the encode/decode time in ms per codec for value.
+
+    The size of the value pickled with the default protocol (the format used
+    before codecs) is included under 'legacy'.
+    """
+    entry = CacheEntry(value, 0, 0)
+    results = {}
+    legacy = pickle.dumps(value)
+    results['legacy'] = dict(
+        size=len(legacy),
+        encode=_time(lambda: pickle.dumps(value), number),
+        decode=_time(lambda: pickle.loads(legacy), number))
+    for codec in codecs or CODECS.keys():
+        try:
+            data = encode(entry, codec, compress_threshold)
+        except (TypeError, ValueError):
+            # Not every value can be encoded by every codec
+            continue
+        results[codec] = dict(
+            size=len(data),
+            encode=_time(lambda: encode(entry, codec, compress_threshold),
+                         number),
+            decode=_time(lambda: decode(data), number))
+    return results
+
+
+def _time(function, number):
+    return timeit.timeit(function, number=number) * 1000.0 / number
@@ -0,0 +1,144 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+In process cache kept in front of Redis by the cache decorators.
+
+Entries are the pickled values read from (or written to) Redis, so their size
+is known and every hit returns a fresh copy. The cache is bounded both by
+number of entries and by bytes, evicting the least recently used entries
+first, and every entry expires after its own (short) TTL.
+
+As every worker keeps its own copy, invalidations are published in a Redis
+channel that all the workers listen to.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+class LocalCache(object):
+
+    """Size bounded LRU cache with a TTL per entry."""
+
+    def __init__(self, max_entries=1000, max_bytes=10 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the data stored for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires <= time.time():
+                self._bytes -= len(data)
+                return None
+            # Most recently used entries are kept at the end
+            self._entries[key] = entry
+            return data
+
+    def set(self, key, data, ttl):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.time() + ttl, data)
+            self._bytes += len(data)
+            while (len(self._entries) > self.max_entries or
+                   self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._entries
+                        if key.startswith(prefix)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+
+class InvalidationListener(object):
+
+    """Apply the invalidations published by any worker to a LocalCache.
+
+    Messages are 'key:<key>' or 'prefix:<prefix>'. The listener runs in a
+    daemon thread, started again in forked processes. If the subscription is
+    lost the local cache is cleared, as messages may have been missed.
+    """
+
+    RETRY_DELAY = 1
+
+    def __init__(self, local_cache, channel):
+        self.local_cache = local_cache
+        self.channel = channel
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self, redis_conn):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Entries inherited from the parent process are not listened for
+            self.local_cache.clear()
+            thread = threading.Thread(target=self._listen, args=(redis_conn,))
+            thread.daemon = True
+            thread.start()
+            self._pid = os.getpid()
+
+    def handle(self, message):
+        if message.get('type') != 'message':
+            return
+        kind, _, target = message['data'].partition(':')
+        if kind == 'key':
+            self.local_cache.delete(target)
+        elif kind == 'prefix':
+            self.local_cache.delete_prefix(target)
+
+    def _listen(self, redis_conn):
+        while True:
+            try:
+                pubsub = redis_conn.pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self.handle(message)
+            except Exception:
+                pass
+            self.local_cache.clear()
+            time.sleep(self.RETRY_DELAY)
@@ -19,7 +19,8 @@
 from flask import current_app
 from sqlalchemy.sql import text
 from pybossa.core import db
-from pybossa.cache import memoize, ONE_DAY
+from pybossa.cache import memoize, ONE_DAY, ONE_HOUR
+from pybossa.activity import project_activity
 from flask.ext.babel import gettext
 
 import pygeoip
@@ -42,104 +43,6 @@ def n_tasks(project_id):
     return projects.n_tasks(project_id)
 
 
-@memoize(timeout=ONE_DAY)
-def stats_users(project_id, period=None):
-    """Return users's stats for a given project_id."""
-    users = {}
-    auth_users = []
-    anon_users = []
-
-    # Get Authenticated Users
-    params = dict(project_id=project_id)
-    sql = text('''SELECT task_run.user_id AS user_id,
-               COUNT(task_run.id) as n_tasks FROM task_run
-               WHERE task_run.user_id IS NOT NULL AND
-               task_run.user_ip IS NULL AND
-               task_run.project_id=:project_id
-               GROUP BY task_run.user_id ORDER BY n_tasks DESC
-               LIMIT 5;''')\
-        .execution_options(stream=True)
-    if period:
-        sql = text('''SELECT task_run.user_id AS user_id,
-                   COUNT(task_run.id) as n_tasks FROM task_run
-                   WHERE task_run.user_id IS NOT NULL AND
-                   task_run.user_ip IS NULL AND
-                   task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
-                   GROUP BY task_run.user_id ORDER BY n_tasks DESC
-                   LIMIT 5;''')\
-            .execution_options(stream=True)
-        params['period'] = period
-
-    results = session.execute(sql, params)
-
-    for row in results:
-        auth_users.append([row.user_id, row.n_tasks])
-
-    sql = text('''SELECT count(distinct(task_run.user_id)) AS user_id
-               FROM task_run WHERE task_run.user_id IS NOT NULL AND
-               task_run.user_ip IS NULL AND
-               task_run.project_id=:project_id;''')
-    if period:
-        sql = text('''SELECT count(distinct(task_run.user_id)) AS user_id
-                   FROM task_run WHERE task_run.user_id IS NOT NULL AND
-                   task_run.user_ip IS NULL AND
-                   task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
-                   ;''')
-
-    results = session.execute(sql, params)
-    for row in results:
-        users['n_auth'] = row[0]
-
-    # Get all Anonymous Users
-    sql = text('''SELECT task_run.user_ip AS user_ip,
-               COUNT(task_run.id) as n_tasks FROM task_run
-               WHERE task_run.user_ip IS NOT NULL AND
-               task_run.user_id IS NULL AND
-               task_run.project_id=:project_id
-               GROUP BY task_run.user_ip ORDER BY n_tasks DESC;''')\
-        .execution_options(stream=True)
-
-    if period:
-        sql = text('''SELECT task_run.user_ip AS user_ip,
-                   COUNT(task_run.id) as n_tasks FROM task_run
-                   WHERE task_run.user_ip IS NOT NULL AND
-                   task_run.user_id IS NULL AND
-                   task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
-                   GROUP BY task_run.user_ip ORDER BY n_tasks DESC;''')\
-            .execution_options(stream=True)
-
-    results = session.execute(sql, params)
-
-    for row in results:
-        anon_users.append([row.user_ip, row.n_tasks])
-
-    sql = text('''SELECT COUNT(DISTINCT(task_run.user_ip)) AS user_ip
-               FROM task_run WHERE task_run.user_ip IS NOT NULL AND
-               task_run.user_id IS NULL AND
-               task_run.project_id=:project_id;''')
-    if period:
-        sql = text('''SELECT COUNT(DISTINCT(task_run.user_ip)) AS user_ip
-                   FROM task_run WHERE task_run.user_ip IS NOT NULL AND
-                   task_run.user_id IS NULL AND
-                   task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
-                   ;''')
-
-    results = session.execute(sql, params)
-
-    for row in results:
-        users['n_anon'] = row[0]
-
-    return users, anon_users, auth_users
-
-
 def convert_period_to_days(period):
     """Convert SQL period into integer days."""
     try:
@@ -158,94 +61,107 @@ def convert_period_to_days(period):
     return int_period
 
 
+def task_run_users(project_id, period=None):
+    """Return the task runs of a project grouped by user.
+
+    If period is given, only the task runs within that period are included.
+    """
+    window = ''
+    if period:
+        window = 'AND finish_time_ts >= NOW() - :period ::INTERVAL'
+    sql = text('''SELECT user_id, user_ip, COUNT(id) AS n_task_runs
+               FROM task_run WHERE project_id=:project_id %s
+               GROUP BY user_id, user_ip;''' % window)
+    results = session.execute(sql, dict(project_id=project_id, period=period))
+    return [(row.user_id, row.user_ip, row.n_task_runs) for row in results]
+
+
+def hourly_activity(project_id, period=None):
+    """Return the (hour, n_anon, n_auth) answers of a project per hour."""
+    return [(hour, n_anon, n_auth) for _, hour, n_anon, n_auth, _
+            in project_activity(session, period, project_id)]
+
+
+def _is_auth(user_id, user_ip):
+    return user_id is not None and user_ip is None
+
+
+def _is_anon(user_id, user_ip):
+    return user_ip is not None and user_id is None
+
+
+@memoize(timeout=ONE_DAY)
+def stats_users(project_id, period=None):
+    """Return users's stats for a given project_id."""
+    return _stats_users(task_run_users(project_id, period))
+
+
+def _stats_users(task_runs):
+    auth = {}
+    anon = {}
+    for user_id, user_ip, n_task_runs in task_runs:
+        if _is_auth(user_id, user_ip):
+            auth[user_id] = auth.get(user_id, 0) + n_task_runs
+        elif _is_anon(user_id, user_ip):
+            anon[user_ip] = anon.get(user_ip, 0) + n_task_runs
+    by_n_tasks = operator.itemgetter(1)
+    auth_users = [list(user) for user in
+                  sorted(auth.items(), key=by_n_tasks, reverse=True)[:5]]
+    anon_users = [list(user) for user in
+                  sorted(anon.items(), key=by_n_tasks, reverse=True)]
+    users = dict(n_auth=len(auth), n_anon=len(anon))
+    return users, anon_users, auth_users
+
+
+def _fill_empty_days(days, obj, period):
+    if len(days) < convert_period_to_days(period):
+        base = datetime.datetime.today()
+        for x in range(0, convert_period_to_days(period)):
+            tmp_date = base - datetime.timedelta(days=x)
+            if tmp_date.strftime('%Y-%m-%d') not in days:
+                obj[tmp_date.strftime('%Y-%m-%d')] = 0
+    return obj
+
+
 @memoize(timeout=ONE_DAY)
 def stats_dates(project_id, period='15 day'):
     """Return statistics with dates for a project."""
+    return _stats_dates(project_id, hourly_activity(project_id, period),
+                        period)
+
+
+def _stats_dates(project_id, activity, period):
     dates = {}
     dates_anon = {}
     dates_auth = {}
 
     n_tasks(project_id)
 
-    params = dict(project_id=project_id, period=period)
-
-    # Get all completed tasks
+    # Tasks per day of their last task run in the period
     sql = text('''
-               WITH myquery AS (
-               SELECT task.id, coalesce(ct, 0) as n_task_runs, task.n_answers
-               FROM task LEFT OUTER JOIN
-               (SELECT task_id, COUNT(id) AS ct FROM task_run
-               WHERE project_id=:project_id AND
-               TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               >= NOW() - :period :: INTERVAL
-               GROUP BY task_id) AS log_counts
-               ON task.id=log_counts.task_id
-               WHERE task.project_id=:project_id ORDER BY id ASC)
-               select myquery.id, max(task_run.finish_time) as day
-               from task_run, myquery where task_run.task_id=myquery.id
-               and
-               TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               >= NOW() - :period :: INTERVAL
-               group by myquery.id order by day;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
+               SELECT day, COUNT(task_id) AS n_tasks FROM
+               (SELECT task_id,
+               to_char(MAX(finish_time_ts), 'YYYY-MM-DD') AS day
+               FROM task_run WHERE project_id=:project_id AND
+               finish_time_ts >= NOW() - :period :: INTERVAL
+               GROUP BY task_id) AS last_task_runs
+               GROUP BY day;
+               ''')
+    results = session.execute(sql, dict(project_id=project_id, period=period))
     for row in results:
-        day = row.day[:10]
-        if day in dates.keys():
-            dates[day] += 1
-        else:
-            dates[day] = 1
+        dates[row.day] = row.n_tasks
 
-    # No completed tasks in the last period
-    def _fill_empty_days(days, obj):
-        if len(days) < convert_period_to_days(period):
-            base = datetime.datetime.today()
-            for x in range(0, convert_period_to_days(period)):
-                tmp_date = base - datetime.timedelta(days=x)
-                if tmp_date.strftime('%Y-%m-%d') not in days:
-                    obj[tmp_date.strftime('%Y-%m-%d')] = 0
-        return obj
+    dates = _fill_empty_days(dates.keys(), dates, period)
 
-    dates = _fill_empty_days(dates.keys(), dates)
+    for hour, n_anon, n_auth in activity:
+        day = hour.strftime('%Y-%m-%d')
+        if n_auth:
+            dates_auth[day] = dates_auth.get(day, 0) + n_auth
+        if n_anon:
+            dates_anon[day] = dates_anon.get(day, 0) + n_anon
 
-    # Get all answers per date for auth
-    sql = text('''
-                WITH myquery AS (
-                    SELECT TO_DATE(finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    as d, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id
-                    AND user_ip IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY d)
-                SELECT to_char(d, 'YYYY-MM-DD') as d, count from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-    for row in results:
-        dates_auth[row.d] = row.count
-
-    dates_auth = _fill_empty_days(dates_auth.keys(), dates_auth)
-
-    # Get all answers per date for anon
-    sql = text('''
-                WITH myquery AS (
-                    SELECT TO_DATE(finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    as d, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id
-                    AND user_id IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY d)
-               SELECT to_char(d, 'YYYY-MM-DD') as d, count  from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-    for row in results:
-        dates_anon[row.d] = row.count
-
-    dates_anon = _fill_empty_days(dates_anon.keys(), dates_anon)
+    dates_auth = _fill_empty_days(dates_auth.keys(), dates_auth, period)
+    dates_anon = _fill_empty_days(dates_anon.keys(), dates_anon, period)
 
     return dates, dates_anon, dates_auth
 
@@ -253,12 +169,13 @@ def stats_dates(project_id, period='15 day'):
 @memoize(timeout=ONE_DAY)
 def stats_hours(project_id, period='2 week'):
     """Return statistics of a project per hours."""
+    return _stats_hours(hourly_activity(project_id, period))
+
+
+def _stats_hours(activity):
     hours = {}
     hours_anon = {}
     hours_auth = {}
-    max_hours = 0
-    max_hours_anon = 0
-    max_hours_auth = 0
 
     # initialize hours keys
     for i in range(0, 24):
@@ -266,130 +183,26 @@ def stats_hours(project_id, period='2 week'):
         hours_anon[str(i).zfill(2)] = 0
         hours_auth[str(i).zfill(2)] = 0
 
-    params = dict(project_id=project_id, period=period)
-    # Get hour stats for all users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY h)
-               SELECT h, count from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
+    # Hours with answers, the maximum is None if there are none
+    seen, seen_anon, seen_auth = set(), set(), set()
+    for hour, n_anon, n_auth in activity:
+        if not n_anon + n_auth:
+            continue
+        hour = hour.strftime('%H')
+        hours[hour] += n_anon + n_auth
+        seen.add(hour)
+        if n_anon:
+            hours_anon[hour] += n_anon
+            seen_anon.add(hour)
+        if n_auth:
+            hours_auth[hour] += n_auth
+            seen_auth.add(hour)
 
-    for row in results:
-        hours[row.h] = row.count
+    def _max(counts, seen):
+        return max(counts[h] for h in seen) if seen else None
 
-    # Get maximum stats for all users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id  AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY h)
-               SELECT max(count) from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-    for row in results:
-        max_hours = row.max
-
-    # Get hour stats for Anonymous users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id
-                    AND user_id IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY h)
-               SELECT h, count from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-
-    for row in results:
-        hours_anon[row.h] = row.count
-
-    # Get maximum stats for Anonymous users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id
-                    AND user_id IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY h)
-               SELECT max(count) from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-    for row in results:
-        max_hours_anon = row.max
-
-    # Get hour stats for Auth users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id
-                    AND user_ip IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY h)
-               SELECT h, count from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-
-    for row in results:
-        hours_auth[row.h] = row.count
-
-    # Get hour stats for Anon users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id
-                    AND user_ip IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY h)
-               SELECT max(count) from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-    for row in results:
-        max_hours_auth = row.max
-
-    return hours, hours_anon, hours_auth, max_hours, max_hours_anon, \
-        max_hours_auth
+    return hours, hours_anon, hours_auth, _max(hours, seen), \
+        _max(hours_anon, seen_anon), _max(hours_auth, seen_auth)
 
 
 @memoize(timeout=ONE_DAY)
@@ -539,13 +352,16 @@ def stats_format_users(project_id, users, anon_users, auth_users, geo=False):
                 n_anon=users['n_anon'], n_auth=users['n_auth'])
 
 
-@memoize(timeout=ONE_DAY)
+@memoize(timeout=ONE_DAY, stale_timeout=ONE_HOUR, single_flight=True,
+         early_recompute=1)
 def get_stats(project_id, geo=False, period='2 week'):
     """Return the stats of a given project."""
+    activity = hourly_activity(project_id, period)
     hours, hours_anon, hours_auth, max_hours, \
-        max_hours_anon, max_hours_auth = stats_hours(project_id, period)
-    users, anon_users, auth_users = stats_users(project_id, period)
-    dates, dates_anon, dates_auth = stats_dates(project_id, period)
+        max_hours_anon, max_hours_auth = _stats_hours(activity)
+    users, anon_users, auth_users = _stats_users(
+        task_run_users(project_id, period))
+    dates, dates_anon, dates_auth = _stats_dates(project_id, activity, period)
 
 
     n_tasks(project_id)
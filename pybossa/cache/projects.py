@@ -17,10 +17,12 @@
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 """Cache module for projects."""
 from sqlalchemy.sql import text
-from pybossa.core import db, timeouts
+from pybossa.core import db, timeouts, sentinel
 from pybossa.model.project import Project
 from pybossa.util import pretty_date
-from pybossa.cache import memoize, cache, delete_memoized, delete_cached
+from pybossa.volunteer_counter import VolunteerCounter, use_approximate
+from pybossa.cache import memoize, cache, delete_memoized, delete_cached, \
+    get_memoized_many, delete_memoized_many, limit_memoized, FIVE_MINUTES
 
 
 session = db.slave_session
@@ -33,6 +35,17 @@ def get_project(short_name):
     return project
 
 
+@memoize(timeout=timeouts.get('APP_TIMEOUT'))
+def get_project_data(project_id):
+    """Return the name, short_name, info and webhook of a project."""
+    sql = text('''SELECT name, short_name, info, webhook FROM project
+               WHERE id=:project_id''')
+    for row in session.execute(sql, dict(project_id=project_id)):
+        return dict(name=row.name, short_name=row.short_name, info=row.info,
+                    webhook=row.webhook)
+    return None
+
+
 @cache(timeout=timeouts.get('STATS_FRONTPAGE_TIMEOUT'),
        key_prefix="front_page_top_projects")
 def get_top(n=4):
@@ -45,27 +58,32 @@ def get_top(n=4):
                AND project.id=project_id
                AND (project.info->>'passwd_hash') IS NULL
                GROUP BY project.id ORDER BY total DESC LIMIT :limit;''')
-    results = session.execute(sql, dict(limit=n))
+    results = session.execute(sql, dict(limit=n)).fetchall()
+    functions = (n_anonymous_volunteers, n_registered_volunteers,
+                 n_completed_tasks)
+    values = iter(get_memoized_many([(function, (row.id,))
+                                     for row in results
+                                     for function in functions]))
     top_projects = []
     for row in results:
+        anonymous, registered, completed = [next(values)
+                                            for function in functions]
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
                        description=row.description,
                        info=row.info,
-                       n_volunteers=n_volunteers(row.id),
-                       n_completed_tasks=n_completed_tasks(row.id))
+                       n_volunteers=anonymous + registered,
+                       n_completed_tasks=completed)
         top_projects.append(project)
     return top_projects
 
 
-@memoize(timeout=timeouts.get('BROWSE_TASKS_TIMEOUT'))
+@memoize(timeout=timeouts.get('BROWSE_TASKS_TIMEOUT'),
+         stale_timeout=FIVE_MINUTES, single_flight=True)
 def browse_tasks(project_id):
     """Cache browse tasks view for a project."""
     sql = text('''
-               SELECT task.id, coalesce(ct, 0) as n_task_runs, task.n_answers
-               FROM task LEFT OUTER JOIN
-               (SELECT task_id, COUNT(id) AS ct FROM task_run
-               WHERE project_id=:project_id GROUP BY task_id) AS log_counts
-               ON task.id=log_counts.task_id
+               SELECT task.id, task.n_task_runs, task.n_answers
+               FROM task
                WHERE task.project_id=:project_id ORDER BY id ASC
                ''')
     results = session.execute(sql, dict(project_id=project_id))
@@ -88,77 +106,103 @@ def _pct_status(n_task_runs, n_answers):
     return float(0)
 
 
+def _values_by_project(sql, args_list, default=0):
+    """Return a value per args tuple from a query grouped by project_id."""
+    project_ids = [args[0] for args in args_list]
+    results = session.execute(text(sql), dict(project_ids=project_ids))
+    values = dict((row[0], row[1]) for row in results)
+    return dict((args, values.get(args[0], default)) for args in args_list)
+
+
+def _counter(name, project_id, default=0):
+    """Return a counter of a project from project_counters."""
+    sql = text('''SELECT %s FROM project_counters
+               WHERE project_id=:project_id''' % name)
+    value = session.execute(sql, dict(project_id=project_id)).scalar()
+    return default if value is None else value
+
+
+def _counter_many(name, args_list, default=0):
+    return _values_by_project('''SELECT project_id, %s FROM project_counters
+                              WHERE project_id = ANY(:project_ids)'''
+                              % name, args_list, default)
+
+
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def n_tasks(project_id):
     """Return number of tasks of a project."""
-    sql = text('''SELECT COUNT(task.id) AS n_tasks FROM task
-                  WHERE task.project_id=:project_id;''')
-    results = session.execute(sql, dict(project_id=project_id))
-    n_tasks = 0
-    for row in results:
-        n_tasks = row.n_tasks
-    return n_tasks
+    return _counter('n_tasks', project_id)
+
+
+@n_tasks.many
+def _n_tasks_many(args_list):
+    return _counter_many('n_tasks', args_list)
 
 
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def n_completed_tasks(project_id):
     """Return number of completed tasks of a project."""
-    sql = text('''SELECT COUNT(task.id) AS n_completed_tasks FROM task
-                WHERE task.project_id=:project_id AND task.state=\'completed\';
-                ''')
+    return _counter('n_completed_tasks', project_id)
 
-    results = session.execute(sql, dict(project_id=project_id))
-    n_completed_tasks = 0
-    for row in results:
-        n_completed_tasks = row.n_completed_tasks
-    return n_completed_tasks
+
+@n_completed_tasks.many
+def _n_completed_tasks_many(args_list):
+    return _counter_many('n_completed_tasks', args_list)
 
 
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def n_results(project_id):
     """Return number of results of a project."""
-    query = text('''
-                 SELECT COUNT(id) AS ct FROM result
-                 WHERE project_id=:project_id
-                 AND info IS NOT NULL;
-                 ''')
-    results = session.execute(query, dict(project_id=project_id))
-    n_results = 0
-    for row in results:
-        n_results = row.ct
-    return n_results
+    return _counter('n_results', project_id)
+
+
+@n_results.many
+def _n_results_many(args_list):
+    return _counter_many('n_results', args_list)
 
 
 @memoize(timeout=timeouts.get('REGISTERED_USERS_TIMEOUT'))
 def n_registered_volunteers(project_id):
-    """Return number of registered users that have participated in a project."""
-    sql = text('''SELECT COUNT(DISTINCT(task_run.user_id))
-               AS n_registered_volunteers FROM task_run
-               WHERE task_run.user_id IS NOT NULL AND
-               task_run.user_ip IS NULL AND
-               task_run.project_id=:project_id;''')
+    """Return number of registered users that have participated in a project.
 
-    results = session.execute(sql, dict(project_id=project_id))
-    n_registered_volunteers = 0
-    for row in results:
-        n_registered_volunteers = row.n_registered_volunteers
-    return n_registered_volunteers
+    With APPROXIMATE_VOLUNTEERS they are counted with its HyperLogLog.
+    """
+    if use_approximate():
+        return VolunteerCounter(sentinel.master).count('registered',
+                                                       project_id)
+    return _counter('n_registered_volunteers', project_id)
+
+
+@n_registered_volunteers.many
+def _n_registered_volunteers_many(args_list):
+    if use_approximate():
+        return _approximate_many('registered', args_list)
+    return _counter_many('n_registered_volunteers', args_list)
 
 
 @memoize(timeout=timeouts.get('ANON_USERS_TIMEOUT'))
 def n_anonymous_volunteers(project_id):
-    """Return number of anonymous users that have participated in a project."""
-    sql = text('''SELECT COUNT(DISTINCT(task_run.user_ip))
-               AS n_anonymous_volunteers FROM task_run
-               WHERE task_run.user_ip IS NOT NULL AND
-               task_run.user_id IS NULL AND
-               task_run.project_id=:project_id;''')
+    """Return number of anonymous users that have participated in a project.
 
-    results = session.execute(sql, dict(project_id=project_id))
-    n_anonymous_volunteers = 0
-    for row in results:
-        n_anonymous_volunteers = row.n_anonymous_volunteers
-    return n_anonymous_volunteers
+    With APPROXIMATE_VOLUNTEERS they are counted with its HyperLogLog.
+    """
+    if use_approximate():
+        return VolunteerCounter(sentinel.master).count('anonymous',
+                                                       project_id)
+    return _counter('n_anonymous_volunteers', project_id)
+
+
+@n_anonymous_volunteers.many
+def _n_anonymous_volunteers_many(args_list):
+    if use_approximate():
+        return _approximate_many('anonymous', args_list)
+    return _counter_many('n_anonymous_volunteers', args_list)
+
+
+def _approximate_many(kind, args_list):
+    counts = VolunteerCounter(sentinel.master).count_many(
+        kind, [args[0] for args in args_list])
+    return dict((args, counts[args[0]]) for args in args_list)
 
 
 def n_volunteers(project_id):
@@ -171,14 +215,12 @@ def n_volunteers(project_id):
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def n_task_runs(project_id):
     """Return number of task_runs of a project."""
-    sql = text('''SELECT COUNT(task_run.id) AS n_task_runs FROM task_run
-                  WHERE task_run.project_id=:project_id''')
+    return _counter('n_task_runs', project_id)
 
-    results = session.execute(sql, dict(project_id=project_id))
-    n_task_runs = 0
-    for row in results:
-        n_task_runs = row.n_task_runs
-    return n_task_runs
+
+@n_task_runs.many
+def _n_task_runs_many(args_list):
+    return _counter_many('n_task_runs', args_list)
 
 
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
@@ -190,18 +232,50 @@ def overall_progress(project_id):
         return 0
 
 
+@overall_progress.many
+def _overall_progress_many(args_list):
+    values = get_memoized_many([(n_tasks, args) for args in args_list] +
+                               [(n_completed_tasks, args)
+                                for args in args_list])
+    progress = {}
+    for args, tasks, completed in zip(args_list, values[:len(args_list)],
+                                      values[len(args_list):]):
+        progress[args] = (completed * 100) / tasks if tasks != 0 else 0
+    return progress
+
+
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def last_activity(project_id):
     """Return last activity, date, from a project."""
-    sql = text('''SELECT finish_time FROM task_run WHERE project_id=:project_id
-               ORDER BY finish_time DESC LIMIT 1''')
+    return _counter('last_activity', project_id, default=None)
 
-    results = session.execute(sql, dict(project_id=project_id))
-    for row in results:
-        if row is not None:
-            return row[0]
-        else:  # pragma: no cover
-            return None
+
+@last_activity.many
+def _last_activity_many(args_list):
+    return _counter_many('last_activity', args_list, default=None)
+
+
+def summaries(project_ids):
+    """Return the counters shown in project listings for many projects.
+
+    All of them are read from the cache at once, and the missing ones are
+    computed with one query per counter for all the projects.
+    """
+    functions = (last_activity, overall_progress, n_tasks,
+                 n_anonymous_volunteers, n_registered_volunteers)
+    values = iter(get_memoized_many([(function, (project_id,))
+                                     for project_id in project_ids
+                                     for function in functions]))
+    result = {}
+    for project_id in project_ids:
+        activity, progress, tasks, anonymous, registered = \
+            [next(values) for function in functions]
+        result[project_id] = dict(last_activity=pretty_date(activity),
+                                  last_activity_raw=activity,
+                                  overall_progress=progress,
+                                  n_tasks=tasks,
+                                  n_volunteers=anonymous + registered)
+    return result
 
 
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
@@ -244,19 +318,16 @@ def get_all_featured(category=None):
            AND "user".id=project.owner_id
            GROUP BY project.id, "user".id;''')
 
-    results = session.execute(sql)
+    results = session.execute(sql).fetchall()
+    counters = summaries([row.id for row in results])
     projects = []
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
                        created=row.created, description=row.description,
                        updated=row.updated,
-                       last_activity=pretty_date(last_activity(row.id)),
-                       last_activity_raw=last_activity(row.id),
                        owner=row.owner,
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
                        info=row.info)
+        project.update(counters[row.id])
         projects.append(project)
     return projects
 
@@ -303,7 +374,8 @@ def get_all_draft(category=None):
            WHERE project.owner_id="user".id
            AND project.published=false;''')
 
-    results = session.execute(sql)
+    results = session.execute(sql).fetchall()
+    counters = summaries([row.id for row in results])
     projects = []
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
@@ -311,12 +383,8 @@ def get_all_draft(category=None):
                        updated=row.updated,
                        description=row.description,
                        owner=row.owner,
-                       last_activity=pretty_date(last_activity(row.id)),
-                       last_activity_raw=last_activity(row.id),
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
                        info=row.info)
+        project.update(counters[row.id])
         projects.append(project)
     return projects
 
@@ -353,7 +421,8 @@ def n_count(category):
     return count
 
 
-@memoize(timeout=timeouts.get('APP_TIMEOUT'))
+@memoize(timeout=timeouts.get('APP_TIMEOUT'), stale_timeout=FIVE_MINUTES,
+         single_flight=True)
 def get_all(category):
     """Return a list of published projects for a given category.
     """
@@ -370,7 +439,8 @@ def get_all(category):
            AND (project.info->>'passwd_hash') IS NULL
            GROUP BY project.id, "user".id ORDER BY project.name;''')
 
-    results = session.execute(sql, dict(category=category))
+    results = session.execute(sql, dict(category=category)).fetchall()
+    counters = summaries([row.id for row in results])
     projects = []
     for row in results:
         project = dict(id=row.id,
@@ -380,12 +450,8 @@ def get_all(category):
                        description=row.description,
                        owner=row.owner,
                        featured=row.featured,
-                       last_activity=pretty_date(last_activity(row.id)),
-                       last_activity_raw=last_activity(row.id),
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
                        info=row.info)
+        project.update(counters[row.id])
         projects.append(project)
     return projects
 
@@ -429,6 +495,11 @@ def delete_project(short_name):
     delete_memoized(get_project, short_name)
 
 
+def delete_project_data(project_id):
+    """Reset get_project_data value in cache"""
+    delete_memoized(get_project_data, project_id)
+
+
 def delete_browse_tasks(project_id):
     """Reset browse_tasks value in cache"""
     delete_memoized(browse_tasks, project_id)
@@ -497,3 +568,36 @@ def clean_project(project_id):
     delete_last_activity(project_id)
     delete_n_task_runs(project_id)
     delete_overall_progress(project_id)
+
+
+def _limit_browse_tasks(project_id):
+    # Too expensive to recompute on every write
+    limit_memoized([(browse_tasks, (project_id,))],
+                   timeouts.get('PROJECT_RECOMPUTE_INTERVAL'))
+
+
+def task_created(project_id, task_completed):
+    """Update the cache of a project for a new task."""
+    calls = [(n_tasks, (project_id,)), (overall_progress, (project_id,))]
+    if task_completed:
+        calls.append((n_completed_tasks, (project_id,)))
+    delete_memoized_many(calls)
+    _limit_browse_tasks(project_id)
+
+
+def task_run_created(project_id, task_completed):
+    """Update the cache of a project for a new task run.
+
+    The counters are primary key reads of project_counters, which the
+    listeners already updated, so their cached values are just deleted. The
+    tasks browser is recomputed once every PROJECT_RECOMPUTE_INTERVAL
+    seconds at most.
+    """
+    calls = [(n_task_runs, (project_id,)), (last_activity, (project_id,)),
+             (n_registered_volunteers, (project_id,)),
+             (n_anonymous_volunteers, (project_id,))]
+    if task_completed:
+        calls.extend([(n_completed_tasks, (project_id,)),
+                      (overall_progress, (project_id,))])
+    delete_memoized_many(calls)
+    _limit_browse_tasks(project_id)
@@ -20,8 +20,10 @@ import pygeoip
 from sqlalchemy.sql import text
 from flask import current_app
 
-from pybossa.core import db
+from pybossa.core import db, sentinel
 from pybossa.cache import cache, ONE_DAY
+from pybossa.activity import project_activity
+from pybossa.volunteer_counter import VolunteerCounter, use_approximate
 
 session = db.slave_session
 
@@ -36,9 +38,19 @@ def n_auth_users():
     return n_auth or 0
 
 
+def n_anon_users(approximate=None):
+    """Return number of anonymous users.
+
+    With approximate (APPROXIMATE_VOLUNTEERS by default) they are counted
+    with the site wide HyperLogLog instead of the task_run table.
+    """
+    if use_approximate(approximate):
+        return VolunteerCounter(sentinel.master).count('anonymous')
+    return _n_anon_users()
+
+
 @cache(timeout=ONE_DAY, key_prefix="site_n_anon_users")
-def n_anon_users():
-    """Return number of anonymous users."""
+def _n_anon_users():
     sql = text('''SELECT COUNT(DISTINCT(task_run.user_ip))
                AS n_anon FROM task_run;''')
 
@@ -51,7 +63,7 @@ def n_anon_users():
 @cache(timeout=ONE_DAY, key_prefix="site_n_tasks")
 def n_tasks_site():
     """Return number of tasks in the server."""
-    sql = text('''SELECT COUNT(task.id) AS n_tasks FROM task''')
+    sql = text('''SELECT SUM(n_tasks) AS n_tasks FROM project_counters''')
     results = session.execute(sql)
     for row in results:
         n_tasks = row.n_tasks
@@ -71,7 +83,8 @@ def n_total_tasks_site():
 @cache(timeout=ONE_DAY, key_prefix="site_n_task_runs")
 def n_task_runs_site():
     """Return number of task runs in the server."""
-    sql = text('''SELECT COUNT(task_run.id) AS n_task_runs FROM task_run''')
+    sql = text('''SELECT SUM(n_task_runs) AS n_task_runs
+               FROM project_counters''')
     results = session.execute(sql)
     for row in results:
         n_task_runs = row.n_task_runs
@@ -82,19 +95,23 @@ def n_task_runs_site():
 def get_top5_projects_24_hours():
     """Return the top 5 projects more active in the last 24 hours."""
     # Top 5 Most active projects in last 24 hours
-    sql = text('''SELECT project.id, project.name, project.short_name, project.info,
-               COUNT(task_run.project_id) AS n_answers FROM project, task_run
-               WHERE project.id=task_run.project_id
-               AND DATE(task_run.finish_time) > NOW() - INTERVAL '24 hour'
-               AND DATE(task_run.finish_time) <= NOW()
-               GROUP BY project.id
-               ORDER BY n_answers DESC LIMIT 5;''')
-
-    results = session.execute(sql, dict(limit=5))
+    answers = {}
+    for project_id, hour, n_anon, n_auth, n_completed_tasks \
+            in project_activity(session, '24 hour'):
+        answers[project_id] = answers.get(project_id, 0) + n_anon + n_auth
+    top5 = sorted(((n, project_id) for project_id, n in answers.items()
+                   if n > 0), key=lambda top: top[0], reverse=True)[:5]
     top5_apps_24_hours = []
-    for row in results:
+    if not top5:
+        return top5_apps_24_hours
+    sql = text('''SELECT id, name, short_name, info FROM project
+               WHERE id IN (%s);''' % ', '.join(str(int(project_id))
+                                           for n, project_id in top5))
+    projects = dict((row.id, row) for row in session.execute(sql))
+    for n_answers, project_id in top5:
+        row = projects[project_id]
         tmp = dict(id=row.id, name=row.name, short_name=row.short_name,
-                   info=row.info, n_answers=row.n_answers)
+                   info=row.info, n_answers=n_answers)
         top5_apps_24_hours.append(tmp)
     return top5_apps_24_hours
 
@@ -106,8 +123,8 @@ def get_top5_users_24_hours():
     sql = text('''SELECT "user".id, "user".fullname, "user".name,
                COUNT(task_run.project_id) AS n_answers FROM "user", task_run
                WHERE "user".id=task_run.user_id
-               AND DATE(task_run.finish_time) > NOW() - INTERVAL '24 hour'
-               AND DATE(task_run.finish_time) <= NOW()
+               AND task_run.finish_time_ts > NOW() - INTERVAL '24 hour'
+               AND task_run.finish_time_ts <= NOW()
                GROUP BY "user".id
                ORDER BY n_answers DESC LIMIT 5;''')
 
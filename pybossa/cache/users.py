@@ -17,88 +17,64 @@
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 """Cache module for users."""
 from sqlalchemy.sql import text
-from pybossa.core import db, timeouts
+from pybossa.core import db, timeouts, sentinel
 from pybossa.cache import cache, memoize, delete_memoized
 from pybossa.util import pretty_date
 from pybossa.model.user import User
-from pybossa.cache.projects import overall_progress, n_tasks, n_volunteers
+from pybossa.cache.projects import summaries
+from pybossa.leaderboard import Leaderboard
 
 
 session = db.slave_session
 
 
-@memoize(timeout=timeouts.get('USER_TIMEOUT'))
-def get_leaderboard(n, user_id=None):
-    """Return the top n users with their rank."""
-    sql = text('''
-               WITH global_rank AS (
-                    WITH scores AS (
-                        SELECT user_id, COUNT(*) AS score FROM task_run
-                        WHERE user_id IS NOT NULL GROUP BY user_id)
-                    SELECT user_id, score, rank() OVER (ORDER BY score desc)
-                    FROM scores)
-               SELECT rank, id, name, fullname, email_addr, info, created,
-               score FROM global_rank
-               JOIN public."user" on (user_id=public."user".id) ORDER BY rank
-               LIMIT :limit;
-               ''')
+def _users_by_id(user_ids):
+    sql = text('''SELECT id, name, fullname, email_addr, info, created
+               FROM "user" WHERE id = ANY(:user_ids)''')
+    results = session.execute(sql, dict(user_ids=list(user_ids)))
+    return dict((row.id, row) for row in results)
+
+
+@memoize(timeout=timeouts.get('API_KEY_TIMEOUT'))
+def get_api_key_user(api_key):
+    """Return the id, name and admin flag of the owner of an API key.
 
-    results = session.execute(sql, dict(limit=n))
+    Read from the master, so a key just reset is not cached again from a
+    replica lagging behind.
+    """
+    sql = text('''SELECT id, name, admin FROM "user"
+               WHERE api_key=:api_key''')
+    for row in db.session.execute(sql, dict(api_key=api_key)):
+        return dict(id=row.id, name=row.name, admin=row.admin)
+    return None
 
+
+@memoize(timeout=timeouts.get('USER_TIMEOUT'))
+def get_leaderboard(n, user_id=None, project_id=None):
+    """Return the top n users with their rank, in a project if given."""
+    leaderboard = Leaderboard(sentinel.master)
+    ranked = leaderboard.top(n, project_id)
+    if user_id is not None and \
+            user_id not in [ranked_id for _, ranked_id, _ in ranked]:
+        rank, score = leaderboard.rank_and_score(user_id, project_id)
+        # Users with no contributions are listed with no rank
+        ranked.append((rank or -1, user_id, score or -1))
+    users = _users_by_id([ranked_id for _, ranked_id, _ in ranked])
     top_users = []
-    user_in_top = False
-    for row in results:
-        if (row.id == user_id):
-            user_in_top = True
+    for rank, ranked_id, score in ranked:
+        row = users.get(ranked_id)
+        if row is None:  # pragma: no cover
+            continue
         user = dict(
-            rank=row.rank,
+            rank=rank,
             id=row.id,
             name=row.name,
             fullname=row.fullname,
             email_addr=row.email_addr,
             info=row.info,
             created=row.created,
-            score=row.score)
+            score=score)
         top_users.append(user)
-    if (user_id is not None):
-        if not user_in_top:
-            sql = text('''
-                       WITH global_rank AS (
-                            WITH scores AS (
-                                SELECT user_id, COUNT(*) AS score FROM task_run
-                                WHERE user_id IS NOT NULL GROUP BY user_id)
-                            SELECT user_id, score, rank() OVER
-                                (ORDER BY score desc)
-                            FROM scores)
-                       SELECT rank, id, name, fullname, email_addr, info, created,
-                              score FROM global_rank
-                       JOIN public."user" on (user_id=public."user".id)
-                       WHERE user_id=:user_id ORDER BY rank;
-                       ''')
-            user_rank = session.execute(sql, dict(user_id=user_id))
-            u = User.query.get(user_id)
-            # Load by default user data with no rank
-            user = dict(
-                rank=-1,
-                id=u.id,
-                name=u.name,
-                fullname=u.fullname,
-                email_addr=u.email_addr,
-                info=u.info,
-                created=u.created,
-                score=-1)
-            for row in user_rank:  # pragma: no cover
-                user = dict(
-                    rank=row.rank,
-                    id=row.id,
-                    name=row.name,
-                    fullname=row.fullname,
-                    email_addr=row.email_addr,
-                    info=row.info,
-                    created=row.created,
-                    score=row.score)
-            top_users.append(user)
-
     return top_users
 
 
@@ -109,12 +85,10 @@ def get_user_summary(name):
                SELECT "user".id, "user".name, "user".fullname, "user".created,
                "user".api_key, "user".twitter_user_id, "user".facebook_user_id,
                "user".google_user_id, "user".info,
-               "user".email_addr, COUNT(task_run.user_id) AS n_answers,
+               "user".email_addr,
                "user".valid_email, "user".confirmation_email_sent
                FROM "user"
-               LEFT OUTER JOIN task_run ON "user".id=task_run.user_id
-               WHERE "user".name=:name
-               GROUP BY "user".id;
+               WHERE "user".name=:name;
                ''')
     results = session.execute(sql, dict(name=name))
     user = dict()
@@ -125,7 +99,7 @@ def get_user_summary(name):
                     google_user_id=row.google_user_id,
                     facebook_user_id=row.facebook_user_id,
                     info=row.info,
-                    email_addr=row.email_addr, n_answers=row.n_answers,
+                    email_addr=row.email_addr,
                     valid_email=row.valid_email,
                     confirmation_email_sent=row.confirmation_email_sent,
                     registered_ago=pretty_date(row.created))
@@ -133,31 +107,19 @@ def get_user_summary(name):
         rank_score = rank_and_score(user['id'])
         user['rank'] = rank_score['rank']
         user['score'] = rank_score['score']
+        # The score is the number of task runs of the user
+        user['n_answers'] = rank_score['score'] or 0
         user['total'] = get_total_users()
         return user
     else:  # pragma: no cover
         return None
 
 
-@memoize(timeout=timeouts.get('USER_TIMEOUT'))
-def rank_and_score(user_id):
-    """Return rank and score for a user."""
-    # See: https://gist.github.com/tokumine/1583695
-    sql = text('''
-               WITH global_rank AS (
-                    WITH scores AS (
-                        SELECT user_id, COUNT(*) AS score FROM task_run
-                        WHERE user_id IS NOT NULL GROUP BY user_id)
-                    SELECT user_id, score, rank() OVER (ORDER BY score desc)
-                    FROM scores)
-               SELECT * from global_rank WHERE user_id=:user_id;
-               ''')
-    results = session.execute(sql, dict(user_id=user_id))
-    rank_and_score = dict(rank=None, score=None)
-    for row in results:
-        rank_and_score['rank'] = row.rank
-        rank_and_score['score'] = row.score
-    return rank_and_score
+def rank_and_score(user_id, project_id=None):
+    """Return rank and score for a user, in a project if given."""
+    rank, score = Leaderboard(sentinel.master).rank_and_score(user_id,
+                                                              project_id)
+    return dict(rank=rank, score=score)
 
 
 def projects_contributed(user_id):
@@ -170,15 +132,16 @@ def projects_contributed(user_id):
                project.description, project.info FROM project, projects_contributed
                WHERE project.id=projects_contributed.project_id ORDER BY project.name DESC;
                ''')
-    results = session.execute(sql, dict(user_id=user_id))
+    results = session.execute(sql, dict(user_id=user_id)).fetchall()
     projects_contributed = []
+    counters = summaries([row.id for row in results])
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
                        owner_id=row.owner_id,
                        description=row.description,
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
+                       overall_progress=counters[row.id]['overall_progress'],
+                       n_tasks=counters[row.id]['n_tasks'],
+                       n_volunteers=counters[row.id]['n_volunteers'],
                        info=row.info)
         projects_contributed.append(project)
     return projects_contributed
@@ -201,14 +164,15 @@ def published_projects(user_id):
                AND project.owner_id=:user_id;
                ''')
     projects_published = []
-    results = session.execute(sql, dict(user_id=user_id))
+    results = session.execute(sql, dict(user_id=user_id)).fetchall()
+    counters = summaries([row.id for row in results])
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
                        owner_id=row.owner_id,
                        description=row.description,
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
+                       overall_progress=counters[row.id]['overall_progress'],
+                       n_tasks=counters[row.id]['n_tasks'],
+                       n_volunteers=counters[row.id]['n_volunteers'],
                        info=row.info)
         projects_published.append(project)
     return projects_published
@@ -231,14 +195,15 @@ def draft_projects(user_id):
                AND project.published=false;
                ''')
     projects_draft = []
-    results = session.execute(sql, dict(user_id=user_id))
+    results = session.execute(sql, dict(user_id=user_id)).fetchall()
+    counters = summaries([row.id for row in results])
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
                        owner_id=row.owner_id,
                        description=row.description,
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
+                       overall_progress=counters[row.id]['overall_progress'],
+                       n_tasks=counters[row.id]['n_tasks'],
+                       n_volunteers=counters[row.id]['n_volunteers'],
                        info=row.info)
         projects_draft.append(project)
     return projects_draft
@@ -282,3 +247,8 @@ def get_users_page(page, per_page=24):
 def delete_user_summary(name):
     """Delete from cache the user summary."""
     delete_memoized(get_user_summary, name)
+
+
+def delete_api_key_user(api_key):
+    """Delete from cache the owner of an API key."""
+    delete_memoized(get_api_key_user, api_key)
@@ -28,13 +28,15 @@ class Ckan(object):
 
     def _field_setup(self, obj):
         int_fields = ['id', 'project_id', 'task_id', 'user_id',
-                      'n_answers', 'timeout', 'calibration', 'quorum']
+                      'n_answers', 'timeout', 'calibration', 'quorum',
+                      'n_task_runs']
         text_fields = ['state', 'user_ip']
         float_fields = ['priority_0']
         timestamp_fields = ['created', 'finish_time']
         json_fields = ['info']
-        # Backrefs and functions
-        sqlalchemy_refs = ['project', 'task_runs', 'pct_status']
+        # Backrefs, functions and internal columns
+        sqlalchemy_refs = ['project', 'task_runs', 'pct_status', 'dictize',
+                           'finish_time_ts']
         fields = []
         for attr in obj.__dict__.keys():
             if ("__" not in attr[0:2] and "_" not in attr[0:1] and
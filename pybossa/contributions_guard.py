@@ -31,6 +31,14 @@ class ContributionsGuard(object):
         key = self._create_key(task, user)
         self.conn.setex(key, self.STAMP_TTL, make_timestamp())
 
+    def stamp_many(self, tasks, user):
+        pipe = self.conn.pipeline()
+        timestamp = make_timestamp()
+        for task in tasks:
+            key = self._create_key(task, user)
+            pipe.setex(key, self.STAMP_TTL, timestamp)
+        pipe.execute()
+
     def check_task_stamped(self, task, user):
         key = self._create_key(task, user)
         task_requested = self.conn.get(key) is not None
@@ -40,6 +48,13 @@ class ContributionsGuard(object):
         key = self._create_key(task, user)
         return self.conn.get(key)
 
+    def retrieve_timestamps(self, tasks, user):
+        """Return the stamps of the tasks, None if not requested, at once."""
+        if not tasks:
+            return []
+        keys = [self._create_key(task, user) for task in tasks]
+        return self.conn.mget(keys)
+
     def _create_key(self, task, user):
         user_id = user['user_id'] or user['user_ip']
         return self.KEY_PREFIX % (user_id, task.id)
@@ -453,8 +453,15 @@ def setup_hooks(app):
         if 'Authorization' in request.headers:
             apikey = request.headers.get('Authorization')
         if apikey:
-            user = user_repo.get_by(api_key=apikey)
-            if user:
+            from pybossa.cache.users import get_api_key_user
+            from pybossa.api_key_user import ApiKeyUser
+            principal = get_api_key_user(apikey)
+            if principal:
+                if request.blueprint == 'api':
+                    # Loaded from the DB only if the call needs more
+                    user = ApiKeyUser(**principal)
+                else:
+                    user = user_repo.get(principal['id'])
                 _request_ctx_stack.top.user = user
 
     @app.context_processor
@@ -567,12 +574,15 @@ def setup_cache_timeouts(app):
     timeouts['STATS_DRAFT_TIMEOUT'] = app.config['STATS_DRAFT_TIMEOUT']
     timeouts['N_APPS_PER_CATEGORY_TIMEOUT'] = \
         app.config['N_APPS_PER_CATEGORY_TIMEOUT']
+    timeouts['PROJECT_RECOMPUTE_INTERVAL'] = \
+        app.config['PROJECT_RECOMPUTE_INTERVAL']
     # Categories
     timeouts['CATEGORY_TIMEOUT'] = app.config['CATEGORY_TIMEOUT']
     # Users
     timeouts['USER_TIMEOUT'] = app.config['USER_TIMEOUT']
     timeouts['USER_TOP_TIMEOUT'] = app.config['USER_TOP_TIMEOUT']
     timeouts['USER_TOTAL_TIMEOUT'] = app.config['USER_TOTAL_TIMEOUT']
+    timeouts['API_KEY_TIMEOUT'] = app.config['API_KEY_TIMEOUT']
 
 
 def setup_scheduled_jobs(app):  # pragma: no cover
@@ -0,0 +1,165 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Counters of the tasks, task runs and results of every project.
+
+The project_counters table has a row per project, updated by the event
+listeners in the same transaction as the changes they count, so the counters
+shown for a project are read by primary key instead of aggregating its tasks
+and task runs.
+
+Changes the listeners can't count by increments (deletions and bulk SQL
+updates) recompute the row of the project with refresh, which is also run for
+every project by the reconcile_project_counters job to repair any drift. It
+recomputes task.n_task_runs too, the counter the task completion is decided
+from.
+"""
+from sqlalchemy.sql import text
+from pybossa.volunteer_counter import use_approximate
+# Registers the table with the rest of the models
+from pybossa.model.project_counters import ProjectCounters
+
+
+COUNTERS = ('n_tasks', 'n_completed_tasks', 'n_task_runs', 'n_results',
+            'n_registered_volunteers', 'n_anonymous_volunteers')
+
+# Counters of every project (or :project_id) computed from the source tables
+AGGREGATES_SQL = '''
+    SELECT project.id AS project_id,
+    COALESCE(tasks.n_tasks, 0) AS n_tasks,
+    COALESCE(tasks.n_completed_tasks, 0) AS n_completed_tasks,
+    COALESCE(task_runs.n_task_runs, 0) AS n_task_runs,
+    COALESCE(results.n_results, 0) AS n_results,
+    COALESCE(task_runs.n_registered_volunteers, 0)
+        AS n_registered_volunteers,
+    COALESCE(task_runs.n_anonymous_volunteers, 0) AS n_anonymous_volunteers,
+    task_runs.last_activity
+    FROM project
+    LEFT JOIN
+    (SELECT project_id, COUNT(id) AS n_tasks,
+     SUM(CASE WHEN state='completed' THEN 1 ELSE 0 END) AS n_completed_tasks
+     FROM task %(where)s GROUP BY project_id) AS tasks
+    ON tasks.project_id=project.id
+    LEFT JOIN
+    (SELECT project_id, COUNT(id) AS n_task_runs,
+     COUNT(DISTINCT CASE WHEN user_ip IS NULL THEN user_id END)
+        AS n_registered_volunteers,
+     COUNT(DISTINCT CASE WHEN user_id IS NULL THEN user_ip END)
+        AS n_anonymous_volunteers,
+     MAX(finish_time) AS last_activity
+     FROM task_run %(where)s GROUP BY project_id) AS task_runs
+    ON task_runs.project_id=project.id
+    LEFT JOIN
+    (SELECT project_id, COUNT(id) AS n_results FROM result
+     WHERE info IS NOT NULL %(filters)s GROUP BY project_id) AS results
+    ON results.project_id=project.id
+    %(where_project)s'''
+
+# Number of task runs of every task (of :project_id) that is out of date
+TASK_RUNS_SQL = '''
+    UPDATE task SET n_task_runs=counted.n_task_runs
+    FROM (SELECT task.id, COUNT(task_run.id) AS n_task_runs
+          FROM task LEFT JOIN task_run ON task_run.task_id=task.id
+          %(where)s GROUP BY task.id) AS counted
+    WHERE task.id=counted.id
+    AND task.n_task_runs IS DISTINCT FROM counted.n_task_runs'''
+
+
+def create(conn, project_id):
+    """Add the row of counters of a new project."""
+    conn.execute(text('''INSERT INTO project_counters (project_id)
+                      VALUES (:project_id)'''), dict(project_id=project_id))
+
+
+def increment(conn, project_id, last_activity=None, **increments):
+    """Add the increments to the counters of a project."""
+    assert set(increments) <= set(COUNTERS), increments
+    updates = ['%s=%s + :%s' % (name, name, name) for name in increments]
+    if last_activity is not None:
+        # GREATEST ignores the NULL of projects without task runs
+        updates.append('last_activity=GREATEST(last_activity, :last_activity)')
+    params = dict(increments, project_id=project_id,
+                  last_activity=last_activity)
+    sql = text('UPDATE project_counters SET %s WHERE project_id=:project_id'
+               % ', '.join(updates))
+    conn.execute(sql, params)
+
+
+def volunteer_increment(task_run):
+    """Return the SET clause, and its params, adding the volunteer of a new
+    task run to the counters if it is the first one of that user or IP in
+    the project.
+
+    The clause ends with a comma, and is empty if the task run is neither
+    from a registered nor from an anonymous user. It is empty as well with
+    APPROXIMATE_VOLUNTEERS, as the volunteers are counted with the
+    HyperLogLogs then, and left to refresh.
+    """
+    if use_approximate():
+        return '', {}
+    if task_run.user_id is not None and task_run.user_ip is None:
+        counter, column, other = 'n_registered_volunteers', 'user_id', \
+            'user_ip'
+        value = task_run.user_id
+    elif task_run.user_ip is not None and task_run.user_id is None:
+        counter, column, other = 'n_anonymous_volunteers', 'user_ip', \
+            'user_id'
+        value = task_run.user_ip
+    else:
+        return '', {}
+    clause = '''%s=%s + (CASE WHEN EXISTS (SELECT 1 FROM task_run
+             WHERE project_id=:project_id AND %s=:volunteer AND %s IS NULL
+             AND id != :task_run_id) THEN 0 ELSE 1 END),''' % (
+        counter, counter, column, other)
+    return clause, dict(volunteer=value, task_run_id=task_run.id)
+
+
+def refresh(conn, project_id=None):
+    """Recompute the counters of a project, or of all of them, and the
+    number of task runs of their tasks.
+
+    Returns the number of rows that were out of date.
+    """
+    if project_id is None:
+        where = filters = where_project = ''
+    else:
+        where = 'WHERE project_id=:project_id'
+        filters = 'AND project_id=:project_id'
+        where_project = 'WHERE project.id=:project_id'
+    params = dict(project_id=project_id)
+    where_task = where and 'WHERE task.project_id=:project_id'
+    n_tasks = conn.execute(text(TASK_RUNS_SQL % dict(where=where_task)),
+                           params).rowcount
+    missing = '''SELECT id FROM project WHERE NOT EXISTS
+                 (SELECT 1 FROM project_counters WHERE project_id=project.id)'''
+    if project_id is not None:
+        missing += ' AND id=:project_id'
+    conn.execute(text('INSERT INTO project_counters (project_id) %s'
+                      % missing), params)
+    columns = COUNTERS + ('last_activity',)
+    aggregates = AGGREGATES_SQL % dict(where=where, filters=filters,
+                                       where_project=where_project)
+    sql = text('''UPDATE project_counters SET %s FROM (%s) AS counted
+               WHERE project_counters.project_id=counted.project_id
+               AND (%s) IS DISTINCT FROM (%s)''' % (
+        ', '.join('%s=counted.%s' % (name, name) for name in columns),
+        aggregates,
+        ', '.join('project_counters.%s' % name for name in columns),
+        ', '.join('counted.%s' % name for name in columns)))
+    return n_tasks + conn.execute(sql, params).rowcount
+
@@ -18,7 +18,8 @@
 """Dashboard queries to be used in admin dashboard view."""
 from sqlalchemy import text
 from sqlalchemy.exc import ProgrammingError
-from pybossa.core import db
+from pybossa.core import db, sentinel
+from pybossa.volunteer_counter import VolunteerCounter, use_approximate
 from datetime import datetime
 
 
@@ -39,14 +40,26 @@ def _select_from_materialized_view(view, n_days=None):
         raise
 
 
-def format_users_week():
-    """Return a variable with users data."""
+def format_users_week(approximate=None):
+    """Return a variable with users data.
+
+    With approximate (APPROXIMATE_VOLUNTEERS by default) they are counted
+    with the HyperLogLogs of every day instead of the materialized view.
+    """
+    if use_approximate(approximate):
+        return _graph_data_from_counter('registered')
     results = _select_from_materialized_view('dashboard_week_users')
     return _graph_data_from_query(results, 'n_users')
 
 
-def format_anon_week():
-    """Return a variable with anon data."""
+def format_anon_week(approximate=None):
+    """Return a variable with anon data.
+
+    With approximate (APPROXIMATE_VOLUNTEERS by default) they are counted
+    with the HyperLogLogs of every day instead of the materialized view.
+    """
+    if use_approximate(approximate):
+        return _graph_data_from_counter('anonymous')
     results = _select_from_materialized_view('dashboard_week_anon')
     return _graph_data_from_query(results, 'n_users')
 
@@ -121,6 +134,14 @@ def _graph_data_from_query(results, column, label=None):
     return new_users_week
 
 
+def _graph_data_from_counter(kind):
+    counter = VolunteerCounter(sentinel.master)
+    days = counter.count_per_day(kind, VolunteerCounter.DAYS)
+    return dict(labels=[day.strftime('%Y-%m-%d') for day, _ in days] or
+                [datetime.now().strftime('%Y-%m-%d')],
+                series=[[n_users for _, n_users in days] or [0]])
+
+
 def _format_projects_data(results):
     formatted_projects = []
     for row in results:
@@ -18,6 +18,7 @@
 """Dashboard Jobs module for running background tasks in PyBossa server."""
 from sqlalchemy import text
 from pybossa.core import db
+from pybossa.activity import project_activity_sql
 
 
 def _exists_materialized_view(view):
@@ -43,12 +44,10 @@ def active_users_week():
     else:
         sql = text('''CREATE MATERIALIZED VIEW dashboard_week_users AS
                    WITH crafters_per_day AS
-                        (select to_date(task_run.finish_time,
-                                        'YYYY-MM-DD\THH24:MI:SS.US') AS day,
+                        (select task_run.finish_time_ts::date AS day,
                                 user_id, COUNT(task_run.user_id) AS day_crafters
                         FROM task_run
-                        WHERE to_date(task_run.finish_time,
-                                      'YYYY-MM-DD\THH24:MI:SS.US')
+                        WHERE task_run.finish_time_ts
                             >= NOW() - ('1 week'):: INTERVAL
                         GROUP BY day, task_run.user_id)
                    SELECT day, COUNT(crafters_per_day.user_id) AS n_users
@@ -65,12 +64,10 @@ def active_anon_week():
     else:
         sql = text('''CREATE MATERIALIZED VIEW dashboard_week_anon AS
                    WITH crafters_per_day AS
-                        (select to_date(task_run.finish_time,
-                                        'YYYY-MM-DD\THH24:MI:SS.US') AS day,
+                        (select task_run.finish_time_ts::date AS day,
                                 user_ip, COUNT(task_run.user_ip) AS day_crafters
                         FROM task_run
-                        WHERE to_date(task_run.finish_time,
-                                      'YYYY-MM-DD\THH24:MI:SS.US')
+                        WHERE task_run.finish_time_ts
                             >= NOW() - ('1 week'):: INTERVAL
                         GROUP BY day, task_run.user_ip)
                    SELECT day, COUNT(crafters_per_day.user_ip) AS n_users
@@ -168,14 +165,11 @@ def new_task_runs_week():
         return _refresh_materialized_view('dashboard_week_new_task_run')
     else:
         sql = text('''CREATE MATERIALIZED VIEW dashboard_week_new_task_run AS
-                      SELECT TO_DATE(task_run.finish_time,
-                                     'YYYY-MM-DD\THH24:MI:SS.US') AS day,
-                      COUNT(task_run.id) AS day_task_runs
-                      FROM task_run WHERE TO_DATE(task_run.finish_time,
-                                              'YYYY-MM-DD\THH24:MI:SS.US')
-                                          >= now() - ('1 week'):: INTERVAL
-                      GROUP BY day;''')
-        db.session.execute(sql)
+                      SELECT hour::date AS day,
+                      SUM(n_anon + n_auth) AS day_task_runs
+                      FROM (%s) AS activity
+                      GROUP BY day;''' % project_activity_sql())
+        db.session.execute(sql, dict(period='1 week'))
         db.session.commit()
         return "Materialized view created"
 
@@ -205,11 +199,9 @@ def returning_users_week():
     else:
         sql = text('''CREATE MATERIALIZED VIEW dashboard_week_returning_users AS
                    WITH data AS (
-                    SELECT user_id, TO_DATE(task_run.finish_time,
-                    'YYYY-MM-DD\THH24:MI:SS.US') AS day
+                    SELECT user_id, task_run.finish_time_ts::date AS day
                    FROM task_run
-                   WHERE TO_DATE(task_run.finish_time,
-                   'YYYY-MM-DD\THH24:MI:SS.US') >= NOW()
+                   WHERE task_run.finish_time_ts >= NOW()
                    - ('1 week')::INTERVAL GROUP BY day, task_run.user_id)
                    SELECT user_id, COUNT(user_id) AS n_days
                    FROM data GROUP BY user_id HAVING(count(user_id) > 1)
@@ -64,6 +64,16 @@ REDIS_DB = 0
 
 REDIS_KEYPREFIX = 'pybossa_cache'
 
+# In process cache in front of Redis (disabled with 0 entries)
+LOCAL_CACHE_MAX_ENTRIES = 0
+LOCAL_CACHE_MAX_BYTES = 10 * 1024 * 1024
+LOCAL_CACHE_TIMEOUT = 5
+
+# Serialization of cached values: pickle, json or msgpack (if installed).
+# Values bigger than the threshold (in bytes) are compressed.
+CACHE_CODEC = 'pickle'
+CACHE_COMPRESS_THRESHOLD = 1024
+
 ## Default cache timeouts
 # Project cache
 AVATAR_TIMEOUT = 30 * 24 * 60 * 60
@@ -75,12 +85,16 @@ STATS_APP_TIMEOUT = 12 * 60 * 60
 STATS_DRAFT_TIMEOUT = 24 * 60 * 60
 N_APPS_PER_CATEGORY_TIMEOUT = 60 * 60
 BROWSE_TASKS_TIMEOUT = 3 * 60 * 60
+# Seconds the tasks browser of a project is still served after a new task or
+# task run before recomputing it
+PROJECT_RECOMPUTE_INTERVAL = 30
 # Category cache
 CATEGORY_TIMEOUT = 24 * 60 * 60
 # User cache
 USER_TIMEOUT = 15 * 60
 USER_TOP_TIMEOUT = 24 * 60 * 60
 USER_TOTAL_TIMEOUT = 24 * 60 * 60
+API_KEY_TIMEOUT = 5 * 60
 
 # Project Presenters
 PRESENTERS = ["basic", "image", "sound", "video", "map", "pdf"]
@@ -95,6 +109,10 @@ TEMPLATE_TASKS = {
 # Rate limits default values
 LIMIT = 300
 PER = 15 * 60
+# Rate limiter engine: token_bucket, fixed_window or sliding_window
+RATE_LIMIT_ENGINE = 'token_bucket'
+# Reject clients over their limit without asking Redis until they can retry
+RATE_LIMIT_LOCAL_CHECK = False
 
 # Expiration time for password protected project cookies
 PASSWD_COOKIE_TIMEOUT = 60 * 30
@@ -115,6 +133,18 @@ WEEKLY_UPDATE_STATS = 'Sunday'
 # Enable Server Sent Events
 SSE = False
 
+# Serve scheduler candidates from a pool of open tasks kept in Redis
+TASK_POOL = False
+
+# Seconds a task stays reserved for a user by the locked scheduler
+LOCKED_SCHED_TTL = 10 * 60
+
+# Count distinct volunteers with Redis HyperLogLogs instead of SQL
+APPROXIMATE_VOLUNTEERS = False
+
+# Apply the feed and webhook side effects of task runs in a worker
+ASYNC_TASK_RUN_EVENTS = False
+
 # Pro user features. False will make the feature available to all regular users,
 # while True will make it available only to pro users
 PRO_FEATURES = {
@@ -35,6 +35,7 @@ class ErrorStatus(object):
 
     This class has the following methods:
         * format_exception: returns a Flask Response with the error.
+        * format_status: returns the error as a dict.
 
     """
 
@@ -56,6 +57,15 @@ class ErrorStatus(object):
 
         Returns a Flask Response with the error.
 
+        """
+        error = self.format_status(e, target, action)
+        return Response(json.dumps(error), status=error['status_code'],
+                        mimetype='application/json')
+
+    def format_status(self, e, target, action):
+        """
+        Format the exception as a dict, for responses with many statuses.
+
         """
         exception_cls = e.__class__.__name__
         if self.error_status.get(exception_cls):
@@ -70,5 +80,4 @@ class ErrorStatus(object):
                      target=target,
                      exception_cls=exception_cls,
                      exception_msg=str(e.message))
-        return Response(json.dumps(error), status=status,
-                        mimetype='application/json')
+        return error
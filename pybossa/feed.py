@@ -28,9 +28,16 @@ FEED_KEY = 'pybossa_feed'
 
 def update_feed(obj):
     """Add domain object to update feed in Redis."""
+    update_feed_many([obj])
+
+def update_feed_many(objs):
+    """Add domain objects, in order, to update feed in a single round trip."""
     pipeline = sentinel.master.pipeline()
-    serialized_object = pickle.dumps(obj)
-    pipeline.zadd(FEED_KEY, time(), serialized_object)
+    now = time()
+    for i, obj in enumerate(objs):
+        serialized_object = pickle.dumps(obj)
+        # Keep the order of objects added within the same clock tick
+        pipeline.zadd(FEED_KEY, now + i * 1e-6, serialized_object)
     pipeline.execute()
 
 def get_update_feed():
@@ -130,10 +130,56 @@ def get_default_jobs():  # pragma: no cover
                timeout=(10 * MINUTE), queue='low')
     yield dict(name=warm_cache, args=[], kwargs={},
                timeout=(10 * MINUTE), queue='super')
+    yield dict(name=update_project_activity, args=[], kwargs={},
+               timeout=(10 * MINUTE), queue='super')
+    yield dict(name=sweep_cache_tags, args=[], kwargs={},
+               timeout=(10 * MINUTE), queue='high')
+    yield dict(name=process_task_run_events, args=[], kwargs={},
+               timeout=(10 * MINUTE), queue='high')
+    yield dict(name=reconcile_project_counters, args=[], kwargs={},
+               timeout=(10 * MINUTE), queue='low')
+    yield dict(name=rebuild_leaderboard, args=[], kwargs={},
+               timeout=(10 * MINUTE), queue='low')
     yield dict(name=news, args=[], kwargs={},
                timeout=(10 * MINUTE), queue='low')
 
 
+def process_task_run_events():
+    """Apply the task run events left in the queue."""
+    from pybossa.task_run_events import process_task_run_events as process
+    return process()
+
+
+def update_project_activity():
+    """Extend the hourly rollup of the projects activity."""
+    from pybossa.core import db
+    from pybossa.activity import update_project_activity as update
+    update(db.session)
+    return True
+
+
+def reconcile_project_counters():
+    """Repair the counters of the projects that drifted."""
+    from pybossa.core import db
+    from pybossa.counters import refresh
+    repaired = refresh(db.session)
+    db.session.commit()
+    return repaired
+
+
+def rebuild_leaderboard():
+    """Compute the leaderboards again, discounting deleted task runs."""
+    from pybossa.core import db, sentinel
+    from pybossa.leaderboard import Leaderboard
+    return Leaderboard(sentinel.master).rebuild(db.session)
+
+
+def sweep_cache_tags():
+    """Remove the expired keys from the cache tag sets."""
+    from pybossa.cache import sweep_tags
+    return sweep_tags()
+
+
 def get_export_task_jobs(queue):
     """Export tasks to zip."""
     from pybossa.core import project_repo
@@ -196,11 +242,9 @@ def get_inactive_users_jobs(queue='quaterly'):
                WHERE user_id IS NOT NULL
                AND user_id NOT IN
                (SELECT user_id FROM task_run WHERE user_id IS NOT NULL
-               AND to_date(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               >= NOW() - '3 month'::INTERVAL
+               AND task_run.finish_time_ts >= NOW() - '3 month'::INTERVAL
                GROUP BY task_run.user_id order by user_id)
-               AND to_date(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               >= NOW() - '1 year'::INTERVAL
+               AND task_run.finish_time_ts >= NOW() - '1 year'::INTERVAL
                GROUP BY user_id ORDER BY user_id;''')
     results = db.slave_session.execute(sql)
     for row in results:
@@ -231,10 +275,13 @@ def get_inactive_users_jobs(queue='quaterly'):
 
 def get_dashboard_jobs(queue='low'):  # pragma: no cover
     """Return dashboard jobs."""
-    yield dict(name=dashboard.active_users_week, args=[], kwargs={},
-               timeout=(10 * MINUTE), queue=queue)
-    yield dict(name=dashboard.active_anon_week, args=[], kwargs={},
-               timeout=(10 * MINUTE), queue=queue)
+    from pybossa.volunteer_counter import use_approximate
+    if not use_approximate():
+        # Otherwise counted with the HyperLogLogs of every day
+        yield dict(name=dashboard.active_users_week, args=[], kwargs={},
+                   timeout=(10 * MINUTE), queue=queue)
+        yield dict(name=dashboard.active_anon_week, args=[], kwargs={},
+                   timeout=(10 * MINUTE), queue=queue)
     yield dict(name=dashboard.draft_projects_week, args=[], kwargs={},
                timeout=(10 * MINUTE), queue=queue)
     yield dict(name=dashboard.published_projects_week, args=[], kwargs={},
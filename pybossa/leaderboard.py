@@ -0,0 +1,180 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Leaderboard of the registered users kept in Redis sorted sets.
+
+There is a sorted set for the whole site and one per project, where every
+member is a user id and its score the number of task runs the user has
+submitted. New task runs increment them, so ranks are read in O(log N)
+instead of ranking the task runs of every user.
+
+Ranks follow the SQL rank() function: users with the same score share the
+rank, and the next score skips as many ranks as users are tied.
+
+Task runs deleted afterwards are only discounted by rebuild, which computes
+all the sorted sets again from the task_run table. While it runs, new task
+runs are also recorded in a delta list, and the ones its snapshot of the
+table missed are counted again once the rebuilt sets replace the live ones.
+"""
+import uuid
+from sqlalchemy.sql import text
+from pybossa.core import sentinel
+
+
+def add_task_run(project_id, user_id, task_run_id=None):
+    """Count a new task run in the leaderboards."""
+    if user_id is not None:
+        Leaderboard(sentinel.master).add(user_id, project_id,
+                                         task_run_id=task_run_id)
+
+
+class Leaderboard(object):
+
+    KEY = 'pybossa:leaderboard'
+    PROJECT_KEY_PREFIX = 'pybossa:leaderboard:project:%s'
+    PROJECTS_KEY = 'pybossa:leaderboard:projects'
+    REBUILDING_KEY = 'pybossa:leaderboard:rebuilding'
+    DELTA_KEY = 'pybossa:leaderboard:delta'
+    REBUILD_TTL = 60 * 60
+    BATCH_SIZE = 1000
+
+    # Checking the rebuild flag in the same script as the increments, a
+    # rebuild either records the task run or has it in its snapshot
+    _add_script = """
+    redis.call('ZINCRBY', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('ZINCRBY', KEYS[2], ARGV[1], ARGV[2])
+    redis.call('SADD', KEYS[3], ARGV[3])
+    if ARGV[4] ~= '' and redis.call('EXISTS', KEYS[4]) == 1 then
+        redis.call('RPUSH', KEYS[5], ARGV[4])
+    end
+    """
+
+    def __init__(self, redis_conn):
+        self.conn = redis_conn
+        self._add = self.conn.register_script(self._add_script)
+
+    def add(self, user_id, project_id, score=1, task_run_id=None):
+        delta = ''
+        if task_run_id is not None:
+            delta = '%s:%s:%s:%s' % (task_run_id, project_id, user_id, score)
+        keys = [self.KEY, self._key(project_id), self.PROJECTS_KEY,
+                self.REBUILDING_KEY, self.DELTA_KEY]
+        self._add(keys=keys, args=[score, user_id, project_id, delta])
+
+    def top(self, n, project_id=None):
+        """Return the (rank, user_id, score) of the top n users."""
+        scores = self.conn.zrevrange(self._key(project_id), 0, n - 1,
+                                     withscores=True, score_cast_func=int)
+        top = []
+        rank = 0
+        for position, (user_id, score) in enumerate(scores):
+            if position == 0 or score != top[-1][2]:
+                rank = position + 1
+            top.append((rank, int(user_id), score))
+        return top
+
+    def rank_and_score(self, user_id, project_id=None):
+        """Return the rank and score of a user, or None if not ranked."""
+        key = self._key(project_id)
+        score = self.conn.zscore(key, user_id)
+        if score is None:
+            return None, None
+        # Users with a higher score, as rank() does
+        above = self.conn.zcount(key, '(%s' % score, '+inf')
+        return above + 1, int(score)
+
+    def rebuild(self, session):
+        """Compute every leaderboard from the task runs in the DB.
+
+        The session must be bound to the master, as the task runs the
+        snapshot misses are told apart by querying it again.
+        """
+        self.conn.delete(self.DELTA_KEY)
+        self.conn.set(self.REBUILDING_KEY, 1, ex=self.REBUILD_TTL)
+        # A single snapshot for the counts and the delta check below
+        connection = session.get_bind().connect().execution_options(
+            isolation_level='REPEATABLE READ')
+        trans = connection.begin()
+        try:
+            return self._rebuild(connection)
+        except Exception:
+            self.conn.delete(self.DELTA_KEY, self.REBUILDING_KEY)
+            raise
+        finally:
+            trans.rollback()
+            connection.close()
+
+    def _rebuild(self, connection):
+        sql = text('''SELECT project_id, user_id, COUNT(id) AS score
+                   FROM task_run WHERE user_id IS NOT NULL
+                   GROUP BY project_id, user_id''')
+        results = connection.execute(
+            sql.execution_options(stream_results=True))
+        # Built aside and renamed, so readers never see partial leaderboards
+        suffix = ':rebuild:%s' % uuid.uuid4().hex
+        project_ids = set()
+        pipe = self.conn.pipeline(transaction=False)
+        for n_rows, row in enumerate(results, 1):
+            pipe.zincrby(self.KEY + suffix, row.user_id, row.score)
+            pipe.zincrby(self._key(row.project_id) + suffix, row.user_id,
+                         row.score)
+            project_ids.add(row.project_id)
+            if n_rows % self.BATCH_SIZE == 0:
+                pipe.execute()
+        pipe.execute()
+        stale = self.conn.smembers(self.PROJECTS_KEY) - \
+            set(str(project_id) for project_id in project_ids)
+        pipe = self.conn.pipeline()
+        if project_ids:
+            for key in [self.KEY] + [self._key(project_id)
+                                     for project_id in project_ids]:
+                pipe.rename(key + suffix, key)
+        else:
+            pipe.delete(self.KEY)
+        for project_id in stale:
+            pipe.delete(self._key(project_id))
+        pipe.delete(self.PROJECTS_KEY)
+        if project_ids:
+            pipe.sadd(self.PROJECTS_KEY, *project_ids)
+        # From now on new task runs only increment the rebuilt sets
+        pipe.lrange(self.DELTA_KEY, 0, -1)
+        pipe.delete(self.DELTA_KEY, self.REBUILDING_KEY)
+        delta = pipe.execute()[-2]
+        self._replay(connection, delta)
+        return len(project_ids)
+
+    def _replay(self, connection, delta):
+        """Count again the task runs recorded that the snapshot missed."""
+        task_runs = {}
+        for entry in delta:
+            task_run_id, project_id, user_id, score = entry.split(':')
+            task_runs[int(task_run_id)] = (int(user_id), int(project_id),
+                                           int(score))
+        if not task_runs:
+            return
+        sql = text('SELECT id FROM task_run WHERE id = ANY(:ids)')
+        seen = connection.execute(sql, ids=list(task_runs)).fetchall()
+        for row in seen:
+            del task_runs[row.id]
+        for user_id, project_id, score in task_runs.values():
+            self.add(user_id, project_id, score)
+
+    def _key(self, project_id):
+        if project_id is None:
+            return self.KEY
+        return self.PROJECT_KEY_PREFIX % project_id
@@ -59,6 +59,20 @@ def make_timestamp():
     return now.isoformat()
 
 
+def parse_timestamp(timestamp):
+    """Return the datetime of a timestamp created by make_timestamp."""
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp
+    if isinstance(timestamp, datetime.date):
+        return datetime.datetime.combine(timestamp, datetime.time())
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(timestamp, fmt)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
 def make_uuid():
     return str(uuid.uuid4())
 
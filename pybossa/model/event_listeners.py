@@ -15,14 +15,17 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
-from datetime import datetime
 
+from flask import current_app
 from rq import Queue
-from sqlalchemy import event
+from sqlalchemy import event, inspect
+from sqlalchemy.sql import text
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.util import identity_key
 
 from pybossa.feed import update_feed
 from pybossa.model import update_project_timestamp, update_target_timestamp
-from pybossa.model import make_timestamp
+from pybossa.model import make_timestamp, parse_timestamp
 from pybossa.model.blogpost import Blogpost
 from pybossa.model.project import Project
 from pybossa.model.task import Task
@@ -31,29 +34,61 @@ from pybossa.model.webhook import Webhook
 from pybossa.model.user import User
 from pybossa.model.result import Result
 from pybossa.core import result_repo
-from pybossa.jobs import webhook, notify_blog_users
+from pybossa.jobs import notify_blog_users
 from pybossa.core import sentinel
+from pybossa.cache import projects as cached_projects
+from pybossa import counters
+from pybossa import volunteer_counter
+from pybossa import leaderboard
+from pybossa import task_run_events
+from pybossa.task_pool import get_task_pool
+from pybossa.task_lock import TaskLock
 
-webhook_queue = Queue('high', connection=sentinel.master)
 mail_queue = Queue('super', connection=sentinel.master)
 
 
+PROJECT_DATA = ('name', 'short_name', 'info', 'webhook')
+
+
+def get_project_data(conn, target):
+    """Return the name, short_name, info and webhook of the project of target.
+
+    The project is taken from the session if it was loaded already, as in
+    API requests, then from the cache and only then from the database.
+    """
+    project_id = target.project_id
+    state = inspect(target, raiseerr=False)
+    session = state.session if state is not None else None
+    if session is not None:
+        project = session.identity_map.get(identity_key(Project, project_id))
+        if project is not None and \
+                not inspect(project).unloaded.intersection(PROJECT_DATA):
+            return dict((key, getattr(project, key)) for key in PROJECT_DATA)
+    project = cached_projects.get_project_data(project_id)
+    if project is None:
+        # Not visible to the cache yet, as in the same transaction
+        cached_projects.delete_project_data(project_id)
+        sql_query = text('''SELECT name, short_name, info, webhook
+                         FROM project WHERE id=:project_id''')
+        for row in conn.execute(sql_query, dict(project_id=project_id)):
+            project = dict((key, getattr(row, key)) for key in PROJECT_DATA)
+    return project or dict.fromkeys(PROJECT_DATA)
+
+
+def get_feed_obj(conn, target, action_updated):
+    """Return the feed entry of an update of the project of target."""
+    project = get_project_data(conn, target)
+    return dict(id=target.project_id,
+                name=project['name'],
+                short_name=project['short_name'],
+                info=project['info'],
+                action_updated=action_updated)
+
+
 @event.listens_for(Blogpost, 'after_insert')
 def add_blog_event(mapper, conn, target):
     """Update PyBossa feed with new blog post."""
-    sql_query = ('select name, short_name, info from project \
-                 where id=%s') % target.project_id
-    results = conn.execute(sql_query)
-    obj = dict(id=target.project_id,
-               name=None,
-               short_name=None,
-               info=None,
-               action_updated='Blog')
-    for r in results:
-        obj['name'] = r.name
-        obj['short_name'] = r.short_name
-        obj['info'] = r.info
-    update_feed(obj)
+    update_feed(get_feed_obj(conn, target, 'Blog'))
     # Notify volunteers
     mail_queue.enqueue(notify_blog_users,
                        blog_id=target.id,
@@ -70,22 +105,144 @@ def add_project_event(mapper, conn, target):
     update_feed(obj)
 
 
+@event.listens_for(Project, 'after_insert')
+def add_project_counters(mapper, conn, target):
+    """Create the counters of a new project."""
+    counters.create(conn, target.id)
+
+
 @event.listens_for(Task, 'after_insert')
 def add_task_event(mapper, conn, target):
     """Update PyBossa feed with new task."""
-    sql_query = ('select name, short_name, info from project \
-                 where id=%s') % target.project_id
-    results = conn.execute(sql_query)
-    obj = dict(id=target.project_id,
-               name=None,
-               short_name=None,
-               info=None,
-               action_updated='Task')
-    for r in results:
-        obj['name'] = r.name
-        obj['short_name'] = r.short_name
-        obj['info'] = r.info
-    update_feed(obj)
+    update_feed(get_feed_obj(conn, target, 'Task'))
+
+
+def add_cache_event(target, update, *args):
+    """Call update(*args) once the session that flushed target commits."""
+    session = object_session(target)
+    session.info.setdefault('cache_events', []).append((update, args))
+
+
+def add_batched_cache_event(target, update, item):
+    """Call update(items) once with the items of all the targets committed
+    together."""
+    session = object_session(target)
+    batches = session.info.setdefault('cache_batches', {})
+    if update not in batches:
+        batches[update] = []
+        add_cache_event(target, update, batches[update])
+    batches[update].append(item)
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_cache_events(session):
+    """Update the cache with the changes just committed.
+
+    The changes are stored already, so a failing update is logged instead
+    of failing the commit or skipping the updates after it.
+    """
+    session.info.pop('cache_batches', None)
+    for update, args in session.info.pop('cache_events', []):
+        try:
+            update(*args)
+        except Exception:
+            current_app.logger.exception(
+                '%s failed after commit' % getattr(update, '__name__', update))
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_cache_events(session):
+    """Forget the cache updates of changes that were rolled back."""
+    session.info.pop('cache_batches', None)
+    session.info.pop('cache_events', None)
+
+
+def refresh_counters_on_flush(target, project_id):
+    """Recompute the counters of a project once target has been flushed."""
+    session = object_session(target)
+    session.info.setdefault('stale_counters', set()).add(project_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def refresh_stale_counters(session, flush_context):
+    """Recompute the counters of the projects with uncountable changes."""
+    for project_id in session.info.pop('stale_counters', ()):
+        counters.refresh(session, project_id)
+
+
+@event.listens_for(Task, 'after_insert')
+def update_task_cache(mapper, conn, target):
+    """Count the new task in the cached counters of its project."""
+    add_cache_event(target, cached_projects.task_created, target.project_id,
+                    target.state == 'completed')
+
+
+@event.listens_for(Task, 'after_insert')
+def count_task(mapper, conn, target):
+    """Count the new task in the counters of its project."""
+    completed = target.state == 'completed'
+    counters.increment(conn, target.project_id, n_tasks=1,
+                       n_completed_tasks=int(completed))
+
+
+@event.listens_for(Task, 'after_update')
+def count_task_state(mapper, conn, target):
+    """Count the tasks completed, or reopened, by an update."""
+    history = inspect(target).attrs.state.history
+    if not history.has_changes():
+        return
+    if not history.deleted:
+        # Not loaded before the change
+        refresh_counters_on_flush(target, target.project_id)
+        return
+    was_completed = history.deleted[0] == 'completed'
+    completed = target.state == 'completed'
+    if was_completed != completed:
+        counters.increment(conn, target.project_id,
+                           n_completed_tasks=1 if completed else -1)
+
+
+@event.listens_for(Task, 'after_delete')
+@event.listens_for(TaskRun, 'after_delete')
+def uncount_deleted(mapper, conn, target):
+    """Recompute the counters of the project of a deleted task or run."""
+    refresh_counters_on_flush(target, target.project_id)
+
+
+@event.listens_for(Result, 'after_update')
+def count_result(mapper, conn, target):
+    """Count the results that get, or lose, their info."""
+    history = inspect(target).attrs.info.history
+    if not history.has_changes():
+        return
+    if not history.deleted:
+        refresh_counters_on_flush(target, target.project_id)
+        return
+    had_info = history.deleted[0] is not None
+    has_info = target.info is not None
+    if had_info != has_info:
+        counters.increment(conn, target.project_id,
+                           n_results=1 if has_info else -1)
+
+
+@event.listens_for(Task, 'after_insert')
+@event.listens_for(Task, 'after_update')
+def update_task_pool(mapper, conn, target):
+    """Add, reprioritize or remove the task from the pool of open tasks."""
+    pool = get_task_pool()
+    if pool is not None:
+        if target.state == 'completed':
+            pool.remove_task(target.project_id, target.id)
+        else:
+            pool.add_task(target.project_id, target.id, target.priority_0)
+
+
+@event.listens_for(Task, 'after_delete')
+def remove_from_task_pool(mapper, conn, target):
+    """Remove a deleted task from the pool of open tasks."""
+    pool = get_task_pool()
+    if pool is not None:
+        pool.remove_task(target.project_id, target.id)
 
 
 @event.listens_for(User, 'after_insert')
@@ -96,110 +253,116 @@ def add_user_event(mapper, conn, target):
     update_feed(obj)
 
 
-def add_user_contributed_to_feed(conn, user_id, project_obj):
-    if user_id is not None:
-        sql_query = ('select fullname, name, info from "user" \
-                     where id=%s') % user_id
-        results = conn.execute(sql_query)
-        for r in results:
-            obj = dict(id=user_id,
-                       name=r.name,
-                       fullname=r.fullname,
-                       info=r.info,
-                       project_name=project_obj['name'],
-                       project_short_name=project_obj['short_name'],
-                       action_updated='UserContribution')
-        update_feed(obj)
-
-
-def is_task_completed(conn, task_id):
-    sql_query = ('select count(id) from task_run \
-                 where task_run.task_id=%s') % task_id
-    n_answers = conn.scalar(sql_query)
-    sql_query = ('select n_answers from task \
-                 where task.id=%s') % task_id
-    task_n_answers = conn.scalar(sql_query)
-    return (n_answers) >= task_n_answers
-
-
-def update_task_state(conn, task_id):
-    sql_query = ("UPDATE task SET state=\'completed\' \
-                 where id=%s") % task_id
+def increment_task_runs(conn, task_id, increment=1):
+    sql_query = ('UPDATE task SET n_task_runs=n_task_runs + %s \
+                 where id=%s') % (increment, task_id)
     conn.execute(sql_query)
 
 
-def push_webhook(project_obj, task_id, result_id):
-    if project_obj['webhook']:
-        payload = dict(event="task_completed",
-                       project_short_name=project_obj['short_name'],
-                       project_id=project_obj['id'],
-                       task_id=task_id,
-                       result_id=result_id,
-                       fired_at=datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
-        webhook_queue.enqueue(webhook, project_obj['webhook'], payload)
-
-
-def create_result(conn, project_id, task_id):
-    """Create a result for the given project and task."""
-    sql_query = ("SELECT id FROM task_run WHERE project_id=%s \
-                 AND task_id=%s") % (project_id, task_id)
-    results = conn.execute(sql_query)
-    task_run_ids = ", ".join(str(tr.id) for tr in results)
-
-    sql_query = ("""SELECT id FROM result WHERE project_id=%s \
-                   AND task_id=%s;""") % (project_id, task_id)
-
-    results = conn.execute(sql_query)
-
-    for r in results:
-        if r:
-            # Update result
-            sql_query = ("""UPDATE result SET last_version=false \
-                           WHERE id=%s;""") % (r.id)
-            conn.execute(sql_query)
-
-    sql_query = """INSERT INTO result
-                   (created, project_id, task_id, task_run_ids, last_version)
-                   VALUES ('%s', %s, %s, '{%s}', %s);""" % (make_timestamp(),
-                                                  project_id,
-                                                  task_id,
-                                                  task_run_ids,
-                                                  True)
-    conn.execute(sql_query)
-
-    sql_query = """SELECT id FROM result \
-                WHERE project_id=%s AND task_id=%s""" % (project_id, task_id)
+def release_task_lock(target, project_obj):
+    """Release the reservation of the task done by the locked scheduler."""
+    info = project_obj['info']
+    if isinstance(info, dict) and info.get('sched') == 'locked':
+        user = dict(user_id=target.user_id, user_ip=target.user_ip)
+        TaskLock(sentinel.master).release(target.task_id, user)
+
+
+# Counts the new task run, completes the task when it has enough answers
+# and, if so, adds a new version of its result, in a single statement. The
+# task row is locked first, so the state read is the one being updated.
+# Tasks not counted by cli.py backfill_n_task_runs yet are counted here.
+SUBMIT_SQL = '''
+    WITH locked AS (
+        SELECT id, state, COALESCE(n_task_runs,
+            (SELECT COUNT(id) - 1 FROM task_run WHERE task_id=:task_id))
+            AS n_task_runs
+        FROM task WHERE id=:task_id FOR UPDATE),
+    updated AS (
+        UPDATE task SET n_task_runs=locked.n_task_runs + 1,
+        state=(CASE WHEN locked.n_task_runs + 1 >= task.n_answers
+               THEN 'completed' ELSE task.state END)
+        FROM locked WHERE task.id=locked.id
+        RETURNING task.id, task.project_id,
+        task.n_task_runs >= task.n_answers AS completed,
+        (task.n_task_runs >= task.n_answers AND
+         locked.state IS DISTINCT FROM 'completed') AS newly_completed),
+    previous_results AS (
+        UPDATE result SET last_version=false FROM updated
+        WHERE updated.completed AND result.project_id=:project_id
+        AND result.task_id=updated.id),
+    new_result AS (
+        INSERT INTO result
+        (created, project_id, task_id, task_run_ids, last_version)
+        SELECT :created, :project_id, updated.id,
+        ARRAY(SELECT id FROM task_run WHERE project_id=:project_id
+              AND task_id=updated.id ORDER BY id), true
+        FROM updated WHERE updated.completed
+        RETURNING id),
+    counted AS (
+        UPDATE project_counters SET n_task_runs=n_task_runs + 1,
+        n_completed_tasks=n_completed_tasks +
+        (CASE WHEN updated.newly_completed AND
+              updated.project_id=:project_id THEN 1 ELSE 0 END),
+        %(volunteers)s
+        last_activity=GREATEST(last_activity, :finish_time)
+        FROM updated WHERE project_counters.project_id=:project_id),
+    counted_task AS (
+        UPDATE project_counters SET n_completed_tasks=n_completed_tasks + 1
+        FROM updated WHERE updated.newly_completed
+        AND updated.project_id != :project_id
+        AND project_counters.project_id=updated.project_id)
+    SELECT updated.completed, updated.newly_completed,
+    (SELECT id FROM new_result) AS result_id FROM updated'''
 
-    results = conn.execute(sql_query)
-    for r in results:
-        return r.id
 
 @event.listens_for(TaskRun, 'after_insert')
 def on_taskrun_submit(mapper, conn, target):
     """Update the task.state when n_answers condition is met."""
-    # Get project details
-    sql_query = ('select name, short_name, webhook, info from project \
-                 where id=%s') % target.project_id
-    results = conn.execute(sql_query)
-    project_obj = dict(id=target.project_id,
-                   name=None,
-                   short_name=None,
-                   info=None,
-                   webhook=None,
-                   action_updated='TaskCompleted')
-    for r in results:
-        project_obj['name'] = r.name
-        project_obj['short_name'] = r.short_name
-        project_obj['info'] = r.info
-        project_obj['webhook'] = r.webhook
-        project_obj['id'] = target.project_id
-
-    add_user_contributed_to_feed(conn, target.user_id, project_obj)
-    if is_task_completed(conn, target.task_id):
-        update_task_state(conn, target.task_id)
-        update_feed(project_obj)
-        result_id = create_result(conn, target.project_id, target.task_id)
-        push_webhook(project_obj, target.task_id, result_id)
+    project_obj = get_project_data(conn, target)
+    pool = get_task_pool()
+    if pool is not None:
+        user = dict(user_id=target.user_id, user_ip=target.user_ip)
+        pool.add_contribution(target.project_id, target.task_id, user)
+    release_task_lock(target, project_obj)
+    volunteers, params = counters.volunteer_increment(target)
+    params.update(task_id=target.task_id, project_id=target.project_id,
+                  created=make_timestamp(), finish_time=target.finish_time)
+    row = conn.execute(text(SUBMIT_SQL % dict(volunteers=volunteers)),
+                       params).first()
+    task_completed = bool(row and row.completed)
+    # Answers beyond n_answers don't complete the task again
+    newly_completed = bool(row and row.newly_completed)
+    add_cache_event(target, cached_projects.task_run_created,
+                    target.project_id, newly_completed)
+    if volunteer_counter.use_approximate():
+        add_cache_event(target, volunteer_counter.add_task_run,
+                        target.project_id, target.user_id, target.user_ip,
+                        target.finish_time_ts)
+    add_cache_event(target, leaderboard.add_task_run, target.project_id,
+                    target.user_id, target.id)
+    # The feed and the webhook are left for after the commit
+    add_batched_cache_event(target, task_run_events.emit, dict(
+        task_run_id=target.id, project_id=target.project_id,
+        task_id=target.task_id, user_id=target.user_id,
+        completed=task_completed,
+        result_id=row.result_id if task_completed else None))
+    if task_completed and pool is not None:
+        pool.remove_task(target.project_id, target.task_id)
+
+
+@event.listens_for(TaskRun, 'before_insert')
+@event.listens_for(TaskRun, 'before_update')
+def update_finish_time_ts(mapper, conn, target):
+    """Keep task_run.finish_time_ts in sync with task_run.finish_time."""
+    if target.finish_time is None:
+        target.finish_time = make_timestamp()
+    target.finish_time_ts = parse_timestamp(target.finish_time)
+
+
+@event.listens_for(TaskRun, 'after_delete')
+def on_taskrun_delete(mapper, conn, target):
+    """Keep task.n_task_runs in sync when a task run is deleted."""
+    increment_task_runs(conn, target.task_id, -1)
 
 
 @event.listens_for(Blogpost, 'after_insert')
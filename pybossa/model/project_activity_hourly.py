@@ -0,0 +1,44 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import Integer, DateTime
+from sqlalchemy.schema import Column, ForeignKey, Index
+
+from pybossa.core import db
+
+
+class ProjectActivityHourly(db.Model):
+    '''Answers and completed tasks of a project in a given hour.
+
+    Rows are maintained by the update_project_activity job.
+    '''
+    __tablename__ = 'project_activity_hourly'
+    __table_args__ = (
+        Index('project_activity_hourly_hour_idx', 'hour'),)
+
+    #: Project.id of the project the activity belongs to.
+    project_id = Column(Integer, ForeignKey('project.id', ondelete='CASCADE'),
+                        primary_key=True)
+    #: UTC hour (truncated timestamp) of the activity.
+    hour = Column(DateTime, primary_key=True)
+    #: Task runs submitted by anonymous users.
+    n_anon = Column(Integer, default=0, nullable=False)
+    #: Task runs submitted by authenticated users.
+    n_auth = Column(Integer, default=0, nullable=False)
+    #: Tasks completed, by the hour of their last task run.
+    n_completed_tasks = Column(Integer, default=0, nullable=False)
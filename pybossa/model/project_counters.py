@@ -0,0 +1,50 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+from sqlalchemy import Integer, Text
+from sqlalchemy.schema import Column, ForeignKey
+
+from pybossa.core import db
+
+
+class ProjectCounters(db.Model):
+    '''Counters of the tasks, task runs and results of a project.
+
+    Rows are kept up to date by the event listeners, and repaired by the
+    reconcile_project_counters job.
+    '''
+    __tablename__ = 'project_counters'
+
+    #: Project.id of the project the counters belong to.
+    project_id = Column(Integer, ForeignKey('project.id', ondelete='CASCADE'),
+                        primary_key=True)
+    #: Number of tasks.
+    n_tasks = Column(Integer, server_default='0', nullable=False)
+    #: Number of tasks with state completed.
+    n_completed_tasks = Column(Integer, server_default='0', nullable=False)
+    #: Number of task runs.
+    n_task_runs = Column(Integer, server_default='0', nullable=False)
+    #: Number of results with info.
+    n_results = Column(Integer, server_default='0', nullable=False)
+    #: Number of distinct authenticated users with task runs.
+    n_registered_volunteers = Column(Integer, server_default='0',
+                                     nullable=False)
+    #: Number of distinct IPs of anonymous users with task runs.
+    n_anonymous_volunteers = Column(Integer, server_default='0',
+                                    nullable=False)
+    #: finish_time of the last task run.
+    last_activity = Column(Text)
@@ -17,7 +17,7 @@
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
 from sqlalchemy import Integer, Boolean, Float, UnicodeText, Text
-from sqlalchemy.schema import Column, ForeignKey
+from sqlalchemy.schema import Column, ForeignKey, Index
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.dialects.postgresql import JSON
 
@@ -31,7 +31,8 @@ class Task(db.Model, DomainObject):
     associated to a project.
     '''
     __tablename__ = 'task'
-
+    __table_args__ = (Index('task_project_id_state_n_task_runs_idx',
+                            'project_id', 'state', 'n_task_runs', 'id'),)
 
     #: Task.ID
     id = Column(Integer, primary_key=True)
@@ -50,6 +51,9 @@ class Task(db.Model, DomainObject):
     info = Column(JSON)
     #: Number of answers to collect for this task.
     n_answers = Column(Integer, default=30)
+    #: Number of task runs submitted for this task. NULL until counted by
+    #: cli.py backfill_n_task_runs for tasks older than the column.
+    n_task_runs = Column(Integer, default=0, server_default='0')
 
     task_runs = relationship(TaskRun, cascade='all, delete, delete-orphan', backref='task')
 
@@ -60,3 +64,9 @@ class Task(db.Model, DomainObject):
             return float(len(self.task_runs)) / self.n_answers
         else:  # pragma: no cover
             return float(0)
+
+
+# Open tasks of a project in the order used by the depth first scheduler
+Index('task_project_id_priority_0_id_open_idx',
+      Task.project_id, Task.priority_0.desc(), Task.id,
+      postgresql_where=(Task.state != u'completed'))
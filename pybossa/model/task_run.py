@@ -16,8 +16,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
-from sqlalchemy import Integer, Text
-from sqlalchemy.schema import Column, ForeignKey
+from sqlalchemy import Integer, Text, DateTime, event
+from sqlalchemy.schema import Column, ForeignKey, Index, DDL
 from sqlalchemy.dialects.postgresql import JSON
 
 from pybossa.core import db
@@ -29,6 +29,15 @@ class TaskRun(db.Model, DomainObject):
     '''A run of a given task by a specific user.
     '''
     __tablename__ = 'task_run'
+    __table_args__ = (
+        Index('task_run_project_id_user_id_task_id_idx',
+              'project_id', 'user_id', 'task_id'),
+        Index('task_run_project_id_user_ip_task_id_idx',
+              'project_id', 'user_ip', 'task_id'),
+        Index('task_run_task_id_idx', 'task_id'),
+        Index('task_run_project_id_finish_time_ts_idx',
+              'project_id', 'finish_time_ts'),
+        Index('task_run_finish_time_ts_idx', 'finish_time_ts'))
 
     #: ID of the TaskRun
     id = Column(Integer, primary_key=True)
@@ -45,6 +54,8 @@ class TaskRun(db.Model, DomainObject):
     user_ip = Column(Text)
     #: UTC timestamp for when TaskRun is saved to DB.
     finish_time = Column(Text, default=make_timestamp)
+    #: finish_time as a timestamp, so time windows can use an index.
+    finish_time_ts = Column(DateTime)
     timeout = Column(Integer)
     calibration = Column(Integer)
     #: Value of the answer.
@@ -56,3 +67,26 @@ class TaskRun(db.Model, DomainObject):
             whatever information should be recorded -- up to task presenter
         }
     '''
+
+    def dictize(self):
+        out = super(TaskRun, self).dictize()
+        # Internal copy of finish_time, not exposed
+        del out['finish_time_ts']
+        return out
+
+
+# finish_time_ts is also set by the DB, for task runs not inserted by the ORM
+event.listen(TaskRun.__table__, 'after_create', DDL('''
+    CREATE OR REPLACE FUNCTION task_run_finish_time_ts() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.finish_time ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}' THEN
+            NEW.finish_time_ts := NEW.finish_time::timestamp;
+        ELSE
+            NEW.finish_time_ts := NULL;
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    CREATE TRIGGER task_run_finish_time_ts
+    BEFORE INSERT OR UPDATE OF finish_time ON task_run
+    FOR EACH ROW EXECUTE PROCEDURE task_run_finish_time_ts()'''))
@@ -22,11 +22,21 @@ Rate limit module for limiting the requests in the API.
 This module exports:
     * RateLimit class: for limiting the requests
     * ratelimit decorator: for decorating the views
+    * FixedWindow, SlidingWindow and TokenBucket: the limiter engines
+
+The engine is chosen with the RATE_LIMIT_ENGINE setting. Each one checks and
+counts a request in a single round trip to the Redis master. Clients are
+limited by user when authenticated, by session or API key, and by IP
+otherwise.
 
 """
+import math
+import random
+import threading
 import time
 from functools import update_wrapper, wraps
-from flask import request, g
+from flask import request, g, current_app
+from flask.ext.login import current_user
 from werkzeug.exceptions import TooManyRequests
 from pybossa.core import sentinel
 from pybossa.error import ErrorStatus
@@ -34,33 +44,187 @@ from pybossa.error import ErrorStatus
 error = ErrorStatus()
 
 
+class FixedWindow(object):
+
+    """Count the requests in fixed windows of `per` seconds."""
+
+    expiration_window = 10
+
+    def __init__(self, redis_conn):
+        self.conn = redis_conn
+
+    def hit(self, key, limit, per, now):
+        """Count a request. Return (remaining, over_limit, reset, retry_at)."""
+        reset = (int(now) // per) * per + per
+        p = self.conn.pipeline()
+        p.incr(key + str(reset))
+        p.expireat(key + str(reset), reset + self.expiration_window)
+        current = min(p.execute()[0], limit)
+        return limit - current, current >= limit, reset, reset
+
+
+class SlidingWindow(object):
+
+    """Keep a log of the requests of the last `per` seconds.
+
+    Unlike the fixed window, a client can't make twice the limit around the
+    end of a window. At most `limit` requests are logged per client.
+    """
+
+    _script = """
+    local now = tonumber(ARGV[1])
+    local per = tonumber(ARGV[2])
+    local limit = tonumber(ARGV[3])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - per)
+    local current = redis.call('ZCARD', KEYS[1])
+    if current < limit then
+        redis.call('ZADD', KEYS[1], now, ARGV[4])
+        current = current + 1
+    end
+    redis.call('EXPIRE', KEYS[1], math.ceil(per))
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    -- Lua numbers are truncated to integers in replies
+    return {current, tostring(tonumber(oldest[2]) + per)}
+    """
+
+    def __init__(self, redis_conn):
+        self.conn = redis_conn
+        self._hit = self.conn.register_script(self._script)
+
+    def hit(self, key, limit, per, now):
+        """Count a request. Return (remaining, over_limit, reset, retry_at)."""
+        member = '%f:%s' % (now, random.random())
+        current, reset = self._hit(keys=[key], args=[now, per, limit, member])
+        reset = float(reset)
+        return limit - current, current >= limit, int(math.ceil(reset)), reset
+
+
+class TokenBucket(object):
+
+    """Refill a bucket of `limit` tokens at `limit / per` tokens a second.
+
+    Each request takes a token, so bursts are allowed up to the size of the
+    bucket and the sustained rate is smoothed.
+    """
+
+    _script = """
+    local now = tonumber(ARGV[1])
+    local per = tonumber(ARGV[2])
+    local limit = tonumber(ARGV[3])
+    local rate = limit / per
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or limit
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(limit, tokens + math.max(0, now - ts) * rate)
+    local over_limit = 1
+    if tokens >= 1 then
+        tokens = tokens - 1
+        over_limit = 0
+    end
+    redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', ARGV[1])
+    redis.call('EXPIRE', KEYS[1], math.ceil(per))
+    return {math.floor(tokens), over_limit,
+            tostring(now + (limit - tokens) / rate),
+            tostring(now + math.max(0, 1 - tokens) / rate)}
+    """
+
+    def __init__(self, redis_conn):
+        self.conn = redis_conn
+        self._hit = self.conn.register_script(self._script)
+
+    def hit(self, key, limit, per, now):
+        """Count a request. Return (remaining, over_limit, reset, retry_at)."""
+        remaining, over_limit, reset, retry_at = self._hit(
+            keys=[key], args=[now, per, limit])
+        return (remaining, bool(over_limit), int(math.ceil(float(reset))),
+                float(retry_at))
+
+
+ENGINES = dict(fixed_window=FixedWindow,
+               sliding_window=SlidingWindow,
+               token_bucket=TokenBucket)
+
+_engines = dict()
+
+
+def get_engine(name=None):
+    """Return the limiter engine, RATE_LIMIT_ENGINE by default."""
+    if name is None:
+        name = current_app.config.get('RATE_LIMIT_ENGINE', 'token_bucket')
+    if name not in _engines:
+        _engines[name] = ENGINES[name](sentinel.master)
+    return _engines[name]
+
+
+class LocalBlocks(object):
+
+    """Clients known to be over their limit, and until when, per process.
+
+    A client is only recorded once Redis says it is over the limit, and
+    until the time Redis says it can try again, so its requests can be
+    rejected without asking Redis.
+    """
+
+    max_size = 10000
+
+    def __init__(self):
+        self._blocked = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        """Return the (reset, retry_at) of a blocked client, or None."""
+        blocked = self._blocked.get(key)
+        if blocked is not None and blocked[1] > now:
+            return blocked
+        return None
+
+    def add(self, key, reset, retry_at, now):
+        with self._lock:
+            if len(self._blocked) >= self.max_size:
+                self._blocked = dict((k, v) for k, v in self._blocked.items()
+                                     if v[1] > now)
+            if len(self._blocked) < self.max_size:
+                self._blocked[key] = (reset, retry_at)
+
+    def clear(self):
+        with self._lock:
+            self._blocked = dict()
+
+
+local_blocks = LocalBlocks()
+
+
 class RateLimit(object):
 
     """
     Limit the number of requests.
 
-    It uses a Redis pipe from the master node (configured via Sentinel) to
-    limit the number of requests.
+    The requests are counted by a limiter engine in the master node
+    (configured via Sentinel). With RATE_LIMIT_LOCAL_CHECK, clients already
+    over the limit are rejected without a call to Redis until they can try
+    again.
 
     """
 
-    expiration_window = 10
-
-    def __init__(self, key_prefix, limit, per, send_x_headers):
-        self.reset = (int(time.time()) // per) * per + per
-        self.key = key_prefix + str(self.reset)
+    def __init__(self, key_prefix, limit, per, send_x_headers, engine=None):
+        self.key = key_prefix
         self.limit = limit
         self.per = per
         self.send_x_headers = send_x_headers
+        now = time.time()
+        local_check = current_app.config.get('RATE_LIMIT_LOCAL_CHECK')
+        blocked = local_blocks.get(key_prefix, now) if local_check else None
+        if blocked is not None:
+            self.remaining, self.over_limit = 0, True
+            self.reset, self.retry_at = blocked
+            return
+        engine = engine or get_engine()
+        (self.remaining, self.over_limit,
+         self.reset, self.retry_at) = engine.hit(key_prefix, limit, per, now)
+        if local_check and self.over_limit:
+            local_blocks.add(key_prefix, self.reset, self.retry_at, now)
 
-        p = sentinel.master.pipeline()
-        p.incr(self.key)
-        p.expireat(self.key, self.reset + self.expiration_window)
-
-        self.current = min(p.execute()[0], limit)
-
-    remaining = property(lambda x: x.limit - x.current)
-    over_limit = property(lambda x: x.current >= x.limit)
+    current = property(lambda x: x.limit - x.remaining)
 
 
 def get_view_rate_limit():
@@ -68,8 +232,15 @@ def get_view_rate_limit():
     return getattr(g, '_view_rate_limit', None)
 
 
+def get_client_scope():
+    """Return the user for authenticated requests, the IP otherwise."""
+    if current_user.is_authenticated():
+        return 'user:%s' % current_user.id
+    return request.remote_addr
+
+
 def ratelimit(limit, per, send_x_headers=True,
-              scope_func=lambda: request.remote_addr,
+              scope_func=get_client_scope,
               key_func=lambda: request.endpoint,
               path=lambda: request.path):
     """
@@ -85,7 +256,6 @@ def ratelimit(limit, per, send_x_headers=True,
                 key = 'rate-limit/%s/%s/' % (key_func(), scope_func())
                 rlimit = RateLimit(key, limit, per, send_x_headers)
                 g._view_rate_limit = rlimit
-                #if over_limit is not None and rlimit.over_limit:
                 if rlimit.over_limit:
                     raise TooManyRequests
                 return f(*args, **kwargs)
@@ -74,6 +74,7 @@ class ProjectRepository(object):
             self.db.session.merge(project)
             self.db.session.commit()
             cached_projects.delete_project(project.short_name)
+            cached_projects.delete_project_data(project.id)
         except IntegrityError as e:
             self.db.session.rollback()
             raise DBIntegrityError(e)
@@ -84,6 +85,7 @@ class ProjectRepository(object):
         self.db.session.delete(project)
         self.db.session.commit()
         cached_projects.delete_project(project.short_name)
+        cached_projects.delete_project_data(project.id)
         cached_projects.clean(project.id)
         self._delete_zip_files_from_store(project)
 
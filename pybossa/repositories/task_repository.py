@@ -27,7 +27,9 @@ from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
 from pybossa.exc import WrongObjectError, DBIntegrityError
 from pybossa.cache import projects as cached_projects
+from pybossa import counters
 from pybossa.core import uploader
+from pybossa.task_pool import get_task_pool
 
 
 def generate_query_from_keywords(model, **kwargs):
@@ -46,9 +48,23 @@ class TaskRepository(object):
         self.db = db
 
     # Methods for queries on Task objects
-    def get_task(self, id):
+    def get_task(self, id, for_update=False):
+        """Return a task. With for_update, its row is locked until commit."""
+        if for_update:
+            query = self.db.session.query(Task).filter(Task.id == id)
+            return query.with_for_update().first()
         return self.db.session.query(Task).get(id)
 
+    def get_tasks(self, ids, for_update=False):
+        if not ids:
+            return []
+        # Always locked in the same order, so they can't deadlock
+        query = self.db.session.query(Task).filter(Task.id.in_(ids))
+        query = query.order_by(Task.id)
+        if for_update:
+            query = query.with_for_update()
+        return query.all()
+
     def get_task_by(self, **attributes):
         filters = generate_query_from_keywords(Task, **attributes)
         return self.db.session.query(Task).filter(*filters).first()
@@ -98,14 +114,34 @@ class TaskRepository(object):
         query_args = generate_query_from_keywords(TaskRun, **filters)
         return self.db.session.query(TaskRun).filter(*query_args).count()
 
+    def get_contributed_task_ids(self, task_ids, user_id=None, user_ip=None):
+        """Return the ids, among task_ids, of the tasks the user answered."""
+        if not task_ids:
+            return set()
+        query = self.db.session.query(TaskRun.task_id).filter(
+            TaskRun.task_id.in_(task_ids), TaskRun.user_id == user_id,
+            TaskRun.user_ip == user_ip)
+        return set(row.task_id for row in query)
+
 
     # Methods for saving, deleting and updating both Task and TaskRun objects
     def save(self, element):
         self._validate_can_be('saved', element)
         try:
+            # The cache is updated by the event listeners on commit
             self.db.session.add(element)
             self.db.session.commit()
-            cached_projects.clean_project(element.project_id)
+        except IntegrityError as e:
+            self.db.session.rollback()
+            raise DBIntegrityError(e)
+
+    def save_many(self, elements):
+        """Save the elements in a single transaction."""
+        for element in elements:
+            self._validate_can_be('saved', element)
+        try:
+            self.db.session.add_all(elements)
+            self.db.session.commit()
         except IntegrityError as e:
             self.db.session.rollback()
             raise DBIntegrityError(e)
@@ -136,8 +172,10 @@ class TaskRepository(object):
                    WHERE result.project_id=:project_id GROUP BY result.task_id);
                    ''')
         self.db.session.execute(sql, dict(project_id=project.id))
+        counters.refresh(self.db.session, project.id)
         self.db.session.commit()
         cached_projects.clean_project(project.id)
+        self._invalidate_task_pool(project.id)
         self._delete_zip_files_from_store(project)
 
     def update_tasks_redundancy(self, project, n_answer):
@@ -145,24 +183,14 @@ class TaskRepository(object):
         Use raw SQL for performance"""
         sql = text('''
                    UPDATE task SET n_answers=:n_answers,
-                   state='ongoing' WHERE project_id=:project_id''')
-        self.db.session.execute(sql, dict(n_answers=n_answer, project_id=project.id))
-        # Update task.state according to their new n_answers value
-        sql = text('''
-                   WITH project_tasks AS (
-                   SELECT task.id, task.n_answers,
-                   COUNT(task_run.id) AS n_task_runs, task.state
-                   FROM task, task_run
-                   WHERE task_run.task_id=task.id AND task.project_id=:project_id
-                   GROUP BY task.id)
-                   UPDATE task SET state='completed'
-                   FROM project_tasks
-                   WHERE (project_tasks.n_task_runs >=:n_answers)
-                   and project_tasks.id=task.id
-                   ''')
+                   state=(CASE WHEN n_task_runs >= :n_answers
+                          THEN 'completed' ELSE 'ongoing' END)
+                   WHERE project_id=:project_id''')
         self.db.session.execute(sql, dict(n_answers=n_answer, project_id=project.id))
+        counters.refresh(self.db.session, project.id)
         self.db.session.commit()
         cached_projects.clean_project(project.id)
+        self._invalidate_task_pool(project.id)
 
     def _validate_can_be(self, action, element):
         if not isinstance(element, Task) and not isinstance(element, TaskRun):
@@ -176,6 +204,12 @@ class TaskRepository(object):
         inst = self.db.session.query(table).filter(table.id==element.id).first()
         self.db.session.delete(inst)
 
+    def _invalidate_task_pool(self, project_id):
+        # Bulk SQL updates skip the ORM listeners that keep the pool in sync
+        pool = get_task_pool()
+        if pool is not None:
+            pool.invalidate(project_id)
+
     def _delete_zip_files_from_store(self, project):
         from pybossa.core import json_exporter, csv_exporter
         global uploader
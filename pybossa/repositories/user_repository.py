@@ -21,6 +21,7 @@ from sqlalchemy.exc import IntegrityError
 
 from pybossa.model.user import User
 from pybossa.exc import WrongObjectError, DBIntegrityError
+from pybossa.cache import users as cached_users
 
 
 class UserRepository(object):
@@ -77,6 +78,8 @@ class UserRepository(object):
         try:
             self.db.session.merge(new_user)
             self.db.session.commit()
+            # The name or admin flag served to API key requests may change
+            cached_users.delete_api_key_user(new_user.api_key)
         except IntegrityError as e:
             self.db.session.rollback()
             raise DBIntegrityError(e)
@@ -16,29 +16,50 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 """Scheduler module for PyBossa tasks."""
+from flask import current_app
 from sqlalchemy.sql import text
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
-from pybossa.core import db
+from pybossa.core import db, sentinel
+from pybossa.task_pool import get_task_pool
+from pybossa.task_lock import TaskLock
 import random
 
 
 session = db.slave_session
 
+# Number of candidates the locked scheduler tries to reserve per request
+LOCKED_SCHED_CANDIDATES = 100
+
 
 def new_task(project_id, sched, user_id=None, user_ip=None, offset=0):
     """Get a new task by calling the appropriate scheduler function."""
+    tasks = new_tasks(project_id, sched, user_id, user_ip, offset=offset)
+    return _first(tasks)
+
+
+def new_tasks(project_id, sched, user_id=None, user_ip=None, offset=0,
+              limit=1):
+    """Get up to limit distinct new tasks from a single scheduler pass."""
     sched_map = {
-        'default': get_depth_first_task,
-        'breadth_first': get_breadth_first_task,
-        'depth_first': get_depth_first_task,
-        'incremental': get_incremental_task}
+        'default': get_depth_first_tasks,
+        'breadth_first': get_breadth_first_tasks,
+        'depth_first': get_depth_first_tasks,
+        'incremental': get_incremental_tasks,
+        'locked': get_locked_tasks}
     scheduler = sched_map.get(sched, sched_map['default'])
-    return scheduler(project_id, user_id, user_ip, offset=offset)
+    return scheduler(project_id, user_id, user_ip, offset=offset, limit=limit)
 
 
 def get_breadth_first_task(project_id, user_id=None, user_ip=None, offset=0):
-    """Get a new task which have the least number of task runs.
+    """Get a new task which have the least number of task runs."""
+    return _first(get_breadth_first_tasks(project_id, user_id, user_ip,
+                                          offset=offset))
+
+
+def get_breadth_first_tasks(project_id, user_id=None, user_ip=None, offset=0,
+                            limit=1):
+    """Get new tasks which have the least number of task runs.
 
     It excludes the current user.
 
@@ -48,76 +69,183 @@ def get_breadth_first_task(project_id, user_id=None, user_ip=None, offset=0):
     """
     if user_id and not user_ip:
         sql = text('''
-                   SELECT task.id, COUNT(task_run.task_id) AS taskcount
-                   FROM task
-                   LEFT JOIN task_run ON (task.id = task_run.task_id)
+                   SELECT task.id FROM task
                    WHERE NOT EXISTS
                    (SELECT 1 FROM task_run WHERE project_id=:project_id AND
                    user_id=:user_id AND task_id=task.id)
                    AND task.project_id=:project_id AND task.state !='completed'
-                   group by task.id ORDER BY taskcount, id ASC LIMIT 10;
+                   ORDER BY task.n_task_runs, id ASC LIMIT :limit;
                    ''')
         rows = session.execute(sql,
-                               dict(project_id=project_id, user_id=user_id))
+                               dict(project_id=project_id, user_id=user_id,
+                                    limit=_candidates_limit(offset, limit)))
     else:
         if not user_ip:  # pragma: no cover
             user_ip = '127.0.0.1'
         sql = text('''
-                   SELECT task.id, COUNT(task_run.task_id) AS taskcount
-                   FROM task
-                   LEFT JOIN task_run ON (task.id = task_run.task_id)
+                   SELECT task.id FROM task
                    WHERE NOT EXISTS
                    (SELECT 1 FROM task_run WHERE project_id=:project_id AND
                    user_ip=:user_ip AND task_id=task.id)
                    AND task.project_id=:project_id AND task.state !='completed'
-                   group by task.id ORDER BY taskcount, id ASC LIMIT 10;
+                   ORDER BY task.n_task_runs, id ASC LIMIT :limit;
                    ''')
 
         rows = session.execute(sql,
-                               dict(project_id=project_id, user_ip=user_ip))
+                               dict(project_id=project_id, user_ip=user_ip,
+                                    limit=_candidates_limit(offset, limit)))
     task_ids = [x[0] for x in rows]
-    total_remaining = len(task_ids) - offset
-    if total_remaining <= 0:
-        return None
-    return session.query(Task).get(task_ids[offset])
+    return _get_tasks(task_ids[offset:offset + limit])
 
 
 def get_depth_first_task(project_id, user_id=None, user_ip=None, offset=0):
     """Get a new task for a given project."""
-    candidate_task_ids = get_candidate_task_ids(project_id, user_id, user_ip)
-    total_remaining = len(candidate_task_ids) - offset
-    if total_remaining <= 0:
-        return None
-    return session.query(Task).get(candidate_task_ids[offset])
+    return _first(get_depth_first_tasks(project_id, user_id, user_ip,
+                                        offset=offset))
+
+
+def get_depth_first_tasks(project_id, user_id=None, user_ip=None, offset=0,
+                          limit=1):
+    """Get new tasks for a given project."""
+    candidate_task_ids = get_candidate_task_ids(
+        project_id, user_id, user_ip, limit=_candidates_limit(offset, limit))
+    return _get_tasks(candidate_task_ids[offset:offset + limit])
 
 
 def get_incremental_task(project_id, user_id=None, user_ip=None, offset=0):
-    """Get a new task for a given project with its last given answer.
+    """Get a new task for a given project with its last given answer."""
+    return _first(get_incremental_tasks(project_id, user_id, user_ip,
+                                        offset=offset))
+
+
+def get_incremental_tasks(project_id, user_id=None, user_ip=None, offset=0,
+                          limit=1):
+    """Get new tasks for a given project with their last given answer.
 
     It is an important strategy when dealing with large tasks, as
     transcriptions.
     """
-    candidate_task_ids = get_candidate_task_ids(project_id, user_id, user_ip)
+    candidate_task_ids = get_candidate_task_ids(
+        project_id, user_id, user_ip, limit=_candidates_limit(0, limit))
     total_remaining = len(candidate_task_ids)
     if total_remaining == 0:
-        return None
-    rand = random.randrange(0, total_remaining)
-    task_id = candidate_task_ids[rand]
-    task = session.query(Task).get(task_id)
-    # Find last answer for the task
-    q = session.query(TaskRun)\
-        .filter(TaskRun.task_id == task.id)\
-        .order_by(TaskRun.finish_time.desc())
-    last_task_run = q.first()
-    if last_task_run:
-        task.info['last_answer'] = last_task_run.info
-        # TODO: As discussed in GitHub #53
-        # it is necessary to create a lock in the task!
-    return task
-
-
-def get_candidate_task_ids(project_id, user_id=None, user_ip=None):
+        return []
+    task_ids = random.sample(candidate_task_ids, min(limit, total_remaining))
+    tasks = _get_tasks(task_ids)
+    for task in tasks:
+        # Find last answer for the task
+        q = session.query(TaskRun)\
+            .filter(TaskRun.task_id == task.id)\
+            .order_by(TaskRun.finish_time.desc())
+        last_task_run = q.first()
+        if last_task_run:
+            task.info['last_answer'] = last_task_run.info
+            # TODO: As discussed in GitHub #53
+            # it is necessary to create a lock in the task!
+    return tasks
+
+
+def get_locked_task(project_id, user_id=None, user_ip=None, offset=0):
+    """Get a new task reserving it for the user for a limited time."""
+    return _first(get_locked_tasks(project_id, user_id, user_ip,
+                                   offset=offset))
+
+
+def get_locked_tasks(project_id, user_id=None, user_ip=None, offset=0,
+                     limit=1):
+    """Get new tasks reserving them for the user for a limited time.
+
+    Tasks are sorted like in the depth first scheduler, but a task is only
+    returned if the task runs already submitted plus the reservations of other
+    users are below task.n_answers. Reservations expire after
+    LOCKED_SCHED_TTL seconds or when the user submits a task run.
+    """
+    if user_id and not user_ip:
+        exclude = 'user_id=:user_id'
+    else:
+        user_ip = user_ip or '127.0.0.1'
+        user_id = None
+        exclude = 'user_ip=:user_ip'
+    sql = text('''
+               SELECT task.id, task.n_answers, task.n_task_runs
+               FROM task WHERE NOT EXISTS
+               (SELECT task_id FROM task_run WHERE
+               project_id=:project_id AND %s AND task_id=task.id)
+               AND project_id=:project_id AND state !='completed'
+               ORDER BY priority_0 DESC, id ASC LIMIT :limit''' % exclude)
+    rows = session.execute(sql, dict(project_id=project_id, user_id=user_id,
+                                     user_ip=user_ip,
+                                     limit=LOCKED_SCHED_CANDIDATES))
+    lock = TaskLock(sentinel.master,
+                    current_app.config.get('LOCKED_SCHED_TTL'))
+    user = dict(user_id=user_id, user_ip=user_ip)
+    candidates = [(row.id, row.n_answers, row.n_task_runs) for row in rows]
+    task_ids = lock.acquire_many(candidates, user, offset=offset, limit=limit)
+    return _get_tasks(task_ids)
+
+
+def _first(tasks):
+    return tasks[0] if tasks else None
+
+
+def _candidates_limit(offset, limit):
+    # At least the 10 candidates the schedulers have always looked at
+    return max(10, offset + limit)
+
+
+def _get_tasks(task_ids):
+    """Return the tasks with the given ids, in the same order, in one query."""
+    if not task_ids:
+        return []
+    tasks = session.query(Task).filter(Task.id.in_(task_ids)).all()
+    tasks_by_id = dict((task.id, task) for task in tasks)
+    return [tasks_by_id[task_id] for task_id in task_ids
+            if task_id in tasks_by_id]
+
+
+def get_candidate_task_ids(project_id, user_id=None, user_ip=None, limit=10):
     """Get all available tasks for a given project and user."""
+    pool = get_task_pool()
+    if pool is not None:
+        return get_pooled_candidate_task_ids(pool, project_id, user_id,
+                                             user_ip, limit)
+    return _get_candidate_task_ids(project_id, user_id, user_ip, limit)
+
+
+def get_pooled_candidate_task_ids(pool, project_id, user_id=None,
+                                  user_ip=None, limit=10):
+    """Get available tasks from the Redis pool of open tasks.
+
+    The pool of the project and the tasks already answered by the user are
+    loaded from the DB when they are not in Redis yet (or have expired).
+    """
+    if not (user_id and not user_ip):
+        user_ip = user_ip or '127.0.0.1'
+        user_id = None
+    user = dict(user_id=user_id, user_ip=user_ip)
+    candidate_task_ids = pool.candidates(project_id, user, limit)
+    if candidate_task_ids is not None:
+        return candidate_task_ids
+    if not pool.is_loaded(project_id):
+        query = text('''
+                     SELECT id, priority_0 FROM task
+                     WHERE project_id=:project_id AND state !='completed'
+                     ''')
+        rows = session.execute(query, dict(project_id=project_id))
+        pool.load(project_id, ((row.id, row.priority_0) for row in rows))
+    if not pool.is_user_loaded(project_id, user):
+        column = 'user_id' if user_id else 'user_ip'
+        query = text('''
+                     SELECT task_id FROM task_run
+                     WHERE project_id=:project_id AND %s=:user
+                     ''' % column)
+        rows = session.execute(query, dict(project_id=project_id,
+                                           user=user_id or user_ip))
+        pool.load_user(project_id, user, (row.task_id for row in rows))
+    return _get_candidate_task_ids(project_id, user_id, user_ip, limit)
+
+
+def _get_candidate_task_ids(project_id, user_id=None, user_ip=None, limit=10):
     rows = None
     if user_id and not user_ip:
         query = text('''
@@ -126,9 +254,9 @@ def get_candidate_task_ids(project_id, user_id=None, user_ip=None):
                      project_id=:project_id AND user_id=:user_id
                         AND task_id=task.id)
                      AND project_id=:project_id AND state !='completed'
-                     ORDER BY priority_0 DESC, id ASC LIMIT 10''')
+                     ORDER BY priority_0 DESC, id ASC LIMIT :limit''')
         rows = session.execute(query, dict(project_id=project_id,
-                                           user_id=user_id))
+                                           user_id=user_id, limit=limit))
     else:
         if not user_ip:
             user_ip = '127.0.0.1'
@@ -138,13 +266,13 @@ def get_candidate_task_ids(project_id, user_id=None, user_ip=None):
                      project_id=:project_id AND user_ip=:user_ip
                         AND task_id=task.id)
                      AND project_id=:project_id AND state !='completed'
-                     ORDER BY priority_0 DESC, id ASC LIMIT 10''')
+                     ORDER BY priority_0 DESC, id ASC LIMIT :limit''')
         rows = session.execute(query, dict(project_id=project_id,
-                                           user_ip=user_ip))
+                                           user_ip=user_ip, limit=limit))
 
     return [t.id for t in rows]
 
 
 def sched_variants():
     return [('default', 'Default'), ('breadth_first', 'Breadth First'),
-            ('depth_first', 'Depth First')]
+            ('depth_first', 'Depth First'), ('locked', 'Locked')]
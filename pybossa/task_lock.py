@@ -0,0 +1,103 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+
+class TaskLock(object):
+
+    """Reserve tasks for users for a limited amount of time.
+
+    Reservations of a task are stored in a sorted set, where every member is a
+    user id (or IP) and its score the time the reservation expires. A task is
+    only reserved if the not expired reservations plus the task runs already
+    submitted are below the number of answers required by the task.
+    """
+
+    KEY_PREFIX = 'pybossa:task_locked:task:%s'
+    LOCK_TTL = 10 * 60
+
+    _acquire_script = """
+    local user = ARGV[1]
+    local now = tonumber(ARGV[2])
+    local ttl = tonumber(ARGV[3])
+    local to_skip = tonumber(ARGV[4])
+    local limit = tonumber(ARGV[5])
+    local reserved = {}
+    for i, key in ipairs(KEYS) do
+        local n_answers = tonumber(ARGV[4 + 2 * i])
+        local n_task_runs = tonumber(ARGV[5 + 2 * i])
+        redis.call('ZREMRANGEBYSCORE', key, '-inf', now)
+        if redis.call('ZSCORE', key, user) or
+                redis.call('ZCARD', key) + n_task_runs < n_answers then
+            if to_skip > 0 then
+                to_skip = to_skip - 1
+            else
+                redis.call('ZADD', key, now + ttl, user)
+                redis.call('EXPIRE', key, ttl)
+                reserved[#reserved + 1] = i
+                if #reserved == limit then
+                    break
+                end
+            end
+        end
+    end
+    return reserved
+    """
+
+    def __init__(self, redis_conn, ttl=None):
+        self.conn = redis_conn
+        self.ttl = ttl or self.LOCK_TTL
+        self._acquire = self.conn.register_script(self._acquire_script)
+
+    def acquire(self, task_id, user, n_answers, n_task_runs):
+        """Reserve the task for the user. Return True if it was reserved."""
+        return self.acquire_many([(task_id, n_answers, n_task_runs)],
+                                 user) == [task_id]
+
+    def acquire_many(self, candidates, user, offset=0, limit=1):
+        """Reserve up to limit tasks for the user in a single round trip.
+
+        candidates is a list of (task_id, n_answers, n_task_runs), in the
+        order they are tried. The first offset tasks that could be reserved
+        are skipped without reserving them. Return the ids of the reserved
+        tasks.
+        """
+        if not candidates or limit <= 0:
+            return []
+        keys = [self._create_key(task_id) for task_id, _, _ in candidates]
+        args = [self._user_id(user), time.time(), self.ttl, offset, limit]
+        for task_id, n_answers, n_task_runs in candidates:
+            args.extend([n_answers, n_task_runs])
+        reserved = self._acquire(keys=keys, args=args)
+        return [candidates[i - 1][0] for i in reserved]
+
+    def release(self, task_id, user):
+        key = self._create_key(task_id)
+        return bool(self.conn.zrem(key, self._user_id(user)))
+
+    def count(self, task_id):
+        """Return the number of not expired reservations of a task."""
+        key = self._create_key(task_id)
+        return self.conn.zcount(key, time.time(), '+inf')
+
+    def _create_key(self, task_id):
+        return self.KEY_PREFIX % task_id
+
+    def _user_id(self, user):
+        return user['user_id'] or user['user_ip']
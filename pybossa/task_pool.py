@@ -0,0 +1,165 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Pool of open tasks per project kept in Redis.
+
+The pool is a sorted set with the ids of the tasks of a project that are not
+completed yet, ordered by priority_0 DESC and id ASC (the same order used by
+the depth first scheduler). For every user (or IP) requesting tasks a set with
+the ids of the tasks already contributed to is kept too, so candidates can be
+served without querying the task_run table.
+
+Both structures carry a sentinel member, so an existing but empty pool (a
+project with no open tasks) can be told apart from a cold one.
+"""
+from flask import current_app, has_app_context
+from pybossa.core import sentinel
+
+
+def get_task_pool():
+    """Return the pool of open tasks if it is enabled, otherwise None."""
+    if has_app_context() and current_app.config.get('TASK_POOL'):
+        return TaskPool(sentinel.master)
+    return None
+
+
+class TaskPool(object):
+
+    KEY_PREFIX = 'pybossa:task_pool:project:%s'
+    CONTRIBUTED_KEY_PREFIX = 'pybossa:task_pool:project:%s:user:%s'
+    POOL_TTL = 60 * 60
+    CONTRIBUTED_TTL = 60 * 60
+    POOL_SENTINEL = 'end'
+    CONTRIBUTED_SENTINEL = '-'
+    BATCH_SIZE = 100
+
+    _candidates_script = """
+    local limit = tonumber(ARGV[1])
+    local batch = tonumber(ARGV[2])
+    local found = {}
+    local start = 0
+    while #found < limit do
+        local members = redis.call('ZRANGE', KEYS[1], start, start + batch - 1)
+        if #members == 0 then break end
+        for _, member in ipairs(members) do
+            if member ~= ARGV[3] and
+                    redis.call('SISMEMBER', KEYS[2], member) == 0 then
+                table.insert(found, member)
+                if #found >= limit then break end
+            end
+        end
+        start = start + batch
+    end
+    return found
+    """
+
+    _add_if_exists_script = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+    end
+    return 0
+    """
+
+    _sadd_if_exists_script = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return redis.call('SADD', KEYS[1], ARGV[1])
+    end
+    return 0
+    """
+
+    def __init__(self, redis_conn):
+        self.conn = redis_conn
+        self._candidates = self.conn.register_script(self._candidates_script)
+        self._add_if_exists = self.conn.register_script(
+            self._add_if_exists_script)
+        self._sadd_if_exists = self.conn.register_script(
+            self._sadd_if_exists_script)
+
+    def is_loaded(self, project_id):
+        return self.conn.exists(self._pool_key(project_id))
+
+    def is_user_loaded(self, project_id, user):
+        return self.conn.exists(self._contributed_key(project_id, user))
+
+    def load(self, project_id, tasks):
+        """Fill the pool of a project with (task_id, priority_0) tuples."""
+        key = self._pool_key(project_id)
+        pipe = self.conn.pipeline()
+        pipe.delete(key)
+        pipe.zadd(key, float('inf'), self.POOL_SENTINEL)
+        for task_id, priority_0 in tasks:
+            pipe.zadd(key, self._score(priority_0),
+                      self._member(task_id))
+        pipe.expire(key, self.POOL_TTL)
+        pipe.execute()
+
+    def load_user(self, project_id, user, task_ids):
+        """Register the tasks a user has already contributed to."""
+        key = self._contributed_key(project_id, user)
+        members = [self._member(task_id) for task_id in task_ids]
+        pipe = self.conn.pipeline()
+        pipe.delete(key)
+        pipe.sadd(key, self.CONTRIBUTED_SENTINEL, *members)
+        pipe.expire(key, self.CONTRIBUTED_TTL)
+        pipe.execute()
+
+    def candidates(self, project_id, user, limit=10):
+        """Return up to limit task ids the user has not contributed to.
+
+        Returns None if the pool is not loaded for the project or the user.
+        """
+        keys = [self._pool_key(project_id),
+                self._contributed_key(project_id, user)]
+        pipe = self.conn.pipeline()
+        for key in keys:
+            pipe.exists(key)
+        if not all(pipe.execute()):
+            return None
+        members = self._candidates(keys=keys,
+                                   args=[limit, self.BATCH_SIZE,
+                                         self.POOL_SENTINEL])
+        return [int(member) for member in members]
+
+    def add_task(self, project_id, task_id, priority_0):
+        self._add_if_exists(keys=[self._pool_key(project_id)],
+                            args=[self._score(priority_0),
+                                  self._member(task_id)])
+
+    def remove_task(self, project_id, task_id):
+        self.conn.zrem(self._pool_key(project_id), self._member(task_id))
+
+    def add_contribution(self, project_id, task_id, user):
+        self._sadd_if_exists(keys=[self._contributed_key(project_id, user)],
+                             args=[self._member(task_id)])
+
+    def invalidate(self, project_id):
+        self.conn.delete(self._pool_key(project_id))
+
+    def _pool_key(self, project_id):
+        return self.KEY_PREFIX % project_id
+
+    def _contributed_key(self, project_id, user):
+        user_id = user['user_id'] or user['user_ip']
+        return self.CONTRIBUTED_KEY_PREFIX % (project_id, user_id)
+
+    def _score(self, priority_0):
+        # Higher priorities first; ties are sorted by the padded member (id)
+        return -float(priority_0 or 0)
+
+    def _member(self, task_id):
+        return '%012d' % int(task_id)
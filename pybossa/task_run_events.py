@@ -0,0 +1,211 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Side effects of submitted task runs applied after commit.
+
+Once a task run is committed, a compact event with its ids, and with the
+result created if it completed its task, is emitted. Applying it adds the
+contribution, and the completion, to the activity feed and pushes the
+webhook of the project.
+
+With ASYNC_TASK_RUN_EVENTS the events are pushed to a Redis list, and a job
+in the high queue applies them in batches: the users and projects of a
+batch are read with a query each and the feed is written in a single round
+trip. Otherwise the events of a commit are applied right after it, with a
+single connection.
+
+Queued events are delivered at least once. A batch is moved atomically to
+a processing list and only dropped once applied, so the batches of a worker
+that died are applied again by the next one. The id of every task run
+applied from the queue is kept for a day, so events delivered twice are
+skipped.
+"""
+import json
+from datetime import datetime
+from flask import current_app, has_app_context
+from rq import Queue
+from sqlalchemy.sql import text
+from pybossa.core import sentinel
+from pybossa.feed import update_feed_many
+from pybossa.jobs import webhook
+
+events_queue = Queue('high', connection=sentinel.master)
+webhook_queue = Queue('high', connection=sentinel.master)
+
+
+def use_async():
+    """Return whether events are queued for a worker."""
+    return has_app_context() and \
+        bool(current_app.config.get('ASYNC_TASK_RUN_EVENTS'))
+
+
+def emit(events):
+    """Apply the events of the task runs of a commit, or queue them."""
+    from pybossa.core import db
+    if use_async():
+        return TaskRunEvents(sentinel.master).push(events)
+    # The session that just committed can't run queries until it ends
+    conn = db.engine.connect()
+    try:
+        TaskRunEvents(sentinel.master).apply(conn, events)
+    finally:
+        conn.close()
+
+
+def process_task_run_events():
+    """Apply the queued events, job entry point."""
+    from pybossa.core import db
+    return TaskRunEvents(sentinel.master).process(db.slave_session)
+
+
+class TaskRunEvents(object):
+
+    KEY = 'pybossa:task_run_events'
+    PROCESSING_KEY = 'pybossa:task_run_events:processing'
+    SCHEDULED_KEY = 'pybossa:task_run_events:scheduled'
+    LOCK_KEY = 'pybossa:task_run_events:lock'
+    APPLIED_KEY = 'pybossa:task_run_events:applied:%s'
+    APPLIED_TTL = 24 * 60 * 60
+    LOCK_TTL = 10 * 60
+    BATCH_SIZE = 500
+
+    _take_script = """
+    local events = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    if #events > 0 then
+        redis.call('LTRIM', KEYS[1], #events, -1)
+        redis.call('RPUSH', KEYS[2], unpack(events))
+    end
+    return events
+    """
+
+    def __init__(self, redis_conn):
+        self.conn = redis_conn
+        self._take = self.conn.register_script(self._take_script)
+
+    def push(self, events):
+        """Queue the events, and a job to apply them unless one is pending."""
+        pipe = self.conn.pipeline()
+        pipe.rpush(self.KEY, *[json.dumps(event) for event in events])
+        pipe.set(self.SCHEDULED_KEY, 1, nx=True, ex=self.LOCK_TTL)
+        scheduled = pipe.execute()[1]
+        if scheduled:
+            events_queue.enqueue(process_task_run_events)
+
+    def process(self, conn):
+        """Apply the queued events in batches. Return how many were applied.
+
+        Only one worker applies events at a time; the others leave them to
+        it.
+        """
+        n_events = 0
+        while self.conn.set(self.LOCK_KEY, 1, nx=True, ex=self.LOCK_TTL):
+            try:
+                # Events queued from now on schedule a new job
+                self.conn.delete(self.SCHEDULED_KEY)
+                # Left by a worker that died while applying them
+                n_events += self._apply_batch(
+                    conn, self.conn.lrange(self.PROCESSING_KEY, 0, -1))
+                while True:
+                    events = self._take(keys=[self.KEY, self.PROCESSING_KEY],
+                                        args=[self.BATCH_SIZE])
+                    if not events:
+                        break
+                    n_events += self._apply_batch(conn, events)
+            finally:
+                self.conn.delete(self.LOCK_KEY)
+            # Pushed while the lock was being released
+            if not self.conn.llen(self.KEY):
+                break
+        return n_events
+
+    def apply(self, conn, events):
+        """Add the events to the feed and push their webhooks."""
+        if not events:
+            return 0
+        projects = self._projects(conn, set(e['project_id'] for e in events))
+        users = self._users(conn, set(e['user_id'] for e in events
+                                      if e['user_id'] is not None))
+        feed = []
+        for event in events:
+            project = projects[event['project_id']]
+            user = users.get(event['user_id'])
+            if user is not None:
+                feed.append(dict(user, project_name=project['name'],
+                                 project_short_name=project['short_name'],
+                                 action_updated='UserContribution'))
+            if event['completed']:
+                feed.append(project)
+        update_feed_many(feed)
+        for event in events:
+            if event['completed']:
+                self._push_webhook(projects[event['project_id']], event)
+        return len(events)
+
+    def _apply_batch(self, conn, serialized_events):
+        if not serialized_events:
+            return 0
+        pending = self._not_applied([json.loads(e) for e in serialized_events])
+        n_events = self.apply(conn, pending)
+        pipe = self.conn.pipeline(transaction=False)
+        for event in pending:
+            pipe.set(self.APPLIED_KEY % event['task_run_id'], 1,
+                     ex=self.APPLIED_TTL)
+        pipe.delete(self.PROCESSING_KEY)
+        pipe.execute()
+        return n_events
+
+    def _not_applied(self, events):
+        pipe = self.conn.pipeline(transaction=False)
+        for event in events:
+            pipe.exists(self.APPLIED_KEY % event['task_run_id'])
+        applied = pipe.execute()
+        return [event for event, done in zip(events, applied) if not done]
+
+    def _projects(self, conn, project_ids):
+        projects = dict((project_id, dict(id=project_id, name=None,
+                                          short_name=None, info=None,
+                                          webhook=None,
+                                          action_updated='TaskCompleted'))
+                        for project_id in project_ids)
+        sql = text('''SELECT id, name, short_name, info, webhook FROM project
+                   WHERE id=ANY(:project_ids)''')
+        for row in conn.execute(sql, dict(project_ids=list(project_ids))):
+            projects[row.id].update(name=row.name, short_name=row.short_name,
+                                    info=row.info, webhook=row.webhook)
+        return projects
+
+    def _users(self, conn, user_ids):
+        if not user_ids:
+            return {}
+        sql = text('''SELECT id, fullname, name, info FROM "user"
+                   WHERE id=ANY(:user_ids)''')
+        results = conn.execute(sql, dict(user_ids=list(user_ids)))
+        return dict((row.id, dict(id=row.id, name=row.name,
+                                  fullname=row.fullname, info=row.info))
+                    for row in results)
+
+    def _push_webhook(self, project, event):
+        if project['webhook']:
+            payload = dict(event="task_completed",
+                           project_short_name=project['short_name'],
+                           project_id=project['id'],
+                           task_id=event['task_id'],
+                           result_id=event['result_id'],
+                           fired_at=datetime.utcnow().strftime(
+                               "%Y-%m-%d %H:%M:%S"))
+            webhook_queue.enqueue(webhook, project['webhook'], payload)
@@ -43,7 +43,7 @@ from pybossa.model.webhook import Webhook
 from pybossa.model.blogpost import Blogpost
 from pybossa.util import Pagination, admin_required, get_user_id_or_ip, rank
 from pybossa.auth import ensure_authorized_to
-from pybossa.cache import projects as cached_projects
+from pybossa.cache import projects as cached_projects, get_memoized_many
 from pybossa.cache import categories as cached_cat
 from pybossa.cache import project_stats as stats
 from pybossa.cache.helpers import add_custom_contrib_button_to, has_no_presenter
@@ -84,13 +84,12 @@ def project_by_shortname(short_name):
         # Get owner
         owner = user_repo.get(project.owner_id)
         # Populate CACHE with the data of the project
-        return (project,
-                owner,
-                cached_projects.n_tasks(project.id),
-                cached_projects.n_task_runs(project.id),
-                cached_projects.overall_progress(project.id),
-                cached_projects.last_activity(project.id),
-                cached_projects.n_results(project.id))
+        counters = get_memoized_many(
+            [(function, (project.id,)) for function in
+             (cached_projects.n_tasks, cached_projects.n_task_runs,
+              cached_projects.overall_progress,
+              cached_projects.last_activity, cached_projects.n_results)])
+        return tuple([project, owner] + counters)
     else:
         cached_projects.delete_project(short_name)
         return abort(404)
@@ -0,0 +1,136 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Approximate counts of distinct volunteers kept in Redis HyperLogLogs.
+
+With APPROXIMATE_VOLUNTEERS, every task run adds its user id (registered
+volunteers) or IP (anonymous ones) to a HyperLogLog of its project, to one
+of the whole site for its day and, for anonymous ones, to a site wide one.
+They are read by the project volunteer counters, site_stats.n_anon_users
+and the weekly users of the admin dashboard. Counts take about 12KB per
+HyperLogLog at most and have a standard error of 0.81%, instead of a COUNT
+DISTINCT over task_run. Day keys are kept for DAYS days.
+
+Task runs older than the counter are added with backfill.
+"""
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy.sql import text
+from pybossa.core import sentinel
+
+
+def use_approximate(approximate=None):
+    """Return whether to count volunteers with the HyperLogLogs.
+
+    Call sites pass True or False to choose, or None to follow the
+    APPROXIMATE_VOLUNTEERS setting.
+    """
+    if approximate is not None:
+        return approximate
+    return has_app_context() and \
+        bool(current_app.config.get('APPROXIMATE_VOLUNTEERS'))
+
+
+def add_task_run(project_id, user_id, user_ip, finish_time):
+    """Add the volunteer of a task run to the counters."""
+    day = finish_time.date() if finish_time is not None else None
+    VolunteerCounter(sentinel.master).add(project_id, user_id, user_ip, day)
+
+
+class VolunteerCounter(object):
+
+    KEY_PREFIX = 'pybossa:volunteers:%s:%s'
+    DAY_KEY_PREFIX = 'pybossa:volunteers:site:%s:day:%s'
+    DAYS = 8
+    BATCH_SIZE = 1000
+
+    def __init__(self, redis_conn):
+        self.conn = redis_conn
+
+    def add(self, project_id, user_id, user_ip, day=None):
+        pipe = self.conn.pipeline(transaction=False)
+        self._queue_add(pipe, project_id, user_id, user_ip, day)
+        pipe.execute()
+
+    def count(self, kind, project_id=None):
+        """Return the approximate number of registered or anonymous
+        volunteers."""
+        key = self.KEY_PREFIX % (self._scope(project_id), kind)
+        return self.conn.execute_command('PFCOUNT', key)
+
+    def count_many(self, kind, project_ids):
+        """Return the approximate number of volunteers of every project."""
+        pipe = self.conn.pipeline(transaction=False)
+        for project_id in project_ids:
+            pipe.execute_command('PFCOUNT', self.KEY_PREFIX % (
+                self._scope(project_id), kind))
+        return dict(zip(project_ids, pipe.execute()))
+
+    def count_per_day(self, kind, days):
+        """Return the (day, approximate number of volunteers of the site)
+        of the last days with any, oldest first."""
+        today = datetime.utcnow().date()
+        last_days = [today - timedelta(days=n) for n in range(days)]
+        pipe = self.conn.pipeline(transaction=False)
+        for day in last_days:
+            pipe.execute_command('PFCOUNT', self.DAY_KEY_PREFIX % (kind, day))
+        counts = zip(last_days, pipe.execute())
+        return [(day, count) for day, count in reversed(counts) if count]
+
+    def backfill(self, session):
+        """Add the volunteers of every task run. Return the rows read."""
+        sql = text('''SELECT project_id, user_id, user_ip,
+                   CASE WHEN finish_time_ts >= :oldest
+                   THEN finish_time_ts::date END AS day
+                   FROM task_run GROUP BY project_id, user_id, user_ip, day''')
+        # Only the days still kept are added
+        oldest = datetime.utcnow().date() - timedelta(days=self.DAYS - 1)
+        results = session.execute(sql.execution_options(stream_results=True),
+                                  dict(oldest=oldest))
+        n_rows = 0
+        pipe = self.conn.pipeline(transaction=False)
+        for row in results:
+            self._queue_add(pipe, row.project_id, row.user_id, row.user_ip,
+                            row.day)
+            n_rows += 1
+            if n_rows % self.BATCH_SIZE == 0:
+                pipe.execute()
+        pipe.execute()
+        return n_rows
+
+    def _queue_add(self, pipe, project_id, user_id, user_ip, day):
+        if user_id is not None and user_ip is None:
+            kind, member = 'registered', user_id
+        elif user_ip is not None and user_id is None:
+            kind, member = 'anonymous', user_ip
+        else:
+            return
+        scopes = [self._scope(project_id)]
+        if kind == 'anonymous':
+            # Registered users are counted site wide from the user table
+            scopes.append(self._scope(None))
+        for scope in scopes:
+            pipe.execute_command('PFADD', self.KEY_PREFIX % (scope, kind),
+                                 member)
+        if day is not None:
+            key = self.DAY_KEY_PREFIX % (kind, day)
+            pipe.execute_command('PFADD', key, member)
+            pipe.expire(key, self.DAYS * 24 * 60 * 60)
+
+    def _scope(self, project_id):
+        return 'site' if project_id is None else 'project:%s' % project_id
@@ -16,7 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
-from sqlalchemy import text
+from sqlalchemy import event, text
 from pybossa.core import db
 from pybossa.core import create_app, sentinel
 from pybossa.model.project import Project
@@ -25,6 +25,7 @@ from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
 from pybossa.model.user import User
 import pybossa.model as model
+from contextlib import contextmanager
 from functools import wraps
 from factories import reset_all_pk_sequences
 import random
@@ -44,6 +45,21 @@ def with_context(f):
             return f(*args, **kwargs)
     return decorated_function
 
+@contextmanager
+def sql_statements():
+    """Record the (statement, parameters) run on the DB within the block."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
 def delete_materialized_views():
     """Delete materialized views."""
     sql = text('''SELECT relname
@@ -49,6 +49,6 @@ class Helper(web.Helper):
         db.session.commit()
         # Update task.state
         db.session.query(model.task.Task).filter_by(project_id=project_id)\
-                  .update({"state": "ongoing"})
+                  .update({"state": "ongoing", "n_task_runs": 0})
         db.session.commit()
         db.session.remove()
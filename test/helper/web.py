@@ -127,6 +127,8 @@ class Helper(Test):
     def delete_task_runs(self, project_id=1):
         """Deletes all TaskRuns for a given project_id"""
         db.session.query(TaskRun).filter_by(project_id=project_id).delete()
+        db.session.query(Task).filter_by(project_id=project_id).update(
+            {'n_task_runs': 0})
         db.session.commit()
 
     def task_settings_scheduler(self, method="POST", short_name='sampleapp',
@@ -16,7 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 import json
-from default import with_context
+from default import with_context, sql_statements
 from nose.tools import assert_equal, assert_raises
 from test_api import TestAPI
 
@@ -26,6 +26,21 @@ from factories import ProjectFactory, TaskFactory, TaskRunFactory, UserFactory
 
 class TestApiCommon(TestAPI):
 
+    @with_context
+    def test_api_key_read_does_not_load_the_user(self):
+        """Test API GET with an API key does not load the whole user"""
+        user = UserFactory.create()
+        TaskFactory.create()
+
+        with sql_statements() as statements:
+            res = self.app.get('/api/task?api_key=%s' % user.api_key)
+
+        users = [s for s, _ in statements if 'FROM "user"' in s]
+        assert res.status_code == 200, res.data
+        assert len(users) == 1, users
+        assert 'api_key' in users[0], users
+        assert 'passwd_hash' not in users[0], users
+
 
     @with_context
     def test_limits_query(self):
@@ -24,6 +24,9 @@ from test_api import TestAPI
 from factories import (ProjectFactory, TaskFactory, TaskRunFactory, AnonymousTaskRunFactory, UserFactory,
                        CategoryFactory)
 
+from pybossa.api import NEWTASK_MAX_LIMIT
+from pybossa.contributions_guard import ContributionsGuard
+from pybossa.core import sentinel
 from pybossa.repositories import ProjectRepository
 from pybossa.repositories import TaskRepository
 from pybossa.repositories import ResultRepository
@@ -643,6 +646,41 @@ class TestProjectAPI(TestAPI):
         res = self.app.get(url)
         assert res.data == '{}', res.data
 
+    @with_context
+    def test_newtask_with_limit(self):
+        """Test API project new_task with limit returns a list of different
+        tasks and stamps all of them"""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(3, project=project)
+        guard = ContributionsGuard(sentinel.master)
+        user = {'user_id': None, 'user_ip': '127.0.0.1'}
+
+        res = self.app.get('/api/project/%s/newtask?limit=2' % project.id)
+        data = json.loads(res.data)
+
+        assert res.mimetype == 'application/json', res
+        assert [t['id'] for t in data] == [tasks[0].id, tasks[1].id], data
+        assert guard.check_task_stamped(tasks[0], user)
+        assert guard.check_task_stamped(tasks[1], user)
+        assert not guard.check_task_stamped(tasks[2], user)
+
+        # Get an empty list
+        url = '/api/project/%s/newtask?limit=2&offset=1000' % project.id
+        res = self.app.get(url)
+        assert json.loads(res.data) == [], res.data
+
+    @with_context
+    def test_newtask_limit_is_capped(self):
+        """Test API project new_task does not return more tasks than the
+        maximum allowed"""
+        project = ProjectFactory.create()
+        TaskFactory.create_batch(NEWTASK_MAX_LIMIT + 1, project=project)
+
+        res = self.app.get('/api/project/%s/newtask?limit=1000' % project.id)
+        data = json.loads(res.data)
+
+        assert len(data) == NEWTASK_MAX_LIMIT, len(data)
+
     @patch('pybossa.repositories.project_repository.uploader')
     def test_project_delete_deletes_zip_files(self, uploader):
         """Test API project delete deletes also zip files of tasks and taskruns"""
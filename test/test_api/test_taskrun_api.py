@@ -15,8 +15,12 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+import re
 import json
-from default import with_context, mock_contributions_guard
+import time
+from threading import Thread
+from default import flask_app, with_context, mock_contributions_guard
+from default import sql_statements
 from nose.tools import assert_equal
 from test_api import TestAPI
 from mock import patch
@@ -25,6 +29,7 @@ from factories import (ProjectFactory, TaskFactory, TaskRunFactory,
 from pybossa.repositories import ProjectRepository, TaskRepository
 from pybossa.repositories import ResultRepository
 from pybossa.core import db
+from pybossa.exc import DBIntegrityError
 
 project_repo = ProjectRepository(db)
 task_repo = TaskRepository(db)
@@ -110,6 +115,28 @@ class TestTaskrunAPI(TestAPI):
         assert len(data) == 5, data
         assert data[0]['id'] == task_runs[5].id, data[0]['id']
 
+    @with_context
+    def test_taskrun_query_stream(self):
+        """Test API TaskRun query streamed as NDJSON with a cursor"""
+        project = ProjectFactory.create()
+        task_runs = TaskRunFactory.create_batch(3, project=project)
+        TaskRunFactory.create()
+        url = '/api/taskrun?project_id=%s&stream=ndjson' % project.id
+
+        res = self.app.get(url + '&limit=2')
+        lines = [json.loads(line) for line in res.data.splitlines()]
+
+        assert res.mimetype == 'application/x-ndjson', res.mimetype
+        assert [l['id'] for l in lines[:-1]] == [tr.id for tr in task_runs[:2]]
+        assert 'links' not in lines[0], lines[0]
+        assert lines[-1] == dict(cursor=str(task_runs[1].id)), lines[-1]
+
+        res = self.app.get(url + '&cursor=%s' % lines[-1]['cursor'])
+        lines = [json.loads(line) for line in res.data.splitlines()]
+
+        assert [l['id'] for l in lines[:-1]] == [task_runs[2].id], lines
+        assert lines[-1] == dict(cursor=None), lines[-1]
+
 
     @with_context
     @patch('pybossa.api.task_run.request')
@@ -627,3 +654,147 @@ class TestTaskrunAPI(TestAPI):
                                                   volunteer.api_key)
             res = self.app.delete(url)
             assert_equal(res.status, '204 NO CONTENT', res.status)
+
+    @with_context
+    def test_taskrun_bulk_post_returns_status_per_item(self):
+        """Test API TaskRun bulk post stores valid items and reports errors"""
+        from pybossa.core import sentinel
+        from pybossa.contributions_guard import ContributionsGuard
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(3, project=project)
+        guard = ContributionsGuard(sentinel.master)
+        user = dict(user_id=None, user_ip='127.0.0.1')
+        guard.stamp(tasks[0], user)
+        guard.stamp(tasks[1], user)
+        data = [dict(project_id=project.id, task_id=tasks[0].id, info='a'),
+                dict(project_id=project.id, task_id=tasks[1].id, info='b'),
+                dict(project_id=project.id, task_id=tasks[2].id, info='c'),
+                dict(project_id=project.id, task_id=tasks[0].id, info='d'),
+                dict(project_id=project.id, task_id=tasks[1].id, id=3)]
+
+        res = self.app.post('/api/taskrun/bulk', data=json.dumps(data))
+        statuses = json.loads(res.data)
+
+        assert res.status_code == 200, res.data
+        assert [s['status'] for s in statuses] == \
+            ['OK', 'OK', 'failed', 'failed', 'failed'], statuses
+        assert statuses[2]['exception_msg'] == \
+            'You must request a task first!', statuses
+        assert statuses[3]['status_code'] == 403, statuses
+        assert statuses[4]['status_code'] == 400, statuses
+        taskruns = task_repo.filter_task_runs_by(project_id=project.id)
+        assert sorted(tr.id for tr in taskruns) == \
+            sorted([statuses[0]['id'], statuses[1]['id']]), taskruns
+
+    @with_context
+    @patch('pybossa.repositories.TaskRepository.save_many',
+           side_effect=DBIntegrityError('duplicated answer'))
+    def test_taskrun_bulk_post_integrity_error_per_item(self, save_many):
+        """Test API TaskRun bulk post reports integrity errors per item"""
+        from pybossa.core import sentinel
+        from pybossa.contributions_guard import ContributionsGuard
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(2, project=project)
+        guard = ContributionsGuard(sentinel.master)
+        guard.stamp(tasks[0], dict(user_id=None, user_ip='127.0.0.1'))
+        data = [dict(project_id=project.id, task_id=tasks[0].id, info='a'),
+                dict(project_id=project.id, task_id=tasks[1].id, info='b')]
+
+        res = self.app.post('/api/taskrun/bulk', data=json.dumps(data))
+        statuses = json.loads(res.data)
+
+        assert res.status_code == 200, res.data
+        assert statuses[0]['exception_cls'] == 'DBIntegrityError', statuses
+        assert statuses[1]['exception_msg'] == \
+            'You must request a task first!', statuses
+
+    @with_context
+    @patch.dict(flask_app.config, {'WTF_CSRF_ENABLED': True})
+    def test_taskrun_bulk_post_is_csrf_exempt(self):
+        """Test API TaskRun bulk post works for API clients with CSRF on"""
+        from pybossa.core import sentinel
+        from pybossa.contributions_guard import ContributionsGuard
+        user = UserFactory.create()
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        guard = ContributionsGuard(sentinel.master)
+        guard.stamp(task, dict(user_id=user.id, user_ip=None))
+        data = [dict(project_id=project.id, task_id=task.id, info='a')]
+        url = '/api/taskrun/bulk?api_key=%s' % user.api_key
+
+        res = self.app.post(url, data=json.dumps(data))
+        statuses = json.loads(res.data)
+
+        assert res.status_code == 200, res.data
+        assert statuses[0]['status'] == 'OK', statuses
+
+    @with_context
+    def test_taskrun_bulk_post_requires_a_list(self):
+        """Test API TaskRun bulk post fails without a list of task runs"""
+        res = self.app.post('/api/taskrun/bulk', data=json.dumps(dict()))
+        err = json.loads(res.data)
+
+        assert res.status_code == 400, res.data
+        assert err['exception_cls'] == 'BadRequest', err
+
+    @with_context
+    @patch('pybossa.model.event_listeners.task_run_events')
+    def test_taskrun_post_loads_project_and_task_once(self, task_run_events):
+        """Test API TaskRun post reads the project and the task only once"""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        self.app.get('/api/project/%s/newtask' % project.id)
+        data = dict(project_id=project.id, task_id=task.id, info='answer')
+
+        with sql_statements() as recorded:
+            res = self.app.post('/api/taskrun', data=json.dumps(data))
+
+        statements = [statement for statement, _ in recorded]
+        projects = [s for s in statements if re.search(r'FROM project\b', s)]
+        tasks = [s for s in statements if s.startswith('SELECT task.id')]
+        assert res.status_code == 200, res.data
+        assert len(projects) == 1, projects
+        assert len(tasks) == 1, tasks
+        # The project, the locked task, the previous answers, the insert,
+        # the counters, the project timestamp and the reload for the reply
+        assert len(statements) == 7, statements
+
+    @with_context
+    def test_taskrun_post_twice_before_commit_is_forbidden(self):
+        """Test API TaskRun post forbids a second answer of the same user
+        sent while the first one is not committed yet"""
+        from pybossa.core import sentinel
+        from pybossa.contributions_guard import ContributionsGuard
+        user = UserFactory.create()
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, n_answers=2)
+        guard = ContributionsGuard(sentinel.master)
+        guard.stamp(task, dict(user_id=user.id, user_ip=None))
+        url = '/api/taskrun?api_key=%s' % user.api_key
+        data = json.dumps(dict(project_id=project.id, task_id=task.id,
+                               info='answer'))
+        responses = []
+        second = Thread(target=lambda: responses.append(
+            flask_app.test_client().post(url, data=data)))
+        save = TaskRepository.save
+
+        def save_after_second_post(repo, element):
+            if second.ident is None:
+                second.start()
+                # Wait for the second post to block on the task lock
+                sql = 'SELECT COUNT(*) FROM pg_locks WHERE NOT granted'
+                for i in range(100):
+                    if db.engine.execute(sql).scalar():
+                        break
+                    time.sleep(0.05)
+            save(repo, element)
+
+        with patch.object(TaskRepository, 'save', save_after_second_post):
+            res = self.app.post(url, data=data)
+            second.join(10)
+
+        assert res.status_code == 200, res.data
+        assert len(responses) == 1, responses
+        assert responses[0].status_code == 403, responses[0].data
+        taskruns = task_repo.filter_task_runs_by(task_id=task.id)
+        assert len(taskruns) == 1, taskruns
@@ -16,10 +16,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
 import hashlib
+import cPickle as pickle
 from mock import patch
 from pybossa.cache import (get_key_to_hash, get_hash_key, cache, memoize,
-                           delete_cached, delete_memoized)
+                           delete_cached, delete_memoized, sweep_tags,
+                           get_tag_key, INVALIDATION_CHANNEL, CacheEntry,
+                           get_memoized_many, delete_memoized_many,
+                           limit_memoized, delete_legacy_keys, KEY_PREFIX)
+from pybossa.cache.local import LocalCache
+from pybossa.cache.codecs import decode, HEADER, MAGIC, VERSION
 from pybossa.sentinel import Sentinel
 from settings_test import REDIS_SENTINEL, REDIS_KEYPREFIX
 
@@ -27,6 +34,10 @@ from settings_test import REDIS_SENTINEL, REDIS_KEYPREFIX
 
 class TestCacheHashFunctions(object):
 
+    def test_key_prefix_has_the_format_version(self):
+        """Test CACHE keys are namespaced by the storage format version."""
+        assert KEY_PREFIX == '%s:v%s' % (REDIS_KEYPREFIX, VERSION), KEY_PREFIX
+
     def test_00_get_key_to_hash_with_args(self):
         """Test CACHE get_key_to_hash with args works."""
         expected = ':1:a'
@@ -68,6 +79,8 @@ class FakeApp(object):
         self.config = { 'REDIS_SENTINEL': REDIS_SENTINEL }
 
 test_sentinel = Sentinel(app=FakeApp())
+# Keys of memoized values, leaving out their tag sets
+memoized_keys = '%s:*_args:*' % KEY_PREFIX
 
 @patch('pybossa.cache.sentinel', new=test_sentinel)
 class TestCacheMemoizeFunctions(object):
@@ -99,7 +112,7 @@ class TestCacheMemoizeFunctions(object):
         def my_func():
             return 'my_func was called'
         my_func()
-        key = "%s::%s" % (REDIS_KEYPREFIX, 'my_cached_func')
+        key = "%s::%s" % (KEY_PREFIX, 'my_cached_func')
 
         assert test_sentinel.master.keys() == [key], test_sentinel.master.keys()
 
@@ -141,7 +154,7 @@ class TestCacheMemoizeFunctions(object):
         def my_func(*args, **kwargs):
             return [args, kwargs]
         my_func('arg')
-        key_pattern = "%s:%s_args:*" % (REDIS_KEYPREFIX, my_func.__name__)
+        key_pattern = "%s:%s_args:*" % (KEY_PREFIX, my_func.__name__)
 
         assert len(test_sentinel.master.keys(key_pattern)) == 1
 
@@ -155,7 +168,7 @@ class TestCacheMemoizeFunctions(object):
             return [args, kwargs]
         my_func('arg')
         my_func('arg')
-        key_pattern = "%s:%s_args:*" % (REDIS_KEYPREFIX, my_func.__name__)
+        key_pattern = "%s:%s_args:*" % (KEY_PREFIX, my_func.__name__)
 
         assert len(test_sentinel.master.keys(key_pattern)) == 1
 
@@ -167,7 +180,7 @@ class TestCacheMemoizeFunctions(object):
         @memoize()
         def my_func(*args, **kwargs):
             return [args, kwargs]
-        key_pattern = "%s:%s_args:*" % (REDIS_KEYPREFIX, my_func.__name__)
+        key_pattern = "%s:%s_args:*" % (KEY_PREFIX, my_func.__name__)
         my_func('arg')
         assert len(test_sentinel.master.keys(key_pattern)) == 1
         my_func('another_arg')
@@ -216,7 +229,7 @@ class TestCacheMemoizeFunctions(object):
         @cache(key_prefix='my_cached_func')
         def my_func():
             return 'my_func was called'
-        key = "%s::%s" % (REDIS_KEYPREFIX, 'my_cached_func')
+        key = "%s::%s" % (KEY_PREFIX, 'my_cached_func')
         my_func()
         assert test_sentinel.master.keys() == [key]
 
@@ -231,7 +244,7 @@ class TestCacheMemoizeFunctions(object):
         @cache(key_prefix='my_cached_func')
         def my_func():
             return 'my_func was called'
-        key = "%s::%s" % (REDIS_KEYPREFIX, 'my_cached_func')
+        key = "%s::%s" % (KEY_PREFIX, 'my_cached_func')
         assert test_sentinel.master.keys() == []
 
         delete_succedeed = delete_cached('my_cached_func')
@@ -246,11 +259,11 @@ class TestCacheMemoizeFunctions(object):
         def my_func(*args, **kwargs):
             return [args, kwargs]
         my_func('arg', kwarg='kwarg')
-        assert len(test_sentinel.master.keys()) == 1
+        assert len(test_sentinel.master.keys(memoized_keys)) == 1
 
         delete_succedeed = delete_memoized(my_func, 'arg', kwarg='kwarg')
         assert delete_succedeed is True, delete_succedeed
-        assert test_sentinel.master.keys() == [], 'Key was not deleted!'
+        assert test_sentinel.master.keys(memoized_keys) == [], 'Key was not deleted!'
 
 
     def test_delete_memoized_returns_false_when_delete_fails(self):
@@ -260,11 +273,11 @@ class TestCacheMemoizeFunctions(object):
         def my_func(*args, **kwargs):
             return [args, kwargs]
         my_func('arg', kwarg='kwarg')
-        assert len(test_sentinel.master.keys()) == 1
+        assert len(test_sentinel.master.keys(memoized_keys)) == 1
 
         delete_succedeed = delete_memoized(my_func, 'badarg', kwarg='barkwarg')
         assert delete_succedeed is False, delete_succedeed
-        assert len(test_sentinel.master.keys()) == 1, 'Key was unexpectedly deleted'
+        assert len(test_sentinel.master.keys(memoized_keys)) == 1, 'Key was unexpectedly deleted'
 
 
     def test_delete_memoized_deletes_only_requested(self):
@@ -276,11 +289,11 @@ class TestCacheMemoizeFunctions(object):
             return [args, kwargs]
         my_func('arg', kwarg='kwarg')
         my_func('other', kwarg='other')
-        assert len(test_sentinel.master.keys()) == 2
+        assert len(test_sentinel.master.keys(memoized_keys)) == 2
 
         delete_succedeed = delete_memoized(my_func, 'arg', kwarg='kwarg')
         assert delete_succedeed is True, delete_succedeed
-        assert len(test_sentinel.master.keys()) == 1, 'Everything was deleted!'
+        assert len(test_sentinel.master.keys(memoized_keys)) == 1, 'Everything was deleted!'
 
 
     def test_delete_memoized_deletes_all_function_calls(self):
@@ -296,8 +309,303 @@ class TestCacheMemoizeFunctions(object):
         my_func('arg', kwarg='kwarg')
         my_func('other', kwarg='other')
         my_other_func('arg', kwarg='kwarg')
-        assert len(test_sentinel.master.keys()) == 3
+        assert len(test_sentinel.master.keys(memoized_keys)) == 3
 
         delete_succedeed = delete_memoized(my_func)
         assert delete_succedeed is True, delete_succedeed
-        assert len(test_sentinel.master.keys()) == 1
+        assert len(test_sentinel.master.keys(memoized_keys)) == 1
+
+
+    def test_memoize_adds_keys_to_function_tag(self):
+        """Test CACHE memoize registers every stored key in the tag set of
+        the function"""
+
+        @memoize()
+        def my_func(*args, **kwargs):
+            return [args, kwargs]
+        my_func('arg')
+        my_func('other')
+        tag = get_tag_key('my_func')
+
+        members = test_sentinel.master.smembers(tag)
+        assert members == set(test_sentinel.master.keys(memoized_keys))
+        assert test_sentinel.master.ttl(tag) > 0
+
+
+    @patch('pybossa.cache.sentinel')
+    def test_delete_memoized_does_not_scan_keyspace(self, sentinel):
+        """Test CACHE delete_memoized deletes all the calls of a function
+        from its tag set instead of a KEYS scan"""
+
+        @memoize()
+        def my_func(*args, **kwargs):
+            return [args, kwargs]
+        sentinel.master = test_sentinel.master
+        sentinel.slave.get.return_value = None
+        my_func('arg')
+
+        assert delete_memoized(my_func) is True
+        assert not sentinel.slave.keys.called
+        assert test_sentinel.master.keys(memoized_keys) == []
+        assert not test_sentinel.master.exists(get_tag_key('my_func'))
+
+
+    def test_sweep_tags_removes_expired_keys(self):
+        """Test CACHE sweep_tags removes from the tag sets the keys that are
+        not in the cache anymore"""
+
+        @memoize()
+        def my_func(*args, **kwargs):
+            return [args, kwargs]
+        my_func('arg')
+        my_func('other')
+        key = test_sentinel.master.keys(memoized_keys)[0]
+        test_sentinel.master.delete(key)
+
+        assert sweep_tags() == 1
+        assert key not in test_sentinel.master.smembers(get_tag_key('my_func'))
+
+
+    def test_delete_legacy_keys_keeps_the_current_keys(self):
+        """Test CACHE delete_legacy_keys deletes only the keys of earlier
+        versions, which are in no tag set"""
+
+        @memoize()
+        def my_func(*args, **kwargs):
+            return [args, kwargs]
+        my_func('arg')
+        legacy_key = '%s:my_func_args:legacy' % REDIS_KEYPREFIX
+        test_sentinel.master.set(legacy_key, pickle.dumps('legacy'))
+
+        assert delete_legacy_keys() == 1
+        assert not test_sentinel.master.exists(legacy_key)
+        assert len(test_sentinel.master.keys(memoized_keys)) == 1
+
+
+    @patch('pybossa.cache.invalidation_listener')
+    def test_memoize_reads_local_cache_before_redis(self, listener):
+        """Test CACHE memoize serves values from the local cache without
+        calling Redis"""
+
+        @memoize(local_timeout=10)
+        def my_func(call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+        with patch('pybossa.cache.local_cache', new=LocalCache()):
+            my_func()
+            test_sentinel.master.flushall()
+
+            assert my_func() == 1
+            assert test_sentinel.master.keys() == []
+
+
+    @patch('pybossa.cache.invalidation_listener')
+    def test_delete_memoized_publishes_invalidation(self, listener):
+        """Test CACHE delete_memoized removes the local value and publishes
+        the invalidation for the other workers"""
+
+        @memoize(local_timeout=10)
+        def my_func(*args, **kwargs):
+            return [args, kwargs]
+        local = LocalCache()
+        with patch('pybossa.cache.local_cache', new=local):
+            pubsub = test_sentinel.master.pubsub()
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            my_func('arg')
+
+            delete_memoized(my_func)
+
+            assert len(local) == 0
+            for message in pubsub.listen():
+                if message['type'] == 'message':
+                    break
+            assert message['data'].startswith('prefix:'), message
+
+
+    def _store_entry(self, function_name, value, expires, *args):
+        key = "%s:%s_args:" % (KEY_PREFIX, function_name)
+        key = get_hash_key(key, get_key_to_hash(*args))
+        entry = CacheEntry(value, expires, 1)
+        test_sentinel.master.setex(key, 60, pickle.dumps(entry))
+        return key
+
+
+    def test_memoize_serves_stale_value_while_other_caller_refreshes(self):
+        """Test CACHE memoize returns the stale value without computing it if
+        another caller holds the refresh lock"""
+
+        @memoize(stale_timeout=60)
+        def my_func(arg):
+            return 'new'
+        key = self._store_entry('my_func', 'stale', time.time() - 1, 'arg')
+        test_sentinel.master.set(key + ':lock', 1)
+
+        assert my_func('arg') == 'stale'
+
+
+    def test_memoize_refreshes_stale_value(self):
+        """Test CACHE memoize recomputes a stale value if nobody else is"""
+
+        @memoize(stale_timeout=60)
+        def my_func(arg):
+            return 'new'
+        key = self._store_entry('my_func', 'stale', time.time() - 1, 'arg')
+
+        assert my_func('arg') == 'new'
+        assert decode(test_sentinel.master.get(key)).value == 'new'
+        assert not test_sentinel.master.exists(key + ':lock')
+
+
+    @patch('pybossa.cache.random')
+    def test_memoize_recomputes_early(self, random):
+        """Test CACHE memoize may recompute values about to expire"""
+
+        @memoize(early_recompute=1)
+        def my_func(arg):
+            return 'new'
+        self._store_entry('my_func', 'old', time.time() + 5, 'arg')
+        random.random.return_value = 0.999999
+
+        assert my_func('arg') == 'new'
+
+
+    @patch('pybossa.cache._wait_for')
+    def test_single_flight_waits_for_value_being_computed(self, wait_for):
+        """Test CACHE memoize with single_flight does not compute a missing
+        value another caller is already computing"""
+
+        @memoize(single_flight=True)
+        def my_func(arg):
+            raise AssertionError('should not be called')
+        key = "%s:%s_args:" % (KEY_PREFIX, 'my_func')
+        key = get_hash_key(key, get_key_to_hash('arg'))
+        test_sentinel.master.set(key + ':lock', 1)
+        wait_for.return_value = pickle.dumps(CacheEntry('computed', 0, 0))
+
+        assert my_func('arg') == 'computed'
+        wait_for.assert_called_once_with(key)
+
+
+    @patch('pybossa.cache.LOCK_WAIT', 0.1)
+    def test_single_flight_computes_value_after_waiting(self):
+        """Test CACHE memoize with single_flight computes the value if it is
+        not available after waiting"""
+
+        @memoize(single_flight=True)
+        def my_func(arg):
+            return 'computed'
+        key = "%s:%s_args:" % (KEY_PREFIX, 'my_func')
+        key = get_hash_key(key, get_key_to_hash('arg'))
+        test_sentinel.master.set(key + ':lock', 1)
+
+        assert my_func('arg') == 'computed'
+
+
+    def test_memoize_recomputes_values_with_unknown_format(self):
+        """Test CACHE memoize treats values in a format it can't read as
+        misses"""
+
+        @memoize()
+        def my_func(arg):
+            return 'computed'
+        key = "%s:%s_args:" % (KEY_PREFIX, 'my_func')
+        key = get_hash_key(key, get_key_to_hash('arg'))
+        test_sentinel.master.set(key, HEADER.pack(MAGIC, 99, 1, 0, 0, 0))
+
+        assert my_func('arg') == 'computed'
+
+
+    def test_get_memoized_many_returns_cached_and_computed_values(self):
+        """Test CACHE get_memoized_many returns cached values and computes
+        the missing ones in a single batch per function"""
+
+        @memoize()
+        def double(n):
+            return n * 2
+        batches = []
+        @double.many
+        def double_many(args_list):
+            batches.append(args_list)
+            return dict((args, args[0] * 2) for args in args_list)
+        double(1)
+
+        values = get_memoized_many([(double, (1,)), (double, (2,)),
+                                    (double, (3,))])
+
+        assert values == [2, 4, 6], values
+        assert batches == [[(2,), (3,)]], batches
+        assert len(test_sentinel.master.keys(memoized_keys)) == 3
+
+
+    def test_get_memoized_many_reads_values_with_one_mget(self):
+        """Test CACHE get_memoized_many reads every value at once"""
+
+        @memoize()
+        def double(n):
+            return n * 2
+        @memoize()
+        def triple(n):
+            return n * 3
+        double(1)
+        triple(1)
+
+        with patch('pybossa.cache.sentinel') as sentinel:
+            sentinel.slave.mget.side_effect = test_sentinel.slave.mget
+            values = get_memoized_many([(double, (1,)), (triple, (1,))])
+
+        assert values == [2, 3], values
+        assert sentinel.slave.mget.call_count == 1
+        assert not sentinel.slave.get.called
+        assert not sentinel.master.pipeline.called
+
+
+    def test_get_memoized_many_computes_misses_one_by_one_without_many(self):
+        """Test CACHE get_memoized_many calls the function for every miss if
+        it has no batch function"""
+
+        @memoize()
+        def double(n):
+            return n * 2
+
+        assert get_memoized_many([(double, (1,)), (double, (2,))]) == [2, 4]
+
+
+
+    def test_delete_memoized_many_deletes_values_and_tags(self):
+        """Test CACHE delete_memoized_many deletes the values of many calls
+        and removes them from their tag sets"""
+
+        @memoize()
+        def counter(project_id):
+            return project_id
+        counter(1)
+        counter(2)
+        counter(3)
+
+        delete_memoized_many([(counter, (1,)), (counter, (2,))])
+
+        assert test_sentinel.master.get(counter.cache_key(1)) is None
+        assert test_sentinel.master.get(counter.cache_key(2)) is None
+        tag = test_sentinel.master.smembers(get_tag_key('counter'))
+        assert tag == set([counter.cache_key(3)]), tag
+
+
+    def test_limit_memoized_brings_expiration_forward(self):
+        """Test CACHE limit_memoized only shortens expirations longer than the
+        limit"""
+
+        @memoize(timeout=100)
+        def slow(n):
+            return n
+        @memoize(timeout=5)
+        def fast(n):
+            return n
+        slow(1)
+        fast(1)
+
+        limited = limit_memoized([(slow, (1,)), (fast, (1,)), (slow, (2,))],
+                                 10)
+
+        assert limited == 1, limited
+        assert test_sentinel.master.ttl(slow.cache_key(1)) <= 10
+        assert test_sentinel.master.ttl(fast.cache_key(1)) <= 5
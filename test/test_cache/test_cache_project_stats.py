@@ -17,6 +17,9 @@
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
 from default import Test, with_context
+from mock import patch
+from pybossa.core import db
+from pybossa.activity import update_project_activity
 from pybossa.cache.project_stats import *
 from factories import UserFactory, ProjectFactory, TaskFactory, \
     TaskRunFactory, AnonymousTaskRunFactory
@@ -139,3 +142,55 @@ class TestProjectsStatsCache(Test):
         assert max_hours == 1
         assert max_hours_anon is None
         assert max_hours_auth == 1
+
+    @with_context
+    @patch('pybossa.cache.project_stats.task_run_users')
+    @patch('pybossa.cache.project_stats.hourly_activity')
+    def test_get_stats_reads_activity_once(self, hourly_activity,
+                                           task_run_users):
+        """Test CACHE PROJECT STATS get_stats computes hours and dates stats
+        from a single read of the hourly activity."""
+        pr = ProjectFactory.create()
+        hourly_activity.return_value = [(datetime.utcnow(), 2, 3)]
+        task_run_users.return_value = [(pr.owner_id, None, 3),
+                                       (None, '127.0.0.1', 2)]
+
+        dates_stats, hours_stats, users_stats = get_stats(pr.id)
+
+        hourly_activity.assert_called_once_with(pr.id, '2 week')
+        task_run_users.assert_called_once_with(pr.id, '2 week')
+        assert users_stats['n_auth'] == 1, users_stats
+        assert users_stats['n_anon'] == 1, users_stats
+        assert hours_stats[0]['max'] == 5, hours_stats
+
+    @with_context
+    def test_stats_hours_reads_rolled_up_activity(self):
+        """Test CACHE PROJECT STATS hours stats combine the hourly rollup with
+        the task runs submitted after it."""
+        pr = ProjectFactory.create()
+        earlier = datetime.utcnow() - timedelta(hours=3)
+        TaskRunFactory.create(project=pr, finish_time=earlier.isoformat())
+        update_project_activity(db.session)
+        # Only the rollup knows about the earlier answer now
+        db.session.execute('DELETE FROM task_run')
+        db.session.commit()
+        AnonymousTaskRunFactory.create(project=pr)
+
+        hours, hours_anon, hours_auth, max_hours, \
+            max_hours_anon, max_hours_auth = stats_hours(pr.id)
+
+        assert hours[earlier.strftime('%H')] == 1, hours
+        assert max_hours_anon == 1, hours_anon
+        assert max_hours_auth == 1, hours_auth
+
+    def test_stats_users_orders_users_by_answers(self):
+        """Test CACHE PROJECT STATS user stats are sorted by answers."""
+        pr = ProjectFactory.create()
+        users = UserFactory.create_batch(2)
+        TaskRunFactory.create(project=pr, user=users[0])
+        TaskRunFactory.create_batch(2, project=pr, user=users[1])
+
+        stats, anon_users, auth_users = stats_users(pr.id)
+
+        assert auth_users == [[users[1].id, 2], [users[0].id, 1]], auth_users
+        assert stats['n_auth'] == 2, stats
@@ -542,6 +542,27 @@ class TestProjectsCache(Test):
         assert activity == last_task_run.finish_time, last_task_run
 
 
+    def test_summaries_match_counters_of_every_project(self):
+        project = self.create_project_with_tasks(completed_tasks=1,
+                                                 ongoing_tasks=3)
+        empty_project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        TaskRunFactory.create(project=project, task=task)
+        AnonymousTaskRunFactory.create(project=project, task=task)
+
+        summaries = cached_projects.summaries([project.id, empty_project.id])
+
+        assert summaries[project.id]['n_tasks'] == 5, summaries
+        assert summaries[project.id]['overall_progress'] == \
+            cached_projects.overall_progress(project.id), summaries
+        assert summaries[project.id]['n_volunteers'] == 2, summaries
+        assert summaries[project.id]['last_activity_raw'] == \
+            cached_projects.last_activity(project.id), summaries
+        assert summaries[empty_project.id]['n_tasks'] == 0, summaries
+        assert summaries[empty_project.id]['n_volunteers'] == 0, summaries
+        assert summaries[empty_project.id]['last_activity_raw'] is None
+
+
     def test_n_published_counts_published_projects(self):
         published_project = ProjectFactory.create_batch(2, published=True)
         ProjectFactory.create(published=False)
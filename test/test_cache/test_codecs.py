@@ -0,0 +1,56 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from nose.tools import assert_raises
+from pybossa.cache.codecs import (CacheEntry, UnknownFormatError, HEADER,
+                                  MAGIC, encode, decode, benchmark)
+
+
+class TestCodecs(object):
+
+    def test_encode_decode_roundtrip(self):
+        entry = CacheEntry([{u'id': 1, u'info': u'ñ'}], 1000.5, 0.25)
+
+        for codec in ('pickle', 'json'):
+            assert decode(encode(entry, codec)) == entry, codec
+
+    def test_encode_compresses_values_above_threshold(self):
+        entry = CacheEntry('a' * 5000, 0, 0)
+
+        compressed = encode(entry, compress_threshold=1000)
+        plain = encode(entry, compress_threshold=None)
+
+        assert len(compressed) < len(plain)
+        assert decode(compressed) == decode(plain) == entry
+
+    def test_decode_raises_for_legacy_pickles(self):
+        assert_raises(UnknownFormatError, decode, 'S"value"\np0\n.')
+
+    def test_decode_raises_for_unknown_versions(self):
+        data = HEADER.pack(MAGIC, 99, 1, 0, 0, 0) + 'payload'
+
+        assert_raises(UnknownFormatError, decode, data)
+
+    def test_benchmark_reports_every_codec_and_legacy_pickle(self):
+        results = benchmark([{'id': i} for i in range(100)], number=1)
+
+        assert 'legacy' in results
+        assert 'pickle' in results
+        assert 'json' in results
+        assert set(results['pickle'].keys()) == set(['size', 'encode',
+                                                     'decode'])
@@ -0,0 +1,103 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import patch
+from pybossa.cache.local import LocalCache, InvalidationListener
+
+
+class TestLocalCache(object):
+
+    def setUp(self):
+        self.cache = LocalCache(max_entries=3, max_bytes=10)
+
+    def test_get_returns_stored_data(self):
+        self.cache.set('key', 'data', 10)
+
+        assert self.cache.get('key') == 'data'
+
+    @patch('pybossa.cache.local.time')
+    def test_get_returns_None_for_expired_entries(self, time):
+        time.time.return_value = 100
+        self.cache.set('key', 'data', 10)
+        time.time.return_value = 110
+
+        assert self.cache.get('key') is None
+        assert len(self.cache) == 0
+
+    def test_set_evicts_least_recently_used_entries(self):
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, '1', 10)
+        self.cache.get('a')
+
+        self.cache.set('d', '1', 10)
+
+        assert self.cache.get('b') is None
+        assert self.cache.get('a') == '1'
+
+    def test_set_evicts_entries_over_max_bytes(self):
+        self.cache.set('a', '12345', 10)
+        self.cache.set('b', '123456', 10)
+
+        assert self.cache.get('a') is None
+        assert self.cache.get('b') == '123456'
+
+    def test_set_ignores_data_bigger_than_max_bytes(self):
+        self.cache.set('a', '12345678901', 10)
+
+        assert len(self.cache) == 0
+
+    def test_delete_prefix(self):
+        self.cache.set('prefix:1', '1', 10)
+        self.cache.set('prefix:2', '2', 10)
+        self.cache.set('other', '3', 10)
+
+        self.cache.delete_prefix('prefix:')
+
+        assert len(self.cache) == 1
+        assert self.cache.get('other') == '3'
+
+
+class TestInvalidationListener(object):
+
+    def setUp(self):
+        self.cache = LocalCache()
+        self.listener = InvalidationListener(self.cache, 'channel')
+
+    def test_handle_deletes_key(self):
+        self.cache.set('my:key', 'data', 10)
+        self.cache.set('my:other', 'data', 10)
+
+        self.listener.handle(dict(type='message', data='key:my:key'))
+
+        assert self.cache.get('my:key') is None
+        assert self.cache.get('my:other') == 'data'
+
+    def test_handle_deletes_prefix(self):
+        self.cache.set('my:key', 'data', 10)
+        self.cache.set('my:other', 'data', 10)
+
+        self.listener.handle(dict(type='message', data='prefix:my:'))
+
+        assert len(self.cache) == 0
+
+    def test_handle_ignores_subscription_messages(self):
+        self.cache.set('my:key', 'data', 10)
+
+        self.listener.handle(dict(type='subscribe', data=1))
+
+        assert len(self.cache) == 1
@@ -19,6 +19,8 @@
 import datetime
 from default import Test
 from pybossa.cache import site_stats as stats
+from pybossa.core import db
+from pybossa.activity import update_project_activity
 from factories import (UserFactory, ProjectFactory, AnonymousTaskRunFactory,
     TaskRunFactory, TaskFactory)
 from mock import patch, Mock
@@ -96,6 +98,19 @@ class TestSiteStatsCache(Test):
         assert recently_contributed_project.id in top5_ids
         assert long_ago_contributed_project.id not in top5_ids
 
+    def test_get_top5_projects_24_hours_reads_rolled_up_activity(self):
+        project = ProjectFactory.create()
+        two_hours_ago = (datetime.datetime.utcnow() -
+                         datetime.timedelta(hours=2)).isoformat()
+        TaskRunFactory.create(project=project, finish_time=two_hours_ago)
+        update_project_activity(db.session)
+        TaskRunFactory.create(project=project)
+
+        top5 = stats.get_top5_projects_24_hours()
+
+        assert top5[0]['id'] == project.id, top5
+        assert top5[0]['n_answers'] == 2, top5
+
     def test_get_top5_projects_24_hours_returns_required_fields(self):
         fields = ('id', 'name', 'short_name', 'info', 'n_answers')
         TaskRunFactory.create()
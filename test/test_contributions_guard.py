@@ -62,6 +62,16 @@ class TestContributionsGuard(object):
 
         assert self.connection.get(key) == 'now'
 
+    def test_stamp_many_registers_all_tasks(self):
+        keys = ['pybossa:task_requested:user:33:task:22',
+                'pybossa:task_requested:user:33:task:23']
+
+        self.guard.stamp_many([self.task, Task(id=23)], self.auth_user)
+
+        for key in keys:
+            assert key in self.connection.keys(), self.connection.keys()
+            assert self.connection.ttl(key) == 60 * 60
+
     def test_check_task_stamped_returns_False_for_non_stamped_task(self):
         assert self.guard.check_task_stamped(self.task, self.auth_user) is False
 
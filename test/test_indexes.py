@@ -0,0 +1,91 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from default import Test, db, with_context, sql_statements
+from factories import (ProjectFactory, TaskFactory, TaskRunFactory,
+                       AnonymousTaskRunFactory, UserFactory)
+from pybossa import sched
+from pybossa.cache import helpers
+
+
+class TestSchedulerIndexes(Test):
+
+    """Check the scheduler hot queries are served by the indexes."""
+
+    def seed(self):
+        user = UserFactory.create()
+        project = ProjectFactory.create(owner=user)
+        tasks = TaskFactory.create_batch(20, project=project, n_answers=2)
+        for task in tasks[:5]:
+            TaskRunFactory.create(project=project, task=task, user=user)
+            AnonymousTaskRunFactory.create(project=project, task=task)
+        db.session.execute('ANALYZE')
+        return project, user
+
+    def explain(self, func, *args, **kwargs):
+        """Return the plans of the SELECT statements run by func."""
+        with sql_statements() as statements:
+            func(*args, **kwargs)
+        statements = [(statement, parameters)
+                      for statement, parameters in statements
+                      if statement.lstrip().upper().startswith('SELECT')]
+        plans = []
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            # Seeded tables are tiny, so force the planner to consider indexes
+            cursor.execute('SET enable_seqscan = off')
+            for statement, parameters in statements:
+                cursor.execute('EXPLAIN ' + statement, parameters)
+                plans.append('\n'.join(row[0] for row in cursor.fetchall()))
+        finally:
+            connection.close()
+        return '\n'.join(plans)
+
+    @with_context
+    def test_depth_first_uses_indexes(self):
+        """Test depth first scheduler uses the open tasks and task_run
+        indexes"""
+        project, user = self.seed()
+
+        plan = self.explain(sched.get_depth_first_task, project.id, user.id)
+        assert 'task_project_id_priority_0_id_open_idx' in plan, plan
+        assert 'task_run_project_id_user_id_task_id_idx' in plan, plan
+
+        plan = self.explain(sched.get_depth_first_task, project.id,
+                            user_ip='127.0.0.1')
+        assert 'task_project_id_priority_0_id_open_idx' in plan, plan
+        assert 'task_run_project_id_user_ip_task_id_idx' in plan, plan
+
+    @with_context
+    def test_breadth_first_uses_indexes(self):
+        """Test breadth first scheduler does not scan the task tables"""
+        project, user = self.seed()
+
+        plan = self.explain(sched.get_breadth_first_task, project.id, user.id)
+        assert 'Seq Scan' not in plan, plan
+        assert 'task_run_project_id_user_id_task_id_idx' in plan, plan
+
+    @with_context
+    def test_n_available_tasks_uses_indexes(self):
+        """Test n_available_tasks uses the task_run index"""
+        project, user = self.seed()
+
+        plan = self.explain(helpers.n_available_tasks, project.id,
+                            user_ip='127.0.0.1')
+        assert 'task_run_project_id_user_ip_task_id_idx' in plan, plan
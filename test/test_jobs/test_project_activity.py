@@ -0,0 +1,74 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta
+from pybossa.jobs import update_project_activity
+from pybossa.core import db
+from pybossa.model.project_activity_hourly import ProjectActivityHourly
+from default import Test, with_context
+from factories import ProjectFactory, TaskFactory
+from factories import TaskRunFactory, AnonymousTaskRunFactory
+
+
+class TestProjectActivity(Test):
+
+    def rollup(self):
+        return db.session.query(ProjectActivityHourly)\
+                 .order_by(ProjectActivityHourly.hour).all()
+
+    @with_context
+    def test_update_project_activity_rolls_up_task_runs_per_hour(self):
+        """Test JOB update_project_activity counts answers per hour."""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, n_answers=2)
+        earlier = datetime.utcnow() - timedelta(hours=5)
+        TaskRunFactory.create(project=project, task=task,
+                              finish_time=earlier.isoformat())
+        AnonymousTaskRunFactory.create(project=project, task=task)
+
+        update_project_activity()
+
+        rows = self.rollup()
+        assert len(rows) == 2, rows
+        assert rows[0].hour == earlier.replace(minute=0, second=0,
+                                               microsecond=0), rows[0].hour
+        assert (rows[0].n_auth, rows[0].n_anon) == (1, 0)
+        assert (rows[1].n_auth, rows[1].n_anon) == (0, 1)
+        assert rows[1].n_completed_tasks == 1, rows[1].n_completed_tasks
+
+    @with_context
+    def test_update_project_activity_extends_from_watermark(self):
+        """Test JOB update_project_activity recomputes only recent hours."""
+        project = ProjectFactory.create()
+        earlier = datetime.utcnow() - timedelta(hours=5)
+        TaskRunFactory.create(project=project,
+                              finish_time=earlier.isoformat())
+        update_project_activity()
+        # Old hours are not scanned again
+        db.session.execute('DELETE FROM task_run')
+        db.session.commit()
+        AnonymousTaskRunFactory.create(project=project)
+        AnonymousTaskRunFactory.create(project=project)
+
+        update_project_activity()
+        update_project_activity()
+
+        rows = self.rollup()
+        assert len(rows) == 2, rows
+        assert rows[0].n_auth == 1, rows[0].n_auth
+        assert rows[1].n_anon == 2, rows[1].n_anon
@@ -0,0 +1,139 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from pybossa.jobs import reconcile_project_counters
+from pybossa.core import db, task_repo, result_repo
+from pybossa.model.project_counters import ProjectCounters
+from default import Test, with_context
+from factories import ProjectFactory, TaskFactory, UserFactory
+from factories import TaskRunFactory, AnonymousTaskRunFactory
+
+
+class TestProjectCounters(Test):
+
+    def counters(self, project):
+        db.session.expire_all()
+        return db.session.query(ProjectCounters).get(project.id)
+
+    @with_context
+    def test_listeners_count_tasks_task_runs_and_results(self):
+        """Test project counters follow new tasks, task runs and results."""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, n_answers=2)
+        TaskFactory.create(project=project, state='completed')
+        user = UserFactory.create()
+        TaskRunFactory.create(project=project, task=task, user=user)
+        TaskRunFactory.create(project=project, task=task, user=user)
+        last = AnonymousTaskRunFactory.create(project=project, task=task)
+        result = result_repo.get_by(project_id=project.id)
+        result.info = dict(answer='yes')
+        result_repo.update(result)
+
+        counters = self.counters(project)
+
+        assert counters.n_tasks == 2, counters.n_tasks
+        assert counters.n_completed_tasks == 2, counters.n_completed_tasks
+        assert counters.n_task_runs == 3, counters.n_task_runs
+        assert counters.n_results == 1, counters.n_results
+        assert counters.n_registered_volunteers == 1
+        assert counters.n_anonymous_volunteers == 1
+        assert counters.last_activity == last.finish_time
+        assert reconcile_project_counters() == 0
+
+    @with_context
+    def test_deleting_tasks_recomputes_counters(self):
+        """Test project counters are recomputed when tasks are deleted."""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(2, project=project, n_answers=1)
+        TaskRunFactory.create(project=project, task=tasks[0])
+
+        task_repo.delete(tasks[0])
+
+        counters = self.counters(project)
+        assert counters.n_tasks == 1, counters.n_tasks
+        assert counters.n_completed_tasks == 0, counters.n_completed_tasks
+        assert counters.n_task_runs == 0, counters.n_task_runs
+        assert counters.n_registered_volunteers == 0
+        assert counters.last_activity is None
+
+    @with_context
+    def test_bulk_updates_recompute_counters(self):
+        """Test project counters follow the redundancy updates in bulk."""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, n_answers=2)
+        TaskRunFactory.create(project=project, task=task)
+
+        task_repo.update_tasks_redundancy(project, 1)
+
+        assert self.counters(project).n_completed_tasks == 1
+
+    @with_context
+    def test_reconcile_project_counters_repairs_drift(self):
+        """Test JOB reconcile_project_counters fixes counters that drifted."""
+        project = ProjectFactory.create()
+        TaskRunFactory.create(project=project)
+        other = ProjectFactory.create()
+        db.session.execute('DELETE FROM task_run')
+        db.session.execute('DELETE FROM project_counters WHERE project_id=%s'
+                           % other.id)
+        db.session.commit()
+
+        repaired = reconcile_project_counters()
+
+        # The counters of project and the n_task_runs of its task
+        assert repaired == 2, repaired
+        assert self.counters(project).n_task_runs == 0
+        assert self.counters(other).n_tasks == 0
+
+    @with_context
+    def test_reconcile_project_counters_repairs_task_n_task_runs(self):
+        """Test JOB reconcile_project_counters counts the task runs of tasks
+        not counted or that drifted."""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(2, project=project)
+        TaskRunFactory.create_batch(2, project=project, task=tasks[0])
+        TaskRunFactory.create(project=project, task=tasks[1])
+        db.session.execute('UPDATE task SET n_task_runs=NULL WHERE id=%s'
+                           % tasks[0].id)
+        db.session.execute('UPDATE task SET n_task_runs=5 WHERE id=%s'
+                           % tasks[1].id)
+        db.session.commit()
+
+        reconcile_project_counters()
+
+        db.session.expire_all()
+        assert task_repo.get_task(tasks[0].id).n_task_runs == 2
+        assert task_repo.get_task(tasks[1].id).n_task_runs == 1
+
+    @with_context
+    def test_task_runs_of_tasks_not_counted_yet_complete_them(self):
+        """Test a new task run counts all the task runs of a task whose
+        n_task_runs was not filled yet."""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, n_answers=2)
+        TaskRunFactory.create(project=project, task=task)
+        db.session.execute('UPDATE task SET n_task_runs=NULL WHERE id=%s'
+                           % task.id)
+        db.session.commit()
+
+        TaskRunFactory.create(project=project, task=task)
+
+        db.session.expire_all()
+        task = task_repo.get_task(task.id)
+        assert task.n_task_runs == 2, task.n_task_runs
+        assert task.state == 'completed', task.state
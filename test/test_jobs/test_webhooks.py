@@ -81,7 +81,7 @@ class TestWebHooks(Test):
         assert res.response_status_code is None, err_msg
 
     @with_context
-    @patch('pybossa.model.event_listeners.webhook_queue', new=queue)
+    @patch('pybossa.task_run_events.webhook_queue', new=queue)
     def test_trigger_webhook_without_url(self):
         """Test WEBHOOK is triggered without url."""
         project = ProjectFactory.create()
@@ -91,7 +91,7 @@ class TestWebHooks(Test):
         queue.reset_mock()
 
     @with_context
-    @patch('pybossa.model.event_listeners.webhook_queue', new=queue)
+    @patch('pybossa.task_run_events.webhook_queue', new=queue)
     def test_trigger_webhook_with_url_not_completed_task(self):
         """Test WEBHOOK is not triggered for uncompleted tasks."""
         import random
@@ -105,7 +105,7 @@ class TestWebHooks(Test):
 
 
     @with_context
-    @patch('pybossa.model.event_listeners.webhook_queue', new=queue)
+    @patch('pybossa.task_run_events.webhook_queue', new=queue)
     def test_trigger_webhook_with_url(self):
         """Test WEBHOOK is triggered with url."""
         url = 'http://server.com'
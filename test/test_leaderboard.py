@@ -0,0 +1,121 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import patch
+from redis import StrictRedis
+from default import Test, db, with_context
+from factories import ProjectFactory, TaskRunFactory, UserFactory
+from factories import AnonymousTaskRunFactory
+from pybossa.core import sentinel
+from pybossa.leaderboard import Leaderboard
+from pybossa.cache import users as cached_users
+
+
+class TestLeaderboard(object):
+
+    def setUp(self):
+        self.connection = StrictRedis()
+        self.connection.flushall()
+        self.leaderboard = Leaderboard(self.connection)
+
+    def test_top_ranks_tied_users_like_sql_rank(self):
+        for user_id, score in [(1, 5), (2, 3), (3, 3), (4, 1)]:
+            self.leaderboard.add(user_id, 1, score)
+
+        top = self.leaderboard.top(4)
+
+        assert top[0] == (1, 1, 5), top
+        assert sorted(top[1:3]) == [(2, 2, 3), (2, 3, 3)], top
+        assert top[3] == (4, 4, 1), top
+
+    def test_rank_and_score(self):
+        for user_id, score in [(1, 5), (2, 3), (3, 3), (4, 1)]:
+            self.leaderboard.add(user_id, 1, score)
+
+        assert self.leaderboard.rank_and_score(3) == (2, 3)
+        assert self.leaderboard.rank_and_score(4) == (4, 1)
+        assert self.leaderboard.rank_and_score(5) == (None, None)
+
+    def test_project_leaderboards_are_separate(self):
+        self.leaderboard.add(1, 1)
+        self.leaderboard.add(2, 2)
+        self.leaderboard.add(2, 2)
+
+        assert self.leaderboard.top(10, 1) == [(1, 1, 1)]
+        assert self.leaderboard.top(10, 2) == [(1, 2, 2)]
+        assert self.leaderboard.top(10) == [(1, 2, 2), (2, 1, 1)]
+
+
+class TestLeaderboardFeed(Test):
+
+    @with_context
+    def test_task_runs_of_registered_users_are_ranked(self):
+        """Test new task runs of registered users update the leaderboards."""
+        project = ProjectFactory.create()
+        user = UserFactory.create()
+        TaskRunFactory.create_batch(2, project=project, user=user)
+        AnonymousTaskRunFactory.create(project=project)
+
+        leaderboard = cached_users.get_leaderboard(10, project_id=project.id)
+
+        assert len(leaderboard) == 1, leaderboard
+        assert leaderboard[0]['id'] == user.id
+        assert leaderboard[0]['score'] == 2
+
+    @with_context
+    def test_rebuild_computes_leaderboards_from_task_runs(self):
+        """Test rebuild discounts the task runs deleted from the DB."""
+        project = ProjectFactory.create()
+        users = UserFactory.create_batch(2)
+        TaskRunFactory.create_batch(2, project=project, user=users[0])
+        TaskRunFactory.create(project=project, user=users[1])
+        db.session.execute('DELETE FROM task_run WHERE user_id=%s'
+                           % users[0].id)
+        db.session.commit()
+        leaderboard = Leaderboard(sentinel.master)
+
+        leaderboard.rebuild(db.session)
+
+        assert leaderboard.top(10) == [(1, users[1].id, 1)]
+        assert leaderboard.top(10, project.id) == [(1, users[1].id, 1)]
+        assert leaderboard.rank_and_score(users[0].id) == (None, None)
+
+    @with_context
+    def test_rebuild_keeps_task_runs_submitted_meanwhile(self):
+        """Test rebuild counts the task runs its snapshot missed once."""
+        project = ProjectFactory.create()
+        user = UserFactory.create()
+        task_run = TaskRunFactory.create(project=project, user=user)
+        leaderboard = Leaderboard(sentinel.master)
+        smembers = leaderboard.conn.smembers
+
+        def submit_while_rebuilding(key):
+            # Committed after the snapshot was taken
+            TaskRunFactory.create(project=project, user=user)
+            # Committed before it, but counted after the rebuild started
+            leaderboard.add(user.id, project.id, task_run_id=task_run.id)
+            return smembers(key)
+
+        with patch.object(leaderboard.conn, 'smembers',
+                          side_effect=submit_while_rebuilding):
+            leaderboard.rebuild(db.session)
+
+        assert leaderboard.top(10) == [(1, user.id, 2)], leaderboard.top(10)
+        assert leaderboard.top(10, project.id) == [(1, user.id, 2)]
+        assert not sentinel.master.exists(Leaderboard.DELTA_KEY)
+        assert not sentinel.master.exists(Leaderboard.REBUILDING_KEY)
@@ -16,10 +16,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
-from default import Test, with_context
+from default import Test, db, with_context
 from mock import patch, MagicMock
 from pybossa.model.event_listeners import *
 from pybossa.jobs import notify_blog_users
+from factories import ProjectFactory, TaskFactory, TaskRunFactory
 
 
 """Tests for model event listeners."""
@@ -95,3 +96,61 @@ class TestModelEventListeners(Test):
         conn.execute.return_value = [tmp]
         add_user_event(None, conn, target)
         assert mock_update_feed.called
+
+    @with_context
+    @patch('pybossa.model.event_listeners.cached_projects')
+    def test_task_run_updates_cache_after_commit(self, cached_projects):
+        """Test new task runs update the project cache once committed."""
+        task = TaskFactory.create(n_answers=2)
+
+        TaskRunFactory.create(task=task)
+        TaskRunFactory.create(task=task)
+
+        cached_projects.task_created.assert_called_with(task.project_id,
+                                                        False)
+        cached_projects.task_run_created.assert_called_with(
+            task.project_id, True)
+        assert cached_projects.task_run_created.call_count == 2
+
+    @with_context
+    @patch('pybossa.model.event_listeners.leaderboard')
+    @patch('pybossa.model.event_listeners.cached_projects')
+    def test_failing_cache_update_does_not_fail_commit(self, cached_projects,
+                                                       leaderboard):
+        """Test a cache update failing after the commit is logged, and the
+        other updates are still applied."""
+        task = TaskFactory.create()
+        cached_projects.task_run_created.side_effect = Exception('down')
+
+        task_run = TaskRunFactory.create(task=task)
+
+        assert task_run.id is not None
+        assert leaderboard.add_task_run.called
+
+    @with_context
+    @patch('pybossa.model.event_listeners.cached_projects')
+    def test_rolled_back_changes_do_not_update_cache(self, cached_projects):
+        """Test changes rolled back are not applied to the cache."""
+        project = ProjectFactory.create()
+        db.session.add(Task(project_id=project.id, info={}))
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+
+        assert not cached_projects.task_created.called
+
+    @with_context
+    def test_extra_task_run_creates_new_result_version(self):
+        """Test answers beyond n_answers replace the result of the task."""
+        task = TaskFactory.create(n_answers=1)
+        first = TaskRunFactory.create(task=task)
+        second = TaskRunFactory.create(task=task)
+
+        results = db.session.query(Result).filter_by(task_id=task.id).all()
+        latest = [result for result in results if result.last_version]
+
+        assert task.state == 'completed'
+        assert task.n_task_runs == 2, task.n_task_runs
+        assert len(results) == 2, results
+        assert len(latest) == 1, latest
+        assert latest[0].task_run_ids == [first.id, second.id]
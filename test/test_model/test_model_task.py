@@ -23,6 +23,7 @@ from pybossa.model.user import User
 from pybossa.model.project import Project
 from pybossa.model.task import Task
 from pybossa.model.category import Category
+from factories import TaskFactory, TaskRunFactory
 
 
 class TestModelTask(Test):
@@ -49,3 +50,19 @@ class TestModelTask(Test):
         db.session.add(task)
         assert_raises(IntegrityError, db.session.commit)
         db.session.rollback()
+
+
+    @with_context
+    def test_task_n_task_runs_is_updated_on_taskrun_insert_and_delete(self):
+        """Test TASK n_task_runs counter follows the task runs of the task."""
+        task = TaskFactory.create(n_answers=3)
+        task_runs = TaskRunFactory.create_batch(2, task=task)
+        db.session.refresh(task)
+
+        assert task.n_task_runs == 2, task.n_task_runs
+
+        db.session.delete(task_runs[0])
+        db.session.commit()
+        db.session.refresh(task)
+
+        assert task.n_task_runs == 1, task.n_task_runs
@@ -16,14 +16,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
+from datetime import datetime
 from default import Test, db, with_context
 from nose.tools import assert_raises
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import text
 from pybossa.model.user import User
 from pybossa.model.project import Project
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
 from pybossa.model.category import Category
+from factories import TaskRunFactory
 
 
 class TestModelTaskRun(Test):
@@ -59,3 +62,32 @@ class TestModelTaskRun(Test):
         db.session.add(task_run)
         assert_raises(IntegrityError, db.session.commit)
         db.session.rollback()
+
+    @with_context
+    def test_task_run_finish_time_ts(self):
+        """Test TASK_RUN finish_time_ts is a timestamp copy of finish_time."""
+        task_run = TaskRunFactory.create(
+            finish_time='2015-12-24T10:20:30.123456')
+
+        assert task_run.finish_time_ts == datetime(2015, 12, 24, 10, 20, 30,
+                                                   123456)
+        assert 'finish_time_ts' not in task_run.dictize()
+
+        task_run.finish_time = '2016-01-01T00:00:00'
+        db.session.commit()
+
+        assert task_run.finish_time_ts == datetime(2016, 1, 1)
+
+    @with_context
+    def test_task_run_finish_time_ts_set_by_the_db(self):
+        """Test TASK_RUN finish_time_ts is set for rows inserted with SQL."""
+        task_run = TaskRunFactory.create()
+        sql = text('''INSERT INTO task_run (project_id, task_id, finish_time)
+                   VALUES (:project_id, :task_id, :finish_time)
+                   RETURNING finish_time_ts''')
+
+        finish_time_ts = db.session.execute(sql, dict(
+            project_id=task_run.project_id, task_id=task_run.task_id,
+            finish_time='2015-12-24T10:20:30.123456')).scalar()
+
+        assert finish_time_ts == datetime(2015, 12, 24, 10, 20, 30, 123456)
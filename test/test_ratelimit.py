@@ -24,9 +24,10 @@ API endpoints like userprogress or vmcp.
 """
 import json
 
-from default import flask_app, sentinel
+from default import Test, flask_app, sentinel, with_context
 from factories import ProjectFactory, UserFactory
-from mock import patch
+from mock import patch, MagicMock
+from pybossa.ratelimit import RateLimit, get_engine, local_blocks
 
 
 class TestAPI(object):
@@ -138,3 +139,58 @@ class TestAPI(object):
 
         url = '/api/project/1/userprogress'
         self.check_limit(url, 'get', 'project')
+
+
+class TestRateLimitEngines(Test):
+
+    def setUp(self):
+        super(TestRateLimitEngines, self).setUp()
+        self.redis_flushall()
+        local_blocks.clear()
+
+    def hits(self, n, engine, limit=3):
+        return [RateLimit('rate-limit/test/', limit, 60, True,
+                          engine=get_engine(engine)) for i in range(n)]
+
+    @with_context
+    def test_sliding_window_counts_like_the_fixed_window(self):
+        """Test the sliding window rejects the request that uses the limit."""
+        limits = self.hits(4, 'sliding_window')
+
+        assert [l.remaining for l in limits] == [2, 1, 0, 0]
+        assert [l.over_limit for l in limits] == [False, False, True, True]
+        assert sentinel.master.zcard('rate-limit/test/') == 3
+
+    @with_context
+    def test_token_bucket_allows_bursts_up_to_the_limit(self):
+        """Test the token bucket allows as many requests as tokens."""
+        limits = self.hits(4, 'token_bucket')
+
+        assert [l.remaining for l in limits] == [2, 1, 0, 0]
+        assert [l.over_limit for l in limits] == [False, False, False, True]
+        assert limits[-1].retry_at > limits[-1].reset - 60
+
+    @with_context
+    @patch.dict(flask_app.config, {'RATE_LIMIT_LOCAL_CHECK': True})
+    def test_local_check_rejects_blocked_clients_without_redis(self):
+        """Test clients over the limit are rejected locally until retry."""
+        over_limit = self.hits(3, 'sliding_window')[-1]
+        engine = MagicMock()
+
+        limit = RateLimit('rate-limit/test/', 3, 60, True, engine=engine)
+
+        assert limit.over_limit
+        assert limit.remaining == 0
+        assert limit.reset == over_limit.reset
+        assert not engine.hit.called
+
+    def test_authenticated_requests_are_limited_by_user(self):
+        """Test requests with an API key are counted for the user."""
+        user = UserFactory.create()
+
+        res = self.app.get('/api/project?api_key=%s' % user.api_key)
+
+        remaining = flask_app.config['LIMIT'] - 1
+        assert int(res.headers['X-RateLimit-Remaining']) == remaining
+        keys = sentinel.master.keys('rate-limit/*/user:%s/' % user.id)
+        assert len(keys) == 1, keys
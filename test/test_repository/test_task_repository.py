@@ -17,7 +17,7 @@
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 # Cache global variables for timeouts
 
-from default import Test, db
+from default import Test, db, sql_statements
 from nose.tools import assert_raises
 from factories import TaskFactory, TaskRunFactory, ProjectFactory
 from pybossa.repositories import TaskRepository, ProjectRepository
@@ -52,6 +52,18 @@ class TestTaskRepositoryForTaskQueries(Test):
         assert task == retrieved_task, retrieved_task
 
 
+    def test_get_task_for_update_locks_the_task(self):
+        """Test get_task with for_update selects the task FOR UPDATE"""
+
+        task = TaskFactory.create()
+
+        with sql_statements() as statements:
+            retrieved_task = self.task_repo.get_task(task.id, for_update=True)
+
+        assert task == retrieved_task, retrieved_task
+        assert 'FOR UPDATE' in statements[-1][0], statements
+
+
     def test_get_task_by(self):
         """Test get_task_by returns a task with the specified attribute"""
 
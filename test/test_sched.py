@@ -23,6 +23,7 @@ from mock import patch
 
 from helper import sched
 from default import Test, db, with_context
+from pybossa.core import sentinel, task_repo
 from pybossa.model.task import Task
 from pybossa.model.project import Project
 from pybossa.model.user import User
@@ -338,6 +339,72 @@ class TestSched(sched.Helper):
         assert data['project_id'] == project_id, err_msg
         assert data['id'] == tasks[10].id, err_msg
 
+    @with_context
+    def test_task_pool_is_loaded_on_first_request(self):
+        """Test SCHED loads the pool of open tasks when it is enabled"""
+        project = ProjectFactory.create()
+        TaskFactory.create_batch(2, project=project)
+        key = 'pybossa:task_pool:project:%s' % project.id
+
+        with patch.dict(self.flask_app.config, {'TASK_POOL': True}):
+            res = self.app.get('api/project/%s/newtask' % project.id)
+
+        assert json.loads(res.data).get('id') is not None, res.data
+        assert sentinel.master.zcard(key) == 3, sentinel.master.zrange(key, 0, -1)
+
+    @with_context
+    def test_task_pool_respects_priority_and_answers(self):
+        """Test SCHED with the pool of open tasks respects priority_0 and does
+        not return tasks already answered by the user"""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(3, project=project, n_answers=2)
+        url = 'api/project/%s/newtask' % project.id
+
+        with patch.dict(self.flask_app.config, {'TASK_POOL': True}):
+            res = self.app.get(url)
+            assert json.loads(res.data)['id'] == tasks[0].id, res.data
+
+            AnonymousTaskRunFactory.create(project=project, task=tasks[0])
+            res = self.app.get(url)
+            assert json.loads(res.data)['id'] == tasks[1].id, res.data
+
+            tasks[2].priority_0 = 1
+            task_repo.update(tasks[2])
+            res = self.app.get(url)
+            assert json.loads(res.data)['id'] == tasks[2].id, res.data
+
+    @with_context
+    def test_locked_sched_reserves_tasks(self):
+        """Test SCHED locked does not give a task to more users than its
+        n_answers while the reservations last"""
+        project = ProjectFactory.create(info={'sched': 'locked'})
+        tasks = TaskFactory.create_batch(2, project=project, n_answers=1)
+        url = 'api/project/%s/newtask' % project.id
+
+        res = self.app.get(url, environ_base={'REMOTE_ADDR': '1.1.1.1'})
+        assert json.loads(res.data)['id'] == tasks[0].id, res.data
+        res = self.app.get(url, environ_base={'REMOTE_ADDR': '2.2.2.2'})
+        assert json.loads(res.data)['id'] == tasks[1].id, res.data
+        res = self.app.get(url, environ_base={'REMOTE_ADDR': '3.3.3.3'})
+        assert json.loads(res.data) == {}, res.data
+        # The same user keeps its reservation
+        res = self.app.get(url, environ_base={'REMOTE_ADDR': '1.1.1.1'})
+        assert json.loads(res.data)['id'] == tasks[0].id, res.data
+
+    @with_context
+    def test_locked_sched_releases_task_on_submit(self):
+        """Test SCHED locked releases the reservation when the user submits
+        a task run"""
+        project = ProjectFactory.create(info={'sched': 'locked'})
+        task = TaskFactory.create(project=project, n_answers=2)
+        key = 'pybossa:task_locked:task:%s' % task.id
+
+        self.app.get('api/project/%s/newtask' % project.id)
+        assert sentinel.master.zcard(key) == 1
+
+        AnonymousTaskRunFactory.create(project=project, task=task)
+        assert sentinel.master.zcard(key) == 0
+
 
 class TestGetBreadthFirst(Test):
     def setUp(self):
@@ -349,6 +416,8 @@ class TestGetBreadthFirst(Test):
     def del_task_runs(self, project_id=1):
         """Deletes all TaskRuns for a given project_id"""
         db.session.query(TaskRun).filter_by(project_id=1).delete()
+        db.session.query(Task).filter_by(project_id=1).update(
+            {'n_task_runs': 0})
         db.session.commit()
         db.session.remove()
 
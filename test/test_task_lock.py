@@ -0,0 +1,93 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from redis import StrictRedis
+import time
+from mock import patch
+from pybossa.task_lock import TaskLock
+
+
+class TestTaskLock(object):
+
+    def setUp(self):
+        self.connection = StrictRedis()
+        self.connection.flushall()
+        self.lock = TaskLock(self.connection, ttl=10)
+        self.anon_user = {'user_id': None, 'user_ip': '127.0.0.1'}
+        self.auth_user = {'user_id': 33, 'user_ip': None}
+
+    def test_acquire_reserves_task_for_user(self):
+        assert self.lock.acquire(1, self.auth_user, 1, 0) is True
+
+        assert self.lock.count(1) == 1
+
+    def test_acquire_fails_if_task_is_fully_reserved(self):
+        self.lock.acquire(1, self.auth_user, 1, 0)
+
+        assert self.lock.acquire(1, self.anon_user, 1, 0) is False
+
+    def test_acquire_takes_into_account_submitted_task_runs(self):
+        self.lock.acquire(1, self.auth_user, 2, 0)
+
+        assert self.lock.acquire(1, self.anon_user, 2, 1) is False
+
+    def test_acquire_succeeds_again_for_user_holding_reservation(self):
+        self.lock.acquire(1, self.auth_user, 1, 0)
+
+        assert self.lock.acquire(1, self.auth_user, 1, 0) is True
+        assert self.lock.count(1) == 1
+
+    def test_acquire_ignores_expired_reservations(self):
+        self.lock.acquire(1, self.auth_user, 1, 0)
+
+        with patch('pybossa.task_lock.time.time') as now:
+            now.return_value = time.time() + 11
+            assert self.lock.acquire(1, self.anon_user, 1, 0) is True
+
+    def test_release_frees_reservation(self):
+        self.lock.acquire(1, self.auth_user, 1, 0)
+
+        self.lock.release(1, self.auth_user)
+
+        assert self.lock.count(1) == 0
+        assert self.lock.acquire(1, self.anon_user, 1, 0) is True
+
+    def test_reservations_key_expires(self):
+        self.lock.acquire(1, self.auth_user, 1, 0)
+
+        assert 0 < self.connection.ttl(TaskLock.KEY_PREFIX % 1) <= 10
+
+    def test_acquire_many_reserves_up_to_limit_available_tasks(self):
+        self.lock.acquire(2, self.anon_user, 1, 0)
+        candidates = [(1, 1, 0), (2, 1, 0), (3, 2, 2), (4, 1, 0), (5, 1, 0)]
+
+        reserved = self.lock.acquire_many(candidates, self.auth_user,
+                                          limit=2)
+
+        assert reserved == [1, 4], reserved
+        assert self.lock.count(5) == 0
+
+    def test_acquire_many_skips_offset_tasks_without_reserving_them(self):
+        candidates = [(1, 1, 0), (2, 1, 0), (3, 1, 0)]
+
+        reserved = self.lock.acquire_many(candidates, self.auth_user,
+                                          offset=1, limit=1)
+
+        assert reserved == [2], reserved
+        assert self.lock.count(1) == 0
+        assert self.lock.count(3) == 0
@@ -0,0 +1,118 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from redis import StrictRedis
+from pybossa.task_pool import TaskPool
+
+
+class TestTaskPool(object):
+
+    def setUp(self):
+        self.connection = StrictRedis()
+        self.connection.flushall()
+        self.pool = TaskPool(self.connection)
+        self.anon_user = {'user_id': None, 'user_ip': '127.0.0.1'}
+        self.auth_user = {'user_id': 33, 'user_ip': None}
+
+    def test_candidates_returns_None_if_pool_is_not_loaded(self):
+        self.pool.load_user(1, self.auth_user, [])
+
+        assert self.pool.candidates(1, self.auth_user) is None
+
+    def test_candidates_returns_None_if_user_is_not_loaded(self):
+        self.pool.load(1, [(1, 0)])
+
+        assert self.pool.candidates(1, self.auth_user) is None
+
+    def test_candidates_returns_empty_list_for_loaded_empty_pool(self):
+        self.pool.load(1, [])
+        self.pool.load_user(1, self.auth_user, [])
+
+        assert self.pool.candidates(1, self.auth_user) == []
+
+    def test_candidates_are_sorted_by_priority_and_id(self):
+        self.pool.load(1, [(3, 0), (2, 0.5), (11, 0), (1, 0)])
+        self.pool.load_user(1, self.anon_user, [])
+
+        candidates = self.pool.candidates(1, self.anon_user)
+
+        assert candidates == [2, 1, 3, 11], candidates
+
+    def test_candidates_excludes_tasks_contributed_by_user(self):
+        self.pool.load(1, [(1, 0), (2, 0), (3, 0)])
+        self.pool.load_user(1, self.auth_user, [1, 3])
+
+        assert self.pool.candidates(1, self.auth_user) == [2]
+
+    def test_candidates_respects_limit(self):
+        self.pool.load(1, [(i, 0) for i in range(1, 30)])
+        self.pool.load_user(1, self.auth_user, [])
+
+        candidates = self.pool.candidates(1, self.auth_user, limit=5)
+
+        assert candidates == [1, 2, 3, 4, 5], candidates
+
+    def test_candidates_skips_contributed_tasks_across_batches(self):
+        self.pool.BATCH_SIZE = 2
+        self.pool.load(1, [(i, 0) for i in range(1, 6)])
+        self.pool.load_user(1, self.auth_user, [1, 2, 3])
+
+        assert self.pool.candidates(1, self.auth_user) == [4, 5]
+
+    def test_add_task_only_updates_loaded_pools(self):
+        self.pool.add_task(1, 1, 0)
+
+        assert not self.pool.is_loaded(1)
+
+    def test_add_task_updates_priority(self):
+        self.pool.load(1, [(1, 0), (2, 0)])
+        self.pool.load_user(1, self.auth_user, [])
+
+        self.pool.add_task(1, 2, 1)
+
+        assert self.pool.candidates(1, self.auth_user) == [2, 1]
+
+    def test_remove_task(self):
+        self.pool.load(1, [(1, 0), (2, 0)])
+        self.pool.load_user(1, self.auth_user, [])
+
+        self.pool.remove_task(1, 1)
+
+        assert self.pool.candidates(1, self.auth_user) == [2]
+
+    def test_add_contribution_only_updates_loaded_users(self):
+        self.pool.add_contribution(1, 1, self.anon_user)
+
+        assert not self.pool.is_user_loaded(1, self.anon_user)
+
+    def test_add_contribution_excludes_task_for_that_user_only(self):
+        self.pool.load(1, [(1, 0), (2, 0)])
+        self.pool.load_user(1, self.auth_user, [])
+        self.pool.load_user(1, self.anon_user, [])
+
+        self.pool.add_contribution(1, 1, self.anon_user)
+
+        assert self.pool.candidates(1, self.anon_user) == [2]
+        assert self.pool.candidates(1, self.auth_user) == [1, 2]
+
+    def test_invalidate(self):
+        self.pool.load(1, [(1, 0)])
+
+        self.pool.invalidate(1)
+
+        assert not self.pool.is_loaded(1)
@@ -0,0 +1,98 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from mock import patch
+from default import Test, db, with_context
+from factories import ProjectFactory, TaskFactory, TaskRunFactory
+from pybossa.core import sentinel
+from pybossa.model.task_run import TaskRun
+from pybossa.feed import get_update_feed
+from pybossa.task_run_events import TaskRunEvents
+
+
+class TestTaskRunEvents(Test):
+
+    def setUp(self):
+        super(TestTaskRunEvents, self).setUp()
+        self.events = TaskRunEvents(sentinel.master)
+
+    @with_context
+    @patch('pybossa.task_run_events.events_queue')
+    @patch('pybossa.task_run_events.use_async', return_value=True)
+    def test_events_are_queued_and_applied_by_the_job(self, use_async,
+                                                      events_queue):
+        """Test queued events schedule a single job that applies them."""
+        task = TaskFactory.create(n_answers=2)
+        TaskRunFactory.create_batch(2, project=task.project, task=task)
+
+        assert get_update_feed()[0]['action_updated'] == 'Task'
+        assert sentinel.master.llen(self.events.KEY) == 2
+        assert events_queue.enqueue.call_count == 1
+
+        n_events = self.events.process(db.session)
+
+        feed = get_update_feed()
+        assert n_events == 2, n_events
+        assert feed[0]['action_updated'] == 'TaskCompleted', feed[0]
+        assert feed[1]['action_updated'] == 'UserContribution', feed[1]
+        assert sentinel.master.llen(self.events.KEY) == 0
+        assert not sentinel.master.exists(self.events.PROCESSING_KEY)
+
+    @with_context
+    @patch('pybossa.task_run_events.events_queue')
+    def test_events_delivered_twice_are_applied_once(self, events_queue):
+        """Test queued events already applied are skipped."""
+        project = ProjectFactory.create()
+        event = dict(task_run_id=1, project_id=project.id, task_id=1,
+                     user_id=None, completed=True, result_id=1)
+
+        self.events.push([event])
+        assert self.events.process(db.session) == 1
+        self.events.push([event])
+        assert self.events.process(db.session) == 0
+
+    @with_context
+    @patch('pybossa.task_run_events.TaskRunEvents.apply')
+    def test_events_of_a_commit_are_applied_together(self, apply):
+        """Test the events of the task runs of a commit are applied at once,
+        without idempotency keys."""
+        task = TaskFactory.create(n_answers=2)
+        db.session.add_all([TaskRun(project_id=task.project_id,
+                                    task_id=task.id, user_ip=ip)
+                            for ip in ('1.1.1.1', '2.2.2.2')])
+        db.session.commit()
+
+        assert apply.call_count == 1, apply.call_args_list
+        assert len(apply.call_args[0][1]) == 2, apply.call_args
+        assert not sentinel.master.keys('pybossa:task_run_events:applied:*')
+
+    @with_context
+    @patch('pybossa.task_run_events.webhook_queue')
+    def test_batches_left_by_a_dead_worker_are_applied(self, webhook_queue):
+        """Test events moved to processing but never applied are retried."""
+        project = ProjectFactory.create(webhook='http://server.com')
+        event = dict(task_run_id=1, project_id=project.id, task_id=1,
+                     user_id=None, completed=True, result_id=1)
+        sentinel.master.rpush(self.events.PROCESSING_KEY, json.dumps(event))
+
+        n_events = self.events.process(db.session)
+
+        assert n_events == 1, n_events
+        assert webhook_queue.enqueue.called
+        assert not sentinel.master.exists(self.events.PROCESSING_KEY)
@@ -0,0 +1,112 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta
+from mock import patch
+from redis import StrictRedis
+from default import Test, db, flask_app, with_context
+from factories import ProjectFactory, TaskRunFactory, AnonymousTaskRunFactory
+from pybossa.core import sentinel
+from pybossa.volunteer_counter import VolunteerCounter
+from pybossa.cache import site_stats
+from pybossa.cache import projects as cached_projects
+from pybossa.dashboard.data import format_anon_week
+
+
+class TestVolunteerCounter(object):
+
+    def setUp(self):
+        self.connection = StrictRedis()
+        self.connection.flushall()
+        self.counter = VolunteerCounter(self.connection)
+
+    def test_count_distinct_volunteers_per_project_and_site(self):
+        self.counter.add(1, 10, None)
+        self.counter.add(1, 10, None)
+        self.counter.add(1, 11, None)
+        self.counter.add(2, 10, None)
+        self.counter.add(2, None, '127.0.0.1')
+
+        assert self.counter.count('registered', 1) == 2
+        assert self.counter.count('registered', 2) == 1
+        assert self.counter.count('anonymous', 2) == 1
+        assert self.counter.count('anonymous') == 1
+
+    def test_count_per_day_of_the_site(self):
+        today = datetime.utcnow().date()
+        self.counter.add(1, None, '127.0.0.1', today)
+        self.counter.add(2, None, '127.0.0.1', today)
+        self.counter.add(1, None, '127.0.0.2', today - timedelta(days=2))
+        self.counter.add(1, None, '127.0.0.3', today - timedelta(days=9))
+
+        days = self.counter.count_per_day('anonymous', 8)
+
+        assert days == [(today - timedelta(days=2), 1), (today, 1)], days
+
+    def test_task_runs_with_user_and_ip_are_not_counted(self):
+        self.counter.add(1, 10, '127.0.0.1')
+
+        assert self.counter.count('registered', 1) == 0
+        assert self.counter.count('anonymous', 1) == 0
+
+
+class TestVolunteerCounterFeed(Test):
+
+    @with_context
+    @patch.dict(flask_app.config, {'APPROXIMATE_VOLUNTEERS': True})
+    def test_task_runs_are_added_once_committed(self):
+        """Test new task runs feed the HyperLogLogs."""
+        project = ProjectFactory.create()
+        AnonymousTaskRunFactory.create(project=project)
+        AnonymousTaskRunFactory.create(project=project, user_ip='127.0.0.2')
+        TaskRunFactory.create(project=project)
+
+        counter = VolunteerCounter(sentinel.master)
+
+        assert counter.count('anonymous', project.id) == 2
+        assert counter.count('registered', project.id) == 1
+        assert site_stats.n_anon_users(approximate=True) == 2
+        assert cached_projects.n_anonymous_volunteers(project.id) == 2
+        assert cached_projects.n_registered_volunteers(project.id) == 1
+        week = format_anon_week(approximate=True)
+        assert week['series'] == [[2]], week
+
+    @with_context
+    def test_task_runs_are_not_added_when_disabled(self):
+        """Test task runs don't feed the HyperLogLogs by default."""
+        AnonymousTaskRunFactory.create()
+
+        assert not sentinel.master.keys('pybossa:volunteers:*')
+
+    @with_context
+    def test_backfill_adds_existing_task_runs(self):
+        """Test backfill adds the volunteers of the task runs in the DB."""
+        project = ProjectFactory.create()
+        AnonymousTaskRunFactory.create(project=project)
+        TaskRunFactory.create(project=project)
+        self.redis_flushall()
+        counter = VolunteerCounter(sentinel.master)
+
+        n_rows = counter.backfill(db.session)
+
+        assert n_rows == 2, n_rows
+        assert counter.count('anonymous', project.id) == 1
+        assert counter.count('registered', project.id) == 1
+        assert counter.count('anonymous') == 1
+        assert counter.count_per_day('registered', 1) == [
+            (datetime.utcnow().date(), 1)]